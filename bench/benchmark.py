@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Benchmarks for selecting variables (over), querying them (Query) and running
+# the whole action (ActionModule#run) against synthetic variable trees.
+#
+# Run with bin/benchmark; see --help for the parameters of the trees. Results
+# can be saved as a JSON baseline and later runs compared against it:
+#
+#     bin/benchmark --save baseline.json
+#     bin/benchmark --compare baseline.json
+#
+# Comparing exits with a non-zero status if any benchmark got slower than the
+# baseline by more than the tolerance.
+#
+# Every benchmark is measured three ways:
+#
+# - cold: with every cache of the module cleared before each run
+# - warm: keeping what was compiled (selectors, predicates, ...) but not the
+#   results of rules and conditions, so every rule is evaluated again
+# - cached: keeping everything, so rules are looked up from earlier runs
+
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'library', 'action_plugins'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test'))
+
+import ansible # pylint: disable=wrong-import-position
+import lint_arguments # pylint: disable=wrong-import-position
+import lint_predicates # pylint: disable=wrong-import-position
+import lint_query # pylint: disable=wrong-import-position
+import lint_rules # pylint: disable=wrong-import-position
+import lint_variables # pylint: disable=wrong-import-position
+from test_utils import create_action_module, create_query # pylint: disable=wrong-import-position
+
+CONDITIONS = [
+  u"item is not number or item < 1024",
+  u"item | string | length > 8",
+  u"captures | length == 0 or captures[0] not in allowed_keys",
+  u"item | string is search('deprecated')",
+]
+
+# (int, int, Random): dict
+#
+# A tree of nested dicts that is depth levels deep and has fan_out keys at every
+# level. Leaves are either numbers or strings.
+def generate_tree(depth, fan_out, rng):
+  if depth == 0:
+    if rng.random() < 0.5:
+      return rng.randint(1, 65535)
+    else:
+      return u'value-%d' % rng.randint(0, 1000)
+
+  return {
+    u'k%d' % index: generate_tree(depth - 1, fan_out, rng) for index in range(fan_out)
+  }
+
+# (int, Namespace): dict
+#
+# The variables of a host. Hosts with the same seed have identical variables.
+def generate_host_vars(seed, options):
+  rng = random.Random(seed)
+
+  return {
+    u'tree': generate_tree(options.depth, options.fan_out, rng),
+    u'allowed_keys': [ u'k%d' % index for index in range(0, options.fan_out, 2) ],
+  }
+
+# (Namespace): list
+#
+# Rules of every state that select the tree at every depth, with a glob at
+# every level or only some of them.
+def generate_rules(options):
+  rules = []
+
+  for index in range(options.rules):
+    depth = 1 + index % options.depth
+    segments = [ u'*' if (index + level) % 3 else u'k%d' % (level % options.fan_out) for level in range(depth) ]
+    path = u'.'.join([ u'tree' ] + segments)
+    state = [ u'required', u'invalid', u'deprecated', u'suspicious' ][index % 4]
+    rule = { u'state': state, u'path': path }
+
+    if state != u'required':
+      rule[u'when'] = CONDITIONS[index % len(CONDITIONS)]
+
+    rules.append(rule)
+
+  return rules
+
+# (bool): None
+#
+# Forget everything the module has cached in the process, or only the results
+# of the rules and conditions it evaluated.
+def clear_caches(results_only=False):
+  results = (
+    lint_rules.RULES_FILE_RESULTS,
+    lint_query.RULE_RESULTS,
+    lint_query.PREDICATE_RESULTS,
+  )
+
+  for cache in results:
+    cache.clear()
+
+  if results_only:
+    return
+
+  lint_variables.SELECTORS.clear()
+
+  for cache in (
+    lint_predicates.PREDICATES,
+    lint_rules.RULES_FILE_SOURCES,
+    lint_rules.RULES_BUNDLES,
+    lint_arguments.VALIDATED_ARGUMENTS,
+  ):
+    cache.clear()
+
+# (function, int, string): dict
+#
+# Time a function over several runs in one of the modes described at the top.
+def measure(f, repeat, mode):
+  timings = []
+
+  if mode != 'cold':
+    f()
+
+  for _ in range(repeat):
+    if mode == 'cold':
+      clear_caches()
+    elif mode == 'warm':
+      clear_caches(results_only=True)
+
+    started_at = timer()
+    f()
+    timings.append(timer() - started_at)
+
+  return {
+    'min': min(timings),
+    'mean': sum(timings) / len(timings),
+    'runs': len(timings),
+  }
+
+def benchmark_over(hosts, rules):
+  def run():
+    for task_vars in hosts:
+      for rule in rules:
+        lint_variables.over(rule['path'], task_vars)
+
+  return run
+
+def benchmark_over_all(hosts, rules):
+  def run():
+    for task_vars in hosts:
+      lint_variables.over_all([ x['path'] for x in rules ], task_vars)
+
+  return run
+
+def benchmark_query(hosts, rules):
+  def run():
+    for task_vars in hosts:
+      for rule in rules:
+        query = create_query(task_vars).select(rule['path'])
+
+        if rule.get('when'):
+          query = query.where(rule['when'])
+
+        query.commit()
+
+  return run
+
+def benchmark_run(hosts, rules, **args):
+  def run():
+    for task_vars in hosts:
+      module = create_action_module('lint', dict(args, rules=rules), task_vars)
+      module.run(None, task_vars=task_vars)
+
+  return run
+
+# (Namespace): dict
+def run_benchmarks(options):
+  hosts = [
+    generate_host_vars(index % options.distinct_hosts, options)
+    for index in range(options.hosts)
+  ]
+
+  rules = generate_rules(options)
+  benchmarks = [
+    ('over', benchmark_over(hosts, rules)),
+    ('over_all', benchmark_over_all(hosts, rules)),
+    ('query', benchmark_query(hosts, rules)),
+    ('run', benchmark_run(hosts, rules)),
+    ('run_fail_fast', benchmark_run(hosts, rules, fail_fast=True)),
+  ]
+
+  results = {}
+
+  for name, f in benchmarks:
+    if options.only and name not in options.only:
+      continue
+
+    for mode in ('cold', 'warm', 'cached'):
+      key = '%s.%s' % (name, mode)
+      results[key] = measure(f, options.repeat, mode)
+
+      print('%-24s min %10.6fs  mean %10.6fs' % (key, results[key]['min'], results[key]['mean']))
+
+  return {
+    'parameters': {
+      'depth': options.depth,
+      'fan_out': options.fan_out,
+      'hosts': options.hosts,
+      'distinct_hosts': options.distinct_hosts,
+      'rules': options.rules,
+      'repeat': options.repeat,
+    },
+    'environment': {
+      'python': platform.python_version(),
+      'ansible': ansible.__version__,
+    },
+    'results': results,
+  }
+
+# (dict, dict, float): bool
+#
+# Print how every benchmark fares against the baseline and whether it got slower
+# than the tolerance allows. Benchmarks are compared by their best run.
+def compare(report, baseline, tolerance):
+  ok = True
+
+  if report['parameters'] != baseline.get('parameters'):
+    print('warning: the baseline was recorded with different parameters: %s' % json.dumps(baseline.get('parameters')))
+
+  for key in sorted(report['results']):
+    if key not in baseline.get('results', {}):
+      continue
+
+    ratio = report['results'][key]['min'] / max(baseline['results'][key]['min'], 1e-9)
+    regressed = ratio > tolerance
+    ok = ok and not regressed
+
+    print('%-24s %6.2fx%s' % (key, ratio, '  REGRESSED' if regressed else ''))
+
+  return ok
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Benchmark the lint action plugin.')
+  parser.add_argument('--depth', type=int, default=3, help='levels of nesting of the variable tree')
+  parser.add_argument('--fan-out', type=int, default=8, help='keys at every level of the variable tree')
+  parser.add_argument('--hosts', type=int, default=4, help='number of hosts to lint')
+  parser.add_argument('--distinct-hosts', type=int, default=None,
+                      help='number of hosts with distinct variables (defaults to all of them)')
+  parser.add_argument('--rules', type=int, default=20, help='number of rules')
+  parser.add_argument('--repeat', type=int, default=5, help='number of runs of every benchmark')
+  parser.add_argument('--only', action='append', help='run only the named benchmark (may be repeated)')
+  parser.add_argument('--save', metavar='FILE', help='save the results as a JSON baseline')
+  parser.add_argument('--compare', metavar='FILE', help='compare the results against a JSON baseline')
+  parser.add_argument('--tolerance', type=float, default=1.25,
+                      help='how many times slower than the baseline a benchmark may get')
+
+  options = parser.parse_args(argv)
+  options.distinct_hosts = options.distinct_hosts or options.hosts
+
+  report = run_benchmarks(options)
+
+  if options.save:
+    with open(options.save, 'w') as fh:
+      json.dump(report, fh, indent=2, sort_keys=True)
+
+  if options.compare:
+    with open(options.compare, 'r') as fh:
+      baseline = json.load(fh)
+
+    if not compare(report, baseline, options.tolerance):
+      return 1
+
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -7,83 +7,60 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type # pylint: disable=invalid-name
 
+import json
+import multiprocessing
+import os
+import sys
+from collections import OrderedDict
+from timeit import default_timer as timer
 from six import string_types
-from textwrap import TextWrapper
 from ansible import constants as C
-from ansible.errors import AnsibleAction, AnsibleActionFail, AnsibleError, AnsibleFileNotFound, AnsibleOptionsError
-from ansible.module_utils._text import to_bytes, to_native, to_text
-from ansible.module_utils.basic import AnsibleModule
-from ansible.playbook.conditional import Conditional
-from ansible.plugins.action import ActionBase
+from ansible.errors import AnsibleActionFail, AnsibleError
+from ansible.module_utils._text import to_native, to_text
 from ansible.parsing.utils.yaml import from_yaml
+from ansible.plugins.action import ActionBase
+from ansible.template import Templar
+from ansible.vars.hostvars import HostVars
+
+# The rest of the plugin is made of the lint_* modules next to this file, which
+# Ansible does not put on the import path when it loads an action plugin.
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+
+if PLUGIN_DIR not in sys.path:
+  sys.path.insert(0, PLUGIN_DIR)
+
+# pylint: disable=wrong-import-position
+from lint_arguments import validate_args
+from lint_check import check_inventory
+from lint_predicates import compile_predicate
+from lint_query import ConditionCollector, Query, RULE_RESULTS, ResultStore, estimate_rule_cost, evaluate_shard, fingerprint_rule_definition, initialize_worker
+from lint_reports import RULE_SPECS, create_issue_report, format_hint, get_global_display, is_summary_callback_enabled, report_to_display
+from lint_rules import ARGUMENT_SPEC, RulesBundle, RulesBundleLoader, YAMLFileLoader
+from lint_variables import DeferredValue, KeyFilter, UnfingerprintableValue, VariableOverlay, compile_selector, descend_into, fingerprint, fingerprint_subtree, isbranch, over_all
+# pylint: enable=wrong-import-position
 
 # pylint: disable=too-few-public-methods
 class ActionModule(ActionBase):
   TRANSFERS_FILES = False
-  RULE_SPECS = {
-    'deprecated': {
-      'banner': u'The following variables have been deprecated:',
-      'banner_color': C.COLOR_WARN,
-      'ignore_errors': True,
-    },
-
-    'required': {
-      'banner': u'The following variables are required but missing:',
-      'banner_color': C.COLOR_ERROR,
-      'ignore_errors': False,
-    },
-
-    'invalid': {
-      'banner': u'The following variables are invalid:',
-      'banner_color': C.COLOR_ERROR,
-      'ignore_errors': False,
-    },
-
-    'suspicious': {
-      'banner': u'The following variables *may* be invalid:',
-      'banner_color': C.COLOR_WARN,
-      'ignore_errors': True,
-    }
-  }
+  SHARD_SIZE = 1024
+  RULE_SPECS = RULE_SPECS
+  ARGUMENT_SPEC = ARGUMENT_SPEC
 
   def __init__(self, *args, **kwargs):
     super(ActionModule, self).__init__(*args, **kwargs)
     self.display = None
+    self.run_id = None
+    self.summary = None
+    self._result_store = None
+    self._fingerprints = None
 
-  def run(self, tmp=None, task_vars=None):
+  def run(self, tmp=None, task_vars=None): # pylint: disable=too-many-locals
     if task_vars is None:
       task_vars = dict() # pragma: no cover
 
-    argument_error = validate_args(dict(
-      lint = dict(
-        type='dict',
-        required_one_of=[
-          [ 'rules_file', 'rules' ],
-        ],
-        options=dict(
-          pool = dict(type='list', default=[], elements='dict'),
-          rules_file = dict(type='path', default=None),
-          rules = dict(
-            type='list',
-            default=None,
-            required_if=[
-              [ 'state', 'invalid', [ 'when' ] ],
-              [ 'state', 'suspicious', [ 'when' ] ],
-            ],
-            elements='dict',
-            options=dict(
-              state=dict(type='str', choices=self.RULE_SPECS.keys(), required=True),
-              path=dict(type='str', required=True),
-              hint=dict(type='str', aliases=['msg']),
-              hint_wrap=dict(type='bool', default=True),
-              banner=dict(type='str', default=None),
-              banner_color=dict(type='str', default=None),
-              when=dict(type='str'),
-            )
-          )
-        )
-      )
-    ), { 'lint' : self._task.args })
+    started_at = timer()
+    argument_error = validate_args(self.ARGUMENT_SPEC, { 'lint' : self._task.args })
+    totals = { 'validation': timer() - started_at }
 
     if argument_error:
       return { "failed": True, "msg": argument_error }
@@ -92,386 +69,818 @@ class ActionModule(ActionBase):
     result['issues'] = []
     result['failed'] = False
 
-    rules = self._task.args['rules'] or []
-
-    if self._task.args['rules_file']:
-      rules = YAMLFileLoader(
-        loader=self._loader,
-        templar=self._templar,
-        find_needle=self._find_needle
-      ).load_file(self._task.args['rules_file'])
-
+    started_at = timer()
+    rules = self._load_rules()
+    totals['loading'] = timer() - started_at
+    started_at = timer()
     target_vars, target_vars_error = self._collect_target_vars(task_vars)
+    totals['pool'] = timer() - started_at
 
     if target_vars_error:
       return target_vars_error
 
-    issues = self._identify_issues(rules, target_vars, task_vars)
+    if self._task.args['cache_dir']:
+      self._result_store = ResultStore(self._task.args['cache_dir'])
+
+    report = None
+
+    if self._task.args['report_file']:
+      try:
+        report = create_issue_report(
+          self._task.args['report_file'],
+          self._task.args['report_format'],
+          self.run_id or self._task._uuid, # pylint: disable=protected-access
+          task_vars.get('inventory_hostname'),
+          rules
+        )
+      except (IOError, OSError) as e:
+        return { "failed": True, "msg": "Unable to open report file: %s" % to_native(e) }
+
+    cache_stats = {}
+    stats = { 'totals': totals } if self._task.args['stats'] else None
+    unevaluated = []
+    groups = [] if (self.summary if self.summary is not None else is_summary_callback_enabled()) else None
+
+    try:
+      issues = self._identify_issues(
+        rules,
+        target_vars,
+        task_vars,
+        cache_stats,
+        fail_fast=self._task.args['fail_fast'],
+        unevaluated=unevaluated,
+        stats=stats,
+        workers=self._task.args['workers'],
+        max_items_per_rule=self._task.args['max_items_per_rule'],
+        report=report,
+        groups=groups
+      )
+    finally:
+      if report is not None:
+        report.close()
+
+    if self._result_store is not None:
+      self._result_store.prune()
 
     result['rule_count'] = len(rules)
-    result['issues'] = sorted(issues, key=lambda x: x['path'])
-    result['failed'] = bool([
-      x for x
-      in result['issues']
-      if not self.RULE_SPECS[x['type']]['ignore_errors']
-    ])
+    result['cache'] = cache_stats
+    result['unevaluated_rules'] = [ x + 1 for x in unevaluated ]
+
+    if stats is not None:
+      result['stats'] = stats
+
+    if groups is not None:
+      result['grouped_issues'] = groups
+
+    self._add_issues(result, issues, report)
 
     return result
 
   def use_display(self, display):
     self.display = display
 
+  # Hosts share a report file for as long as they report the same run, which
+  # is the task by default (see IssueReport.)
+  def use_run_id(self, run_id):
+    self.run_id = run_id
+
+  # Whether to leave the issues to the lint_summary callback plugin, instead of
+  # finding out whether it is loaded (see lint_reports#is_summary_callback_enabled.)
+  def use_summary(self, summary):
+    self.summary = summary
+
   # ------------------------------------------------------------------------------
   # INTERNAL
   # ------------------------------------------------------------------------------
 
-  def _identify_issues(self, rules, target_vars, task_vars):
-    rule_specs = self.RULE_SPECS
+  # (): list
+  #
+  # The rules of the task: those given inline, or the ones in its rules file or
+  # rules bundle.
+  def _load_rules(self):
+    if self._task.args['rules_file']:
+      return YAMLFileLoader(
+        loader=self._loader,
+        templar=self._templar,
+        find_needle=self._find_needle
+      ).load_file(self._task.args['rules_file'])
+    elif self._task.args['rules_bundle']:
+      bundle = RulesBundleLoader(
+        loader=self._loader,
+        find_needle=self._find_needle
+      ).load_file(self._task.args['rules_bundle'])
+
+      bundle.install(templar=self._templar)
+
+      return bundle.rules
+
+    return self._task.args['rules'] or []
+
+  # (dict, list, IssueReport?): None
+  #
+  # List the issues in the result, or where they were written to and how many
+  # there are if they went to a report, and fail it if any of them is an error.
+  def _add_issues(self, result, issues, report):
+    if report is not None:
+      del result['issues']
+      result['report_file'] = report.file_name
+      result['issue_count'] = sum(report.counts.values())
+      result['failed'] = any(
+        count for state, count in report.counts.items()
+        if not self.RULE_SPECS[state]['ignore_errors']
+      )
+    else:
+      result['issues'] = sorted(issues, key=lambda x: x['path'])
+      result['failed'] = bool([
+        x for x
+        in result['issues']
+        if not self.RULE_SPECS[x['type']]['ignore_errors']
+      ])
+
+  # Rules whose inputs are identical to those of a rule evaluated earlier in the
+  # process (e.g. for another host) reuse its result instead of being evaluated
+  # again; see #_fingerprint_rule. The outcome of the lookups is tallied in
+  # cache_stats. The hashes of the inputs are memoized for the duration of the
+  # evaluation only.
+  #
+  # In fail_fast mode only the rules that can fail the task are evaluated, and
+  # only up to the first issue found; the indices of the rules that were not
+  # evaluated are added to unevaluated.
+  #
+  # If a stats dict is given, the time spent in every phase is added to its
+  # "totals" and a breakdown of the work done for every rule that was
+  # evaluated is listed under "rules" (see #_create_rule_stats.)
+  #
+  # With more than one worker, rules are evaluated by a pool of processes where
+  # possible (see #_create_shards); that does not apply in fail_fast mode where
+  # rules are evaluated one after the other.
+  #
+  # Issues are reported to the display a rule at a time, listing no more than
+  # max_items_per_rule of them (all of them if 0); the result lists every one,
+  # unless they are written to a report (see IssueReport) instead, which is done
+  # as soon as each rule is evaluated.
+  #
+  # If a groups list is given, the issues are added to it a rule at a time for
+  # the lint_summary callback to print rather than reported to the display.
+  # pylint: disable=too-many-arguments,too-many-locals,too-many-branches
+  def _identify_issues(self, rules, target_vars, task_vars, cache_stats=None, fail_fast=False,
+                       unevaluated=None, stats=None, workers=0, max_items_per_rule=0, report=None,
+                       groups=None):
+    cache_stats = cache_stats if cache_stats is not None else {}
+    unevaluated = unevaluated if unevaluated is not None else []
+    rule_stats = None
     issues = []
 
-    for rule_index, rule in enumerate(rules):
-      query = Query(target_vars, task_vars, self._loader, self._templar)
-      query = query.select(rule['path'])
-      query = getattr(self, '_identify_%s' % rule['state'])(rule, query)
+    for key in ('hits', 'misses', 'uncacheable'):
+      cache_stats.setdefault(key, 0)
 
-      items = query.commit()
+    if stats is not None:
+      stats.setdefault('totals', {})
+      rule_stats = [ self._create_rule_stats(index, rule) for index, rule in enumerate(rules) ]
 
-      issues += [{ 'type': rule['state'], 'path': x['path'] } for x in items]
+    started_at = timer()
+    key_filters = [ self._create_key_filter(rule, task_vars) for rule in rules ]
+    schedule = self._schedule_rules(rules, target_vars, fail_fast, key_filters)
 
-      if items:
-        report_to_display(
-          display=self.display or get_global_display(),
-          hint=rule.get('hint', None),
-          hint_wrap=rule.get('hint_wrap'),
-          banner=rule.get('banner') or rule_specs[rule['state']]['banner'],
-          banner_color=rule.get('banner_color') or rule_specs[rule['state']]['banner_color'],
-          group_index=rule_index,
-          group_items=sorted(items, key=lambda x: x['path'])
+    if stats is not None:
+      stats['totals']['scheduling'] = timer() - started_at
+
+    started_at = timer()
+    on_result = report.write if report is not None else None
+    self._fingerprints = {}
+
+    try:
+      if fail_fast:
+        rule_items = self._identify_first_issue(
+          rules, schedule, target_vars, task_vars, cache_stats, rule_stats, key_filters, on_result
+        )
+      else:
+        rule_items = self._identify_all_issues(
+          rules, schedule, target_vars, task_vars, cache_stats, rule_stats, workers, key_filters, on_result
         )
+    finally:
+      self._fingerprints = None
 
-    return issues
+    if stats is not None:
+      stats['totals']['evaluation'] = timer() - started_at
+      stats['rules'] = [
+        x for index, x in enumerate(rule_stats) if rule_items[index] is not None
+      ]
 
-  # Mark specified variables as having been deprecated.
-  #
-  # pylint: disable=unused-argument
-  def _identify_deprecated(self, rule, query):
-    without_nils = query.where('item != ""')
+    for rule_index, rule in enumerate(rules):
+      items = rule_items[rule_index]
 
-    if not rule.get('when', None):
-      return without_nils
+      if items is None:
+        unevaluated.append(rule_index)
+        continue
 
-    return query.where(rule['when'])
+      if report is None:
+        issues += [{ 'type': rule['state'], 'path': x['path'] } for x in items]
 
-  # Fail if any of the specified variables is undefined.
-  #
-  # pylint: disable=unused-argument
-  def _identify_required(self, rule, query):
-    return query.where('item == ""')
+      if rule_stats is not None:
+        rule_stats[rule_index]['issues'] = len(items)
 
-  # Fail if any of the specified variables matches the specified condition.
-  #
-  # pylint: disable=unused-argument
-  def _identify_invalid(self, rule, query):
-    return query.where(rule['when'])
+      if items:
+        self._present_issues(rule_index, rule, items, max_items_per_rule, groups)
 
-  # Fail if any of the specified variables matches the specified condition.
+    return issues
+
+  # (int, dict, list, int, list?): None
   #
-  # pylint: disable=unused-argument
-  def _identify_suspicious(self, rule, query):
-    return query.where(rule['when'])
+  # Hand the issues of a rule over to the lint_summary callback by adding them
+  # to groups, if given, or print them.
+  def _present_issues(self, rule_index, rule, items, max_items_per_rule, groups):
+    banner = rule.get('banner') or self.RULE_SPECS[rule['state']]['banner']
+    banner_color = rule.get('banner_color') or self.RULE_SPECS[rule['state']]['banner_color']
+
+    if groups is not None:
+      groups.append({
+        'rule': rule_index + 1,
+        'state': rule['state'],
+        'banner': banner,
+        'banner_color': banner_color,
+        'hint': rule.get('hint', None),
+        'hint_wrap': rule.get('hint_wrap'),
+        'hint_text': format_hint(rule['hint'], rule.get('hint_wrap'), rule_index) if rule.get('hint') else None,
+        'max_items': max_items_per_rule,
+        'paths': sorted(x['path'] for x in items),
+      })
+    else:
+      report_to_display(
+        display=self.display or get_global_display(),
+        hint=rule.get('hint', None),
+        hint_wrap=rule.get('hint_wrap'),
+        banner=banner,
+        banner_color=banner_color,
+        group_index=rule_index,
+        group_items=sorted(items, key=lambda x: x['path']),
+        max_items=max_items_per_rule
+      )
 
-  def _collect_target_vars(self, task_vars):
-    if self._task.args['pool']:
-      pool = {}
+  # (list, list, dict, dict, dict, list?, int, list?, function?): list
+  #
+  # Evaluate every rule, selecting the variables for all of them in one walk.
+  # Produces the items each rule applies to, in the order of the rules; the
+  # on_result function, if any, is called with the index and items of every
+  # rule as soon as they are known.
+  # pylint: disable=too-many-arguments,too-many-locals
+  def _identify_all_issues(self, rules, schedule, target_vars, task_vars, cache_stats, rule_stats=None,
+                           workers=0, key_filters=None, on_result=None):
+    key_filters = key_filters or [ None ] * len(rules)
+    rule_keys = [
+      self._fingerprint_rule(rule, target_vars, task_vars, key_filters[index])
+      for index, rule in enumerate(rules)
+    ]
+    rule_items = [
+      self._lookup_rule_result(key, cache_stats, None if rule_stats is None else rule_stats[index])
+      for index, key in enumerate(rule_keys)
+    ]
+
+    pending = [ index for index in schedule if rule_items[index] is None ]
+
+    if on_result is not None:
+      for rule_index in schedule:
+        if rule_items[rule_index] is not None:
+          on_result(rule_index, rule_items[rule_index])
+
+    selections = over_all([ rules[x]['path'] for x in pending ], target_vars, [ key_filters[x] for x in pending ])
+    shards = self._create_shards(rules, pending, selections, task_vars, workers) if workers > 1 else {}
+    pool = None
+
+    def finish(rule_index, items, seconds):
+      if rule_stats is not None:
+        rule_stats[rule_index]['time'] = seconds
+
+      self._store_rule_result(rule_keys[rule_index], items)
+
+      rule_items[rule_index] = items
+
+      if on_result is not None:
+        on_result(rule_index, items)
 
-      for var in self._task.args['pool']:
-        if isinstance(var, string_types):
-          pool.update(task_vars[var])
-        elif isinstance(var, dict):
-          pool.update(var)
-        else:
-          return None, {
-            "failed": True,
-            "msg": (
-              "Unrecognized pool variable type: expected a dict or " +
-              "a string but got \"{}\".".format(type(var))
-            )
-          }
+    try:
+      if shards:
+        pool = multiprocessing.Pool(processes=workers, initializer=initialize_worker)
+        shard_results = pool.map_async(evaluate_shard, [ x for xs in shards.values() for x in xs ])
 
-      return pool, None
-    else:
-      return task_vars, None
+      # evaluate what can not be sent to the workers in the meantime
+      for rule_index, selection in zip(pending, selections):
+        if rule_index in shards:
+          continue
 
-# ------------------------------------------------------------------------------
-# INTERNAL
-# ------------------------------------------------------------------------------
+        started_at = timer()
+        stats = None if rule_stats is None else rule_stats[rule_index]
+        items = self._create_rule_query(rules[rule_index], target_vars, task_vars, selection, stats).commit()
 
-class YAMLFileLoader():
-  def __init__(self, loader, templar, find_needle):
-    self._loader = loader
-    self._templar = templar
-    self._find_needle = find_needle
+        finish(rule_index, items, timer() - started_at)
 
-  def load_file(self, file_name):
-    try:
-      source = self._find_needle('files', file_name)
-    except AnsibleError as e:
-      raise AnsibleActionFail(to_text(e))
+      if shards:
+        shard_results = iter(shard_results.get())
 
-    # Get vault decrypted tmp file
-    try:
-      tmp_source = self._loader.get_real_file(source)
-    except AnsibleFileNotFound as e: # pragma: no cover
-      raise AnsibleActionFail("could not find src=%s, %s" % (source, to_text(e))) # pragma: no cover
+        for rule_index, selection in zip(pending, selections):
+          if rule_index not in shards:
+            continue
 
-    b_tmp_source = to_bytes(tmp_source, errors='surrogate_or_strict')
+          items, seconds = self._merge_shard_results(
+            selection,
+            [ next(shard_results) for _ in shards[rule_index] ],
+            None if rule_stats is None else rule_stats[rule_index]
+          )
 
-    # template the source data locally & get ready to transfer
-    try:
-      with open(b_tmp_source, 'rb') as f:
-        template_data = to_text(f.read(), errors='surrogate_or_strict')
-    except AnsibleAction: # pragma: no cover
-      raise # pragma: no cover
-    except Exception as e: # pragma: no cover
-      raise AnsibleActionFail("%s: %s" % (type(e).__name__, to_text(e))) # pragma: no cover
+          finish(rule_index, items, seconds)
     finally:
-      self._loader.cleanup_tmp_file(b_tmp_source)
+      if pool is not None:
+        pool.terminate()
+        pool.join()
 
-    templated = self._templar.do_template(
-      template_data,
-      preserve_trailing_newlines=True,
-      escape_backslashes=False
-    )
+    return rule_items
 
-    return from_yaml(data=templated, file_name=file_name)
+  # (list, list, dict?): (list, float)
+  #
+  # Put the items of a rule back together from what its shards selected, in the
+  # order of the selection. The time the shards took and the work they did is
+  # added up into stats, if given.
+  @staticmethod
+  def _merge_shard_results(selection, shard_results, stats=None):
+    selected = set()
+    seconds = 0.0
 
+    for paths, shard_stats in shard_results:
+      selected.update(paths)
+      seconds += shard_stats.pop('time')
 
-# A somewhat declarative interface for selecting variables
-class Query():
-  def __init__(self, target_vars, task_vars, loader, templar):
-    self._target_vars = target_vars
-    self._task_vars = task_vars.copy()
-    self._loader = loader
-    self._templar = templar
-    self._pipeline = []
+      if stats is not None:
+        stats['shards'] += 1
 
-  # (string): Query
-  #
-  # Select one or more deeply nested variables by a dot-delimited path. Supports
-  # glob expressions.
-  #
-  # Examples
-  # --------
+        for key, value in shard_stats.items():
+          stats[key] += value
+
+    return [ x for x in selection if x['path'] in selected ], seconds
+
+  # (list, list, list, dict, int): OrderedDict
   #
-  #     select('foo')       # the top-level variable "foo"
-  #     select('foo.*')     # direct descendants of "foo"
-  #     select('foo.*.bar') # "bar" property of direct descendants of "foo"
-  #     select('*')         # all top-level variables
+  # Split the selections of the rules into shards that can be evaluated by a
+  # pool of worker processes. A shard carries what it takes to evaluate a
+  # rule's conditions for a slice of its items: the steps of the query, the
+  # items, and the values of the (other) variables the conditions read.
   #
-  # Glob expressions
-  # ----------------
+  # Rules are left out, and evaluated in-process instead, if their conditions
+  # may read more than that (e.g. they call lookups) or if any of the values
+  # involved is not plain data, such as a template that would need all of the
+  # host variables to resolve. Selections are sliced so that every worker gets
+  # a share, but never into slices smaller than SHARD_SIZE; a selection that
+  # fits in a single slice is not worth sending and is left out as well, so no
+  # pool is started unless at least one rule is split.
   #
-  # When a glob expression (*) is specified, an entry will still be constructed
-  # for __every__ leaf covered by the path even if it does not exist. For
-  # example, consider the following struct:
+  # Produces the shards of every rule that can be sent, keyed by its index.
+  def _create_shards(self, rules, pending, selections, task_vars, workers):
+    shards = OrderedDict()
+
+    for rule_index, selection in zip(pending, selections):
+      if len(selection) <= self.SHARD_SIZE:
+        continue
+
+      rule = rules[rule_index]
+      collector = getattr(self, '_identify_%s' % rule['state'])(rule, ConditionCollector())
+      variables = self._collect_portable_variables(collector.conditions, task_vars)
+
+      if variables is None:
+        continue
+
+      try:
+        fingerprint_subtree([ x['value'] for x in selection ], self._templar, self._fingerprints)
+      except UnfingerprintableValue:
+        continue
+
+      size = max(self.SHARD_SIZE, -(-len(selection) // workers))
+      shards[rule_index] = [
+        {
+          'steps': collector.steps,
+          'memoize': rule.get('memoize', True),
+          'variables': variables,
+          'items': selection[offset:offset + size],
+        }
+        for offset in range(0, len(selection), size)
+      ]
+
+    return shards
+
+  # ([string], dict): dict?
   #
-  #     {
-  #       "a": {
-  #         "b": {
-  #         },
-  #         "c": {
-  #           "address": u"127.0.0.1"
-  #         }
-  #       }
-  #     }
+  # The values of the variables the conditions read (besides "item" and
+  # "captures"), or None if they may read anything else or any of the values is
+  # not plain data.
+  def _collect_portable_variables(self, conditions, task_vars):
+    variables = {}
+
+    for expr in conditions:
+      dependencies = compile_predicate(expr, self._templar).dependencies
+
+      if dependencies is None or any(x not in task_vars for x in dependencies):
+        return None
+
+      variables.update((x, task_vars[x]) for x in dependencies)
+
+    try:
+      fingerprint_subtree(variables, self._templar, self._fingerprints)
+    except UnfingerprintableValue:
+      return None
+
+    return variables
+
+  # (list, list, dict, dict, dict, list?, list?, function?): list
   #
-  # For a path query of 'a.*.address', two items will be yielded even though
-  # only one is defined:
+  # Evaluate the rules that can fail the task, one at a time, until one of them
+  # applies to an item. Rules that were not evaluated are left as None. See
+  # #_identify_all_issues for on_result.
+  def _identify_first_issue(self, rules, schedule, target_vars, task_vars, cache_stats, rule_stats=None,
+                            key_filters=None, on_result=None):
+    rule_items = [ None ] * len(rules)
+    key_filters = key_filters or [ None ] * len(rules)
+
+    for rule_index in schedule:
+      rule = rules[rule_index]
+      stats = None if rule_stats is None else rule_stats[rule_index]
+
+      if self.RULE_SPECS[rule['state']]['ignore_errors']:
+        continue
+
+      rule_key = self._fingerprint_rule(rule, target_vars, task_vars, key_filters[rule_index])
+      items = self._lookup_rule_result(rule_key, cache_stats, stats)
+
+      if items is None:
+        started_at = timer()
+        item = self._create_rule_query(
+          rule, target_vars, task_vars, stats=stats, key_filter=key_filters[rule_index]
+        ).first()
+        items = [] if item is None else [ item ]
+
+        if stats is not None:
+          stats['time'] = timer() - started_at
+
+        if not items:
+          self._store_rule_result(rule_key, items)
+
+      rule_items[rule_index] = items
+
+      if on_result is not None:
+        on_result(rule_index, items)
+
+      if items:
+        break
+
+    return rule_items
+
+  # (list, dict, bool, list?): list
   #
-  #     [
-  #       { "path": "a.b.address", "value": None },
-  #       { "path": "a.c.address", "value": u"127.0.0.1 }
-  #     ]
+  # The order to evaluate the rules in: cheapest first (see lint_query#estimate_rule_cost)
+  # and, in fail_fast mode, those that can fail the task before the rest. Rules
+  # of the same cost keep their relative order. The order in which rules are
+  # evaluated has no bearing on how their issues are reported.
+  def _schedule_rules(self, rules, target_vars, fail_fast, key_filters=None):
+    key_filters = key_filters or [ None ] * len(rules)
+
+    def rank(rule_index):
+      rule = rules[rule_index]
+      conditions = getattr(self, '_identify_%s' % rule['state'])(rule, ConditionCollector()).conditions
+      predicates = [ compile_predicate(x, self._templar) for x in conditions ]
+
+      return (
+        fail_fast and self.RULE_SPECS[rule['state']]['ignore_errors'],
+        estimate_rule_cost(rule, predicates, target_vars, key_filters[rule_index]),
+        rule_index
+      )
+
+    return sorted(range(len(rules)), key=rank)
+
+  # (string?, dict, dict?): list?
   #
-  def select(self, selector):
-    return self._chain(lambda _: over(selector, self._target_vars))
+  # Look up the result of a rule in the process, then in the result store if
+  # there is one.
+  def _lookup_rule_result(self, rule_key, cache_stats, stats=None):
+    items = None if rule_key is None else RULE_RESULTS.get(rule_key)
+
+    if items is None and rule_key is not None and self._result_store is not None:
+      items = self._result_store.get(rule_key)
+
+      if items is not None:
+        RULE_RESULTS.set(rule_key, items)
+
+    if rule_key is None:
+      outcome = 'uncacheable'
+    elif items is None:
+      outcome = 'misses'
+    else:
+      outcome = 'hits'
+
+    cache_stats[outcome] += 1
 
-  # (str): Query
+    if stats is not None:
+      stats['cache'] = outcome
+
+    return items
+
+  # (string?, list): None
+  def _store_rule_result(self, rule_key, items):
+    if rule_key is None:
+      return
+
+    RULE_RESULTS.set(rule_key, items)
+
+    if self._result_store is not None:
+      self._result_store.set(rule_key, items)
+
+  # (int, dict): dict
   #
-  # Refine the selection with a Jinja2 test. The expression will be evaluated
-  # with an additional reserved variable "item" pointing to the item being
-  # matched.
+  # The breakdown of the work done to evaluate a rule:
   #
-  # Example:
+  # - "rule": the number of the rule, as displayed
+  # - "time": the seconds spent evaluating its conditions (in full runs, the
+  #   variables of all the rules are selected at once beforehand)
+  # - "leaves", "evaluations", "memo_hits", "memo_misses": see Query
+  # - "cache": whether its result was reused; one of "hits", "misses" or
+  #   "uncacheable", like in the "cache" field of the result
+  # - "shards": the number of shards it was split into for worker processes
+  # - "issues": the number of issues it produced
+  def _create_rule_stats(self, rule_index, rule):
+    return {
+      'rule': rule_index + 1,
+      'state': rule['state'],
+      'path': rule['path'],
+      'time': 0.0,
+      'leaves': 0,
+      'evaluations': 0,
+      'memo_hits': 0,
+      'memo_misses': 0,
+      'cache': None,
+      'shards': 0,
+      'issues': 0,
+    }
+
+  # (dict, dict, dict, list?, dict?): Query
   #
-  #     where('item is search("foo")')
-  #     where(lambda x: x == 'foo')
-  def where(self, expr):
-    predicate = self._create_jinja2_predicate(expr)
+  # A query for the items the rule applies to. Unless the items the rule
+  # covers have already been selected, they are selected as they are read.
+  def _create_rule_query(self, rule, target_vars, task_vars, selection=None, stats=None, key_filter=None):
+    query = Query(
+      target_vars,
+      task_vars,
+      self._loader,
+      self._templar,
+      memoize=rule.get('memoize', True),
+      stats=stats
+    )
+
+    if selection is None:
+      query = query.select(rule['path'], key_filter)
+    else:
+      query = query.select_items(selection)
 
-    return self._chain(lambda items: [merge(x, {
-      'selected': predicate(x),
-    }) for x in items])
+    return getattr(self, '_identify_%s' % rule['state'])(rule, query)
 
-  # (): Query
+  # (dict, dict): KeyFilter?
   #
-  # Invert the selection.
-  def invert(self):
-    return self._chain(lambda items: [merge(x, {
-      'selected': not x.get('selected', True)
-    }) for x in items ])
+  # The keys the globs of a rule may expand to, as given by its "include_keys"
+  # and "exclude_keys" options. Either option is a list of keys or the name of
+  # a variable that holds them: the keys of a dict or the items of a list.
+  def _create_key_filter(self, rule, task_vars):
+    include = self._resolve_key_set(rule, 'include_keys', task_vars)
+    exclude = self._resolve_key_set(rule, 'exclude_keys', task_vars)
 
-  # (): list
+    if include is None and exclude is None:
+      return None
+
+    return KeyFilter(include=include, exclude=exclude)
+
+  def _resolve_key_set(self, rule, option, task_vars):
+    value = rule.get(option)
+
+    if value is None:
+      return None
+    elif isinstance(value, string_types):
+      if value not in task_vars:
+        raise AnsibleActionFail("%s of rule %s refers to an undefined variable: %s" % (option, rule['path'], value))
+
+      value = task_vars[value]
+
+      if isinstance(value, string_types):
+        value = self._templar.template(value)
+
+    if isinstance(value, DeferredValue):
+      value = value.resolve()
+
+    if isbranch(value) and hasattr(value, 'keys'):
+      return frozenset(value.keys())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+      try:
+        return frozenset(value)
+      except TypeError:
+        pass
+
+    raise AnsibleActionFail("%s of rule %s must be a list of keys or the name of a dict or list" % (option, rule['path']))
+
+  # (dict, dict, dict, KeyFilter?): string?
+  #
+  # A content-addressed key for the result of a rule, made up of:
   #
-  # Apply the query and produce the list of selected items. Items in the list
-  # will conform to the following structure:
+  # - the rule definition
+  # - the subtree it selects, i.e. the value at the path leading up to its first
+  #   glob expression
+  # - the values of the variables its conditions read (other than "item" and
+  #   "captures")
+  # - the keys its globs are restricted to, if any (see #_create_key_filter)
   #
-  #     { "path": string, "value": any? }
+  # Returns None when the result can not be cached, for instance when the rule
+  # selects from all of the host variables, its conditions call functions, or
+  # any of its inputs contains templates that could resolve differently.
   #
-  # Value will be None if the variable was not found but was still covered by
-  # the selection (as explained in the globbing section of #select.)
-  def commit(self):
-    scope = None
+  # Hashes are memoized for the run (see #_identify_issues) so that rules that
+  # select the same subtree, or read the same variables, share the work.
+  def _fingerprint_rule(self, rule, target_vars, task_vars, key_filter=None):
+    selector = compile_selector(rule['path'])
+    subtree = target_vars
+    variables = set()
 
-    for f in self._pipeline:
-      scope = f(scope)
+    for lens in selector.segments:
+      if lens == '*':
+        break
+      elif isinstance(subtree, (DeferredValue, HostVars)):
+        return None
 
-    selected = [x for x in scope if x.get('selected', True)]
+      _, subtree = next(descend_into(subtree, lens))
 
-    return [omit(['selected'], x) for x in selected]
+    if subtree is task_vars:
+      return None
 
-  def _chain(self, f): # pylint: disable=invalid-name
-    self._pipeline += [ f ]
-    return self
+    for expr in getattr(self, '_identify_%s' % rule['state'])(rule, ConditionCollector()).conditions:
+      dependencies = compile_predicate(expr, self._templar).dependencies
 
-  def _create_jinja2_predicate(self, expr):
-    def match(item):
-      self._task_vars['item'] = '' if item['value'] is None else item['value']
-      self._task_vars['captures'] = item['captures']
+      if dependencies is None:
+        return None
 
-      return cond.evaluate_conditional(
-        templar=self._templar,
-        all_vars=self._task_vars
-      )
+      variables.update(dependencies)
 
-    cond = Conditional(loader=self._loader)
-    cond.when = [to_text(expr)]
+    if any(x not in task_vars for x in variables):
+      return None
 
-    return match
+    memo = self._fingerprints if self._fingerprints is not None else {}
 
-# (dict, dict): String?
-def validate_args(spec, args):
-  # hack to utilize the argument validation logic in AnsibleModule
-  class DummyConfigurationModule(AnsibleModule):
-    def __init__(self, argument_spec, params):
-      self.argument_spec = argument_spec
-      self.params = params
+    try:
+      return '{0}:{1}:{2}'.format(
+        fingerprint_rule_definition(rule),
+        fingerprint_subtree(subtree, self._templar, memo),
+        fingerprint([ self._fingerprint_variable(x, task_vars, memo) for x in sorted(variables) ])
+      ) + ('' if key_filter is None else ':' + key_filter.fingerprint())
+    except UnfingerprintableValue:
+      return None
+
+  # (string, dict, dict): string
+  #
+  # The hash of the value of a variable, computed once per memo (i.e. once per
+  # run, see #_identify_issues) however many rules read the variable. Raises
+  # UnfingerprintableValue like lint_variables#fingerprint_subtree.
+  def _fingerprint_variable(self, name, task_vars, memo):
+    key = ('variable', name)
 
-      super(DummyConfigurationModule, self).__init__(
-        argument_spec=argument_spec,
-        bypass_checks=False,
-        no_log=True,
-        check_invalid_arguments=True
-      )
+    if key not in memo:
+      try:
+        memo[key] = fingerprint_subtree(task_vars[name], self._templar, memo)
+      except UnfingerprintableValue:
+        memo[key] = None
 
-    def fail_json(self, **kwargs):
-      raise AnsibleOptionsError(kwargs['msg'])
+    if memo[key] is None:
+      raise UnfingerprintableValue()
 
-    def _load_params(self):
-      return self.params
+    return u'{0}={1}'.format(name, memo[key])
 
-  try:
-    DummyConfigurationModule(argument_spec=spec, params=args)
-  except AnsibleOptionsError as configuration_error:
-    return to_native(configuration_error)
-  else:
-    return None
+  # Mark specified variables as having been deprecated.
+  #
+  # pylint: disable=unused-argument
+  def _identify_deprecated(self, rule, query):
+    without_nils = query.where('item != ""')
 
-def isiterable(x):
-  try:
-    iter(x)
-  except TypeError:
-    return False
-  else:
-    return True
+    if not rule.get('when', None):
+      return without_nils
 
-def listof(x):
-  return x if isinstance(x, list) else [ x ]
+    return query.where(rule['when'])
 
-def merge(a, b):
-  c = a.copy()
-  c.update(b)
-  return c
+  # Fail if any of the specified variables is undefined.
+  #
+  # pylint: disable=unused-argument
+  def _identify_required(self, rule, query):
+    return query.where('item == ""')
+
+  # Fail if any of the specified variables matches the specified condition.
+  #
+  # pylint: disable=unused-argument
+  def _identify_invalid(self, rule, query):
+    return query.where(rule['when'])
 
-def omit(keys, target):
-  return { x: target[x] for x in target if x not in keys }
+  # Fail if any of the specified variables matches the specified condition.
+  #
+  # pylint: disable=unused-argument
+  def _identify_suspicious(self, rule, query):
+    return query.where(rule['when'])
 
-def pick(keys, target):
-  return { x: target[x] for x in target if x in keys }
+  # The pool is a lazily merged view of its entries; nothing is copied out of
+  # them. Like with dict.update(), entries that come later in the pool take
+  # precedence over earlier ones.
+  def _collect_target_vars(self, task_vars):
+    if self._task.args['pool']:
+      layers = []
 
-def flatten(lists):
-  memo = []
+      for var in self._task.args['pool']:
+        if isinstance(var, string_types):
+          layers.append(task_vars[var])
+        elif isinstance(var, dict):
+          layers.append(var)
+        else:
+          return None, {
+            "failed": True,
+            "msg": (
+              "Unrecognized pool variable type: expected a dict or " +
+              "a string but got \"{}\".".format(type(var))
+            )
+          }
 
-  for item in lists:
-    if isinstance(item, list):
-      memo += flatten(item)
+      return VariableOverlay(*reversed(layers)), None
     else:
-      memo.append(item)
-
-  return memo
-
-def over(expr, value):
-  not_found = {}
-
-  def descend(path, value, visited):
-    if len(path) == 0: # pylint: disable=len-as-condition
-      return {
-        'path': '.'.join(visited),
-        'captures': [
-          visited[index] for index, x in enumerate(expr.split('.')) if x == '*'
-        ],
-        'value': None if value == not_found else value
-      }
-
-    lens = path.pop(0)
-
-    if not isiterable(value):
-      return descend([] + path, not_found, visited + [ lens ])
-    elif lens in value:
-      return descend([] + path, value[lens], visited + [ lens ])
-    elif lens == '*':
-      return [ descend([x] + path, value, visited) for x in value.keys() ]
-    else:
-      return descend([] + path, not_found, visited + [ lens ])
+      return task_vars, None
 
-  return flatten(listof(descend(expr.split('.'), value, [])))
+# ([string]?): int
+#
+# Command-line interface for compiling rules bundles:
+#
+#     python lint.py compile rules.yml rules.json
+#
+# and for linting the variables of every host of an inventory without running
+# a playbook (see lint_check#check_inventory):
+#
+#     python lint.py check -i inventory --rules-file rules.yml
+def main(argv=None):
+  import argparse
+
+  parser = argparse.ArgumentParser(prog='lint.py')
+  subparsers = parser.add_subparsers(dest='command')
+
+  compile_parser = subparsers.add_parser('compile', help='compile a rules file into a rules bundle')
+  compile_parser.add_argument('rules_file', help='YAML file containing the rules')
+  compile_parser.add_argument('bundle_file', help='where to write the bundle')
+
+  check_parser = subparsers.add_parser('check', help='lint the variables of every host of an inventory')
+  check_parser.add_argument('-i', '--inventory', action='append', required=True,
+                            help='inventory host path or comma separated host list (may be repeated)')
+  check_parser.add_argument('-l', '--limit', help='further limit the hosts to a pattern')
+  check_parser.add_argument('-e', '--extra-vars', dest='extra_vars', action='append', default=[],
+                            help='set additional variables as key=value, YAML/JSON or @file (may be repeated)')
+  check_parser.add_argument('-f', '--forks', type=int, default=C.DEFAULT_FORKS, # pylint: disable=no-member
+                            help='number of hosts to lint in parallel')
+  check_parser.add_argument('--playbook-dir', default=os.getcwd(),
+                            help='directory whose group_vars and host_vars are loaded as a playbook\'s would')
+  rules_group = check_parser.add_mutually_exclusive_group(required=True)
+  rules_group.add_argument('--rules-file', type=os.path.abspath, help='YAML file containing the rules')
+  rules_group.add_argument('--rules-bundle', type=os.path.abspath, help='rules bundle to use')
+  check_parser.add_argument('--fail-fast', action='store_true', help='stop at the first issue that fails a host')
+  check_parser.add_argument('--cache-dir', help='directory to keep the results of the rules in between runs')
+  check_parser.add_argument('--max-items-per-rule', type=int, default=0,
+                            help='most issues to print for every rule')
+  check_parser.add_argument('--report-file', type=os.path.abspath, help='file to write the issues to')
+  check_parser.add_argument('--report-format', choices=[ 'jsonl', 'sarif' ], default='jsonl',
+                            help='format of the report file')
+
+  args = parser.parse_args(argv)
+
+  if args.command == 'check':
+    return check_inventory(args, ActionModule)
+  elif args.command != 'compile':
+    parser.print_usage(sys.stderr)
+    return 2
+
+  from ansible.parsing.dataloader import DataLoader
+
+  templar = Templar(loader=DataLoader())
 
-# pylint: disable=too-many-arguments
-def report_to_display(display, banner, banner_color, hint, hint_wrap, group_index, group_items):
-  gutter = '[R:{0}] '.format(group_index + 1)
-  indent = ' '.ljust(len(gutter))
+  try:
+    with open(args.rules_file, 'rb') as f:
+      template_data = to_text(f.read(), errors='surrogate_or_strict')
 
-  display.display('{0}{1}\n'.format(gutter, banner), color=banner_color)
+    if templar.is_template(template_data):
+      raise AnsibleError(
+        "%s uses templating which can not be resolved ahead of time" % args.rules_file
+      )
 
-  for item in group_items:
-    display.display('{0}  - {1}'.format(indent, item['path']), color=C.COLOR_HIGHLIGHT)
+    bundle = RulesBundle.compile(
+      rules=from_yaml(data=template_data, file_name=args.rules_file),
+      environment=templar.environment
+    )
+  except (AnsibleError, IOError) as e:
+    sys.stderr.write("%s\n" % to_native(e))
+    return 1
 
-  if hint and not hint_wrap:
-    display.display('\n{0}HINT: {1}\n'.format(indent, hint), color=C.COLOR_HIGHLIGHT)
-  elif hint:
-    wrapper = TextWrapper()
-    wrapper.initial_indent = indent
-    wrapper.subsequent_indent = indent
-    wrapper.drop_whitespace = False
-    wrapper.width = 70 - len(indent)
-    wrapped = '\n'.join(wrapper.wrap('HINT: {0}'.format(hint)))
+  with open(args.bundle_file, 'w') as f:
+    json.dump(bundle.dump(), f, sort_keys=True)
 
-    display.display('\n{0}\n'.format(wrapped), color=C.COLOR_HIGHLIGHT)
+  return 0
 
-def get_global_display():
-  try:
-    from __main__ import display as global_display
-    return global_display
-  except ImportError:
-    from ansible.utils.display import Display # pylint: disable=ungrouped-imports
-    return Display()
+if __name__ == '__main__':
+  sys.exit(main()) # pragma: no cover
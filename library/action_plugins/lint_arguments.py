@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2018 Ahmad Amireh <ahmad@instructure.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Validation of the arguments of the lint action, and of the rules of rules
+# files and bundles, the way AnsibleModule validates those of a module.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type # pylint: disable=invalid-name
+
+import ast
+import copy
+import json
+import os
+from six import string_types
+from ansible.errors import AnsibleError, AnsibleOptionsError
+from ansible.module_utils._text import to_native
+from ansible.module_utils.parsing.convert_bool import BOOLEANS_FALSE, BOOLEANS_TRUE, boolean
+from lint_variables import LRUCache, fingerprint, listof
+
+# (dict, dict): String?
+#
+# Validate the arguments against an AnsibleModule-style spec, filling in
+# defaults and aliases in place. Arguments that have been seen before in the
+# process (e.g. by a task that loops, or by the check command for every host)
+# are not validated again; their normalized values are shared with the earlier
+# call and must be treated as read-only.
+def validate_args(spec, args):
+  validator = compile_argument_spec(spec)
+
+  try:
+    key = (validator.checksum, fingerprint(args))
+  except (TypeError, ValueError):
+    key = None
+
+  if key is not None and key in VALIDATED_ARGUMENTS:
+    argument_error, normalized = VALIDATED_ARGUMENTS.get(key)
+  else:
+    argument_error = validator.validate(args)
+    normalized = None if argument_error else copy.deepcopy(args)
+
+    if key is not None:
+      VALIDATED_ARGUMENTS.set(key, (argument_error, normalized))
+
+    return argument_error
+
+  for name, value in (normalized or {}).items():
+    if isinstance(args.get(name), dict) and isinstance(value, dict):
+      args[name].clear()
+      args[name].update(value)
+    else:
+      args[name] = value
+
+  return argument_error
+
+# (dict): ArgumentValidator
+def compile_argument_spec(spec):
+  entry = ARGUMENT_VALIDATORS.get(id(spec))
+
+  # the spec is held on to so that its id may not be recycled
+  if entry is None or entry[0] is not spec:
+    entry = (spec, ArgumentValidator(spec))
+    ARGUMENT_VALIDATORS[id(spec)] = entry
+
+  return entry[1]
+
+# A re-implementation of the argument checks that AnsibleModule performs, with
+# the spec broken down up-front into the bits that each check needs. The order
+# of the checks and the messages they produce are those of AnsibleModule.
+#
+# Every option of the spec is kept as a field: (name, default, type, required,
+# choices), in the order of the spec.
+class ArgumentValidator():
+  # AnsibleModule names itself after the file it was defined in
+  MODULE_NAME = 'basic.py'
+
+  def __init__(self, spec, option=None, context=()):
+    option = option or {}
+
+    self.checksum = fingerprint(spec) if not context else None
+    self.context = context
+    self.aliases = []
+    self.fields = []
+    self.suboptions = []
+    self.checks = {
+      x: option.get(x) or []
+      for x in ('mutually_exclusive', 'required_together', 'required_one_of', 'required_if')
+    }
+
+    for name, value in spec.items():
+      default = value.get('default', None)
+      wanted = value.get('type', None) or 'str'
+
+      if default is not None and value.get('required', False):
+        raise AnsibleError(
+          "internal error: required and default are mutually exclusive for %s" % name
+        )
+      elif wanted not in TYPE_CHECKERS:
+        raise AnsibleError(
+          "implementation error: unknown type %s requested for %s" % (wanted, name)
+        )
+
+      self.aliases.extend((alias, name) for alias in value.get('aliases', None) or [])
+      self.fields.append((name, default, wanted, value.get('required', False), value.get('choices', None)))
+
+      is_dict = wanted == 'dict' or (wanted == 'list' and value.get('elements', '') == 'dict')
+
+      if is_dict and value.get('options', None) is not None:
+        self.suboptions.append((name, ArgumentValidator(
+          value['options'],
+          option=value,
+          context=self.context + (name,)
+        )))
+
+    self.legal_inputs = frozenset(list(spec.keys()) + [alias for alias, _ in self.aliases])
+
+  # (dict): String?
+  def validate(self, params):
+    try:
+      self.check(params)
+    except AnsibleOptionsError as configuration_error:
+      return to_native(configuration_error)
+    else:
+      return None
+
+  # (dict): None
+  #
+  # Check and normalize the parameters in place, raising AnsibleOptionsError
+  # with the message AnsibleModule would fail with.
+  def check(self, params): # pylint: disable=too-many-branches
+    for alias, name in self.aliases:
+      if alias in params:
+        params[name] = params[alias]
+
+    self._check_supported(params)
+
+    for check in self.checks['mutually_exclusive']:
+      if len([ x for x in check if x in params ]) > 1:
+        self._fail("parameters are mutually exclusive: %s" % ', '.join(check))
+
+    for name, default, _, _, _ in self.fields:
+      if default is not None and name not in params:
+        params[name] = default
+
+    missing = [ name for name, _, _, required, _ in self.fields if required and name not in params ]
+
+    if missing:
+      self._fail("missing required arguments: %s" % ", ".join(missing))
+
+    for name, _, wanted, _, _ in self.fields:
+      self._check_type(name, wanted, params)
+
+    for name, _, _, _, choices in self.fields:
+      if choices is not None and name in params:
+        self._check_choice(name, choices, params)
+
+    for check in self.checks['required_together']:
+      present = [ x in params for x in check ]
+
+      if any(present) and not all(present):
+        self._fail("parameters are required together: %s" % ', '.join(check))
+
+    for check in self.checks['required_one_of']:
+      if not any(x in params for x in check):
+        self._fail("one of the following is required: %s" % ', '.join(check))
+
+    for check in self.checks['required_if']:
+      self._check_required_if(check, params)
+
+    for name, default, _, _, _ in self.fields:
+      if name not in params:
+        params[name] = default
+
+    for name, validator in self.suboptions:
+      if params.get(name, None) is None:
+        continue
+
+      for element in listof(params[name]):
+        if not isinstance(element, dict):
+          raise AnsibleOptionsError("value of %s must be of type dict or list of dict" % name)
+
+        validator.check(element)
+
+  def _check_supported(self, params):
+    unsupported = [ x for x in params if x not in self.legal_inputs ]
+
+    if not unsupported:
+      return
+
+    msg = "Unsupported parameters for (%s) module: %s" % (
+      self.MODULE_NAME, ', '.join(sorted(unsupported))
+    )
+
+    if self.context:
+      msg += " found in %s." % " -> ".join(self.context)
+
+    msg += " Supported parameters include: %s" % ', '.join(sorted(x[0] for x in self.fields))
+
+    raise AnsibleOptionsError(msg)
+
+  @staticmethod
+  def _check_type(name, wanted, params):
+    value = params.get(name, None)
+
+    if value is None:
+      return
+
+    try:
+      params[name] = TYPE_CHECKERS[wanted](value)
+    except (TypeError, ValueError) as e:
+      raise AnsibleOptionsError(
+        "argument %s is of type %s and we were unable to convert to %s: %s" % (
+          name, type(value), wanted, to_native(e)
+        )
+      )
+
+  def _check_choice(self, name, choices, params):
+    if isinstance(params[name], list):
+      diff_list = ", ".join([ x for x in params[name] if x not in choices ])
+
+      if diff_list:
+        self._fail("value of %s must be one or more of: %s. Got no match for: %s" % (
+          name, ", ".join([ to_native(x) for x in choices ]), diff_list
+        ))
+
+      return
+
+    # YAML may have turned a choice into a boolean; turn it back if there is
+    # only one way to do it
+    for text, booleans in (('False', BOOLEANS_FALSE), ('True', BOOLEANS_TRUE)):
+      if params[name] == text and params[name] not in choices:
+        overlap = booleans.intersection(choices)
+
+        if len(overlap) == 1:
+          (params[name],) = overlap
+
+    if params[name] not in choices:
+      self._fail("value of %s must be one of: %s, got: %s" % (
+        name, ", ".join([ to_native(x) for x in choices ]), params[name]
+      ))
+
+  def _check_required_if(self, check, params):
+    if len(check) == 4:
+      key, value, requirements, is_one_of = check
+    else:
+      key, value, requirements = check
+      is_one_of = False
+
+    if key not in params or params[key] != value:
+      return
+
+    missing = [ x for x in requirements if x not in params ]
+
+    if missing and len(missing) >= (len(requirements) if is_one_of else 0):
+      self._fail("%s is %s but %s of the following are missing: %s" % (
+        key, value, 'any' if is_one_of else 'all', ', '.join(missing)
+      ))
+
+  def _fail(self, msg):
+    if self.context:
+      msg += " found in %s" % " -> ".join(self.context)
+
+    raise AnsibleOptionsError(msg)
+
+# The conversions AnsibleModule applies to the values of every type of option.
+def check_type_str(value):
+  if isinstance(value, string_types):
+    return value
+
+  return str(value)
+
+def check_type_list(value):
+  if isinstance(value, list):
+    return value
+  elif isinstance(value, string_types):
+    return value.split(",")
+  elif isinstance(value, (int, float)):
+    return [str(value)]
+
+  raise TypeError('%s cannot be converted to a list' % type(value))
+
+def check_type_int(value):
+  if isinstance(value, int):
+    return value
+  elif isinstance(value, string_types):
+    return int(value)
+
+  raise TypeError('%s cannot be converted to an int' % type(value))
+
+def check_type_dict(value):
+  if isinstance(value, dict):
+    return value
+  elif not isinstance(value, string_types):
+    raise TypeError('%s cannot be converted to a dict' % type(value))
+  elif value.startswith("{"):
+    try:
+      return json.loads(value)
+    except ValueError:
+      pass
+
+    try:
+      return ast.literal_eval(value)
+    except (SyntaxError, ValueError):
+      raise TypeError('unable to evaluate string as dictionary')
+  elif '=' in value:
+    return dict(x.split("=", 1) for x in split_key_value_pairs(value.strip()))
+
+  raise TypeError("dictionary requested, could not parse JSON or key=value")
+
+# The message is left to boolean() as AnsibleModule#boolean does, since it lists
+# the members of BOOLEANS in their (hash dependent) iteration order.
+def check_type_bool(value):
+  if isinstance(value, bool):
+    return value
+  elif isinstance(value, (int,) + string_types):
+    try:
+      return boolean(value)
+    except TypeError as e:
+      raise AnsibleOptionsError(to_native(e))
+
+  raise TypeError('%s cannot be converted to a bool' % type(value))
+
+def check_type_path(value):
+  return os.path.expanduser(os.path.expandvars(check_type_str(value)))
+
+def check_type_raw(value):
+  return value
+
+TYPE_CHECKERS = {
+  'str': check_type_str,
+  'list': check_type_list,
+  'dict': check_type_dict,
+  'int': check_type_int,
+  'bool': check_type_bool,
+  'path': check_type_path,
+  'raw': check_type_raw,
+}
+
+# (string): list
+#
+# Split "a=1 b='2 3',c=4" into its fields the way AnsibleModule does.
+def split_key_value_pairs(value):
+  fields = []
+  field_buffer = []
+  in_quote = False
+  in_escape = False
+
+  for c in value:
+    if in_escape:
+      field_buffer.append(c)
+      in_escape = False
+    elif c == '\\':
+      in_escape = True
+    elif not in_quote and c in ('\'', '"'):
+      in_quote = c
+    elif in_quote and in_quote == c:
+      in_quote = False
+    elif not in_quote and c in (',', ' '):
+      if field_buffer:
+        fields.append(''.join(field_buffer))
+
+      field_buffer = []
+    else:
+      field_buffer.append(c)
+
+  if field_buffer:
+    fields.append(''.join(field_buffer))
+
+  return fields
+
+ARGUMENT_VALIDATORS = {}
+VALIDATED_ARGUMENTS = LRUCache(capacity=256)
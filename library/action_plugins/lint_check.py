@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2018 Ahmad Amireh <ahmad@instructure.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# The "check" command of lint.py, which lints the variables of every host of an
+# inventory without a playbook.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type # pylint: disable=invalid-name
+
+import multiprocessing
+from ansible import constants as C
+from ansible.errors import AnsibleError
+from ansible.module_utils._text import to_text
+from ansible.template import Templar
+from ansible.utils.color import stringc
+from lint_reports import get_global_display
+
+# Captures what the lint action prints for a host so that the output of hosts
+# linted in parallel can be printed one host at a time. What is meant for the
+# screen and for the log file is kept apart, as Display does.
+class BufferedDisplay():
+  def __init__(self):
+    self.screen = []
+    self.log = []
+
+  def display(self, msg, color=None, screen_only=False, log_only=False, **_kwargs):
+    if not log_only:
+      self.screen.append(stringc(msg, color) if color else msg)
+
+    if not screen_only:
+      self.log.append(msg)
+
+  # (Display): None
+  def replay(self, display):
+    if self.screen:
+      display.display('\n'.join(self.screen), screen_only=True)
+
+    if self.log:
+      display.display('\n'.join(self.log), log_only=True)
+
+# (Namespace, type): None
+#
+# Load the inventory and variables of a "check" command (see lint#main) into
+# WORKER_CONTEXT, along with the class of the lint action to run for every
+# host. Every process that lints hosts does so once.
+def initialize_check_worker(options, action_class):
+  from ansible.inventory.manager import InventoryManager
+  from ansible.parsing.dataloader import DataLoader
+  from ansible.utils.vars import load_extra_vars
+  from ansible.vars.manager import VariableManager
+
+  loader = DataLoader()
+  loader.set_basedir(options.playbook_dir)
+
+  inventory = InventoryManager(loader=loader, sources=options.inventory)
+  variable_manager = VariableManager(loader=loader, inventory=inventory)
+  variable_manager.extra_vars = load_extra_vars(loader, options)
+
+  WORKER_CONTEXT['check'] = {
+    'action_class': action_class,
+    'run_id': options.run_id,
+    'loader': loader,
+    'inventory': inventory,
+    'variable_manager': variable_manager,
+    'args': {
+      'rules_file': options.rules_file,
+      'rules_bundle': options.rules_bundle,
+      'fail_fast': options.fail_fast,
+      'cache_dir': options.cache_dir,
+      'max_items_per_rule': options.max_items_per_rule,
+      'report_file': options.report_file,
+      'report_format': options.report_format,
+    },
+  }
+
+# (string): tuple
+#
+# Lint the variables of a host with the lint action as a task would, without a
+# play. Produces the name of the host, the result of the action and what it
+# printed (a BufferedDisplay).
+def check_host(host_name):
+  from ansible.playbook.block import Block
+  from ansible.playbook.play import Play
+  from ansible.playbook.play_context import PlayContext
+  from ansible.playbook.task import Task
+  from ansible.plugins.connection.local import Connection
+
+  context = WORKER_CONTEXT['check']
+  loader = context['loader']
+  task_vars = context['variable_manager'].get_vars(host=context['inventory'].get_host(host_name))
+
+  play = Play.load(dict(hosts='all', gather_facts=False), loader=loader)
+  play_context = PlayContext(play=play)
+  display = BufferedDisplay()
+
+  module = context['action_class'](
+    task=Task.load(data=dict(action=dict(module='lint', args=dict(context['args']))), block=Block(play=play)),
+    connection=Connection(play_context, new_stdin=None),
+    play_context=play_context,
+    loader=loader,
+    templar=Templar(loader=loader, variables=task_vars),
+    shared_loader_obj=None
+  )
+
+  module.use_display(display)
+  module.use_run_id(context['run_id'])
+  # there is no play for the callback to summarize
+  module.use_summary(False)
+
+  try:
+    result = module.run(task_vars=task_vars)
+  except AnsibleError as e:
+    result = { 'failed': True, 'msg': to_text(e) }
+
+  return host_name, result, display
+
+# (Namespace, type): int
+#
+# Lint every host of the inventory with the given lint action, in parallel
+# unless forks is 1. Exits with 1 if the issues of any host would have failed
+# the task.
+def check_inventory(options, action_class):
+  from ansible.utils.vars import get_unique_id
+
+  display = get_global_display()
+  options.run_id = get_unique_id()
+
+  initialize_check_worker(options, action_class)
+
+  host_names = [
+    x.name for x in WORKER_CONTEXT['check']['inventory'].list_hosts(options.limit or 'all')
+  ]
+
+  pool = None
+
+  if options.forks > 1 and len(host_names) > 1:
+    pool = multiprocessing.Pool(
+      processes=min(options.forks, len(host_names)),
+      initializer=initialize_check_worker,
+      initargs=(options, action_class)
+    )
+
+    outcomes = pool.imap(check_host, host_names)
+  else:
+    outcomes = (check_host(x) for x in host_names)
+
+  failed = []
+  issue_count = 0
+
+  try:
+    for host_name, result, output in outcomes:
+      if output.screen or output.log:
+        display.banner(u'LINT [{0}]'.format(host_name))
+        output.replay(display)
+
+      if result.get('failed'):
+        failed.append(host_name)
+
+      if result.get('failed') and 'issues' not in result and 'issue_count' not in result:
+        display.error(u'{0}: {1}'.format(host_name, result.get('msg')), wrap_text=False)
+
+      issue_count += result.get('issue_count', len(result.get('issues', [])))
+  finally:
+    if pool is not None:
+      pool.terminate()
+      pool.join()
+
+  display.display(
+    u'{0} hosts linted, {1} issues found, {2} hosts failed'.format(len(host_names), issue_count, len(failed)),
+    color=C.COLOR_ERROR if failed else C.COLOR_OK
+  )
+
+  return 1 if failed else 0
+
+WORKER_CONTEXT = {}
@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2018 Ahmad Amireh <ahmad@instructure.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Compilation of the conditions of rules ("when") into predicates, which are
+# evaluated natively where possible and by Jinja2 otherwise.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type # pylint: disable=invalid-name
+
+import operator
+from jinja2 import nodes as jinja2_nodes
+from ansible.module_utils._text import to_text
+from ansible.template.vars import AnsibleJ2Vars
+from lint_variables import LRUCache, is_plain_value
+
+# (string, Templar): Predicate
+#
+# Compile a Jinja2 test expression. Predicates are cached by the text of their
+# expression in a bounded LRU that lives for as long as the process does, so
+# that an expression used by several rules, tasks, or hosts is parsed only once.
+# A pre-parsed form of the expression (see #compile_native_predicate) may be
+# provided to avoid parsing it again.
+def compile_predicate(expr, templar, tree=None):
+  expr = to_text(expr)
+  predicate = PREDICATES.get(expr)
+
+  if predicate is None:
+    predicate = Predicate(expr, templar, tree=tree)
+    PREDICATES.set(expr, predicate)
+
+  return predicate
+
+# A Jinja2 test expression compiled into a template that can be rendered against
+# any set of variables.
+#
+# The compiled template is only a shortcut for what Conditional would do with
+# the expression; whenever it is not applicable (e.g. the expression is itself
+# templated or names a bare variable) or the evaluation does not produce a clean
+# answer, evaluation falls back to Conditional so that the semantics and error
+# reporting stay the same.
+class Predicate():
+  BATCH_VAR = '__lint_batch__'
+
+  def __init__(self, expr, templar, tree=None):
+    self.expr = expr
+    self.native = None
+    self.tree = None
+    self._environment = None
+    self._templates = None
+
+    if self._is_compilable(expr, templar):
+      self._environment = templar.environment.overlay()
+      self._environment.filters.update(templar._get_filters(self._environment.filters)) # pylint: disable=protected-access
+      self._environment.tests.update(templar._get_tests()) # pylint: disable=protected-access
+      self.tree = parse_expression(expr, self._environment) if tree is None else tree
+      self.native = compile_native_predicate(expr, self._environment, tree=self.tree)
+
+  # frozenset?
+  #
+  # The names of the variables the expression reads besides "item" and
+  # "captures", or None if its result may depend on more than its inputs (e.g.
+  # it calls a function, a filter that is not known to be pure, or could not be
+  # parsed.)
+  @property
+  def dependencies(self):
+    if self.tree is None:
+      return None
+
+    for node in self.tree.find_all((jinja2_nodes.Call, jinja2_nodes.Filter)):
+      if isinstance(node, jinja2_nodes.Filter) and node.name not in PURE_FILTERS:
+        return None
+      elif isinstance(node, jinja2_nodes.Call) and isinstance(node.node, jinja2_nodes.Name):
+        return None
+
+    return frozenset(
+      x.name for x in self.tree.find_all(jinja2_nodes.Name)
+      if x.name not in ('item', 'captures')
+    )
+
+  # Template?
+  #
+  # The templates are compiled on first use as they are not needed at all when
+  # every item can be evaluated natively.
+  @property
+  def template(self):
+    return self._get_templates()[0]
+
+  # Template?
+  @property
+  def batch_template(self):
+    return self._get_templates()[1]
+
+  # (DataLoader, Templar): (dict): bool
+  #
+  # Prepare the predicate for evaluation by a specific templar. The function
+  # produced accepts the variables to evaluate against, which is where "item"
+  # and "captures" are expected to be found.
+  def bind(self, loader, templar):
+    conditionals = []
+
+    # the playbook machinery is only loaded for expressions that can not be
+    # rendered directly, or whose result is not a boolean
+    def fallback(all_vars):
+      if not conditionals:
+        from ansible.playbook.conditional import Conditional
+
+        conditionals.append(Conditional(loader=loader))
+        conditionals[0].when = [ self.expr ]
+
+      return conditionals[0].evaluate_conditional(templar=templar, all_vars=all_vars)
+
+    if self.template is None:
+      return fallback
+
+    render = self._create_renderer(self.template, templar)
+
+    def evaluate(all_vars):
+      result = render(all_vars)
+
+      if result == u'True':
+        return True
+      elif result == u'False':
+        return False
+      else:
+        return fallback(all_vars)
+
+    return evaluate
+
+  # (Templar): (dict, [(any, list)]): [bool]?
+  #
+  # Prepare the predicate for evaluating a whole batch of (item, captures)
+  # pairs in a single render. The function produced yields one boolean per
+  # pair, or None if the batch could not be evaluated as a whole, in which case
+  # the pairs need to be evaluated one by one (see #bind) to find out which of
+  # them is at fault.
+  def bind_batch(self, templar):
+    if self.batch_template is None:
+      return lambda all_vars, pairs: None
+
+    render = self._create_renderer(self.batch_template, templar)
+
+    def evaluate_all(all_vars, pairs):
+      all_vars[self.BATCH_VAR] = pairs
+
+      try:
+        result = render(all_vars)
+      finally:
+        del all_vars[self.BATCH_VAR]
+
+      if result is None or len(result) != len(pairs) or result.strip(u'01'):
+        return None
+
+      return [ x == u'1' for x in result ]
+
+    return evaluate_all
+
+  # (Templar): (dict, any, list): bool?
+  #
+  # Prepare the natively compiled form of the predicate (see
+  # #compile_native_predicate) for evaluation. The function produced yields
+  # None whenever the native form does not apply to the item, in which case it
+  # needs to be evaluated by Jinja2 instead.
+  def bind_native(self, templar):
+    if self.native is None:
+      return lambda all_vars, item, captures: None
+
+    native = self.native
+    template_globals = self._create_globals(self._environment.globals, templar)
+
+    def evaluate(all_vars, item, captures):
+      variables = []
+
+      def resolve(name):
+        if name == 'item':
+          if not is_plain_value(templar, item):
+            raise NativeFallback()
+
+          return item
+        elif name == 'captures':
+          if not all(is_plain_value(templar, x) for x in captures):
+            raise NativeFallback()
+
+          return captures
+
+        if not variables:
+          templar.set_available_variables(variables=all_vars)
+          variables.append(AnsibleJ2Vars(templar, template_globals))
+
+        if name not in variables[0]:
+          raise NativeFallback()
+
+        return variables[0][name]
+
+      try:
+        return bool(native(resolve))
+      except Exception: # pylint: disable=broad-except
+        return None
+
+    return evaluate
+
+  @staticmethod
+  def _create_globals(environment_globals, templar):
+    return dict(
+      environment_globals,
+      lookup=templar._lookup, # pylint: disable=protected-access
+      query=templar._query_lookup, # pylint: disable=protected-access
+      q=templar._query_lookup, # pylint: disable=protected-access
+      finalize=templar._finalize # pylint: disable=protected-access
+    )
+
+  @classmethod
+  def _create_renderer(cls, template, templar):
+    template_globals = cls._create_globals(template.globals, templar)
+
+    def render(all_vars):
+      templar.set_available_variables(variables=all_vars)
+
+      try:
+        context = template.new_context(AnsibleJ2Vars(templar, template_globals), shared=True)
+        return u''.join(template.root_render_func(context)).strip()
+      except Exception: # pylint: disable=broad-except
+        return None
+
+    return render
+
+  # A bare name is looked up as a variable by Conditional, except for the
+  # constants Jinja2 knows (e.g. "when: true" to select every item) which are
+  # compiled like any other expression.
+  @staticmethod
+  def _is_compilable(expr, templar):
+    from ansible.playbook.conditional import VALID_VAR_REGEX
+
+    return not (
+      not expr or
+      hasattr(expr, '__UNSAFE__') or
+      templar.is_template(expr) or
+      (VALID_VAR_REGEX.match(expr) and expr not in CONSTANT_NAMES)
+    )
+
+  def _get_templates(self):
+    if self._templates is None:
+      self._templates = self._compile_templates()
+
+    return self._templates
+
+  def _compile_templates(self):
+    if self._environment is None:
+      return None, None
+
+    try:
+      return (
+        self._environment.from_string(
+          u'{%% if %s %%} True {%% else %%} False {%% endif %%}' % self.expr
+        ),
+        self._environment.from_string(
+          u'{% macro test(item, captures) %}' +
+          u'{%% if %s %%}1{%% else %%}0{%% endif %%}' % self.expr +
+          u'{% endmacro %}' +
+          u'{%% for pair in %s %%}{{ test(pair[0], pair[1]) }}{%% endfor %%}' % self.BATCH_VAR
+        )
+      )
+    except Exception: # pylint: disable=broad-except
+      return None, None
+
+class NativeFallback(Exception):
+  pass
+
+class UnsupportedExpression(Exception):
+  pass
+
+# (string, Environment): ((string): any): any?
+#
+# Compile a Jinja2 test expression into a native Python closure, bypassing
+# Jinja2 rendering entirely. Only a subset of the language is supported:
+#
+# - literals: strings, numbers, booleans, none, lists and tuples
+# - variables, attribute and item access (e.g. "item", "captures[0]", "x.y")
+# - comparisons (==, !=, <, <=, >, >=, in, not in)
+# - boolean operators (and, or, not)
+# - arithmetic (+, -, *, /, //, %)
+# - tests (e.g. "item is match('...')", "item is number")
+# - calls to plain functions or methods (e.g. "x.keys()")
+#
+# Returns None if the expression falls outside that subset. A tree previously
+# produced by #parse_expression may be provided to avoid parsing it again.
+#
+# The closure takes a function that resolves variables by name and which may
+# raise NativeFallback to signal that the expression must be evaluated by
+# Jinja2 instead. Attribute and item access, tests and calls behave exactly as
+# they do in a template since they go through the same environment.
+def compile_native_predicate(expr, environment, tree=None):
+  if tree is None:
+    tree = parse_expression(expr, environment)
+
+  if tree is None:
+    return None
+
+  try:
+    return compile_native_node(tree, environment)
+  except UnsupportedExpression:
+    return None
+
+# (string, Environment): Node?
+#
+# Parse a Jinja2 test expression into its syntax tree, or None if it is not a
+# valid expression.
+def parse_expression(expr, environment):
+  try:
+    tree = environment.parse(u'{%% if %s %%}{%% endif %%}' % expr)
+  except Exception: # pylint: disable=broad-except
+    return None
+
+  if len(tree.body) != 1 or not isinstance(tree.body[0], jinja2_nodes.If):
+    return None
+
+  return tree.body[0].test
+
+NATIVE_BINARY_OPERATORS = {
+  'Add': operator.add,
+  'Sub': operator.sub,
+  'Mul': operator.mul,
+  'Div': operator.truediv,
+  'FloorDiv': operator.floordiv,
+  'Mod': operator.mod,
+}
+
+NATIVE_COMPARISON_OPERATORS = {
+  'eq': operator.eq,
+  'ne': operator.ne,
+  'lt': operator.lt,
+  'lteq': operator.le,
+  'gt': operator.gt,
+  'gteq': operator.ge,
+  'in': lambda a, b: a in b,
+  'notin': lambda a, b: a not in b,
+}
+
+# pylint: disable=too-many-return-statements,too-many-branches,too-many-locals
+def compile_native_node(node, environment):
+  def compile_all(nodes):
+    return [ compile_native_node(x, environment) for x in nodes ]
+
+  def compile_keywords(keywords):
+    return [ (x.key, compile_native_node(x.value, environment)) for x in keywords ]
+
+  node_type = type(node).__name__
+
+  if node_type == 'Const':
+    value = node.value
+    return lambda resolve: value
+
+  elif node_type in ('List', 'Tuple'):
+    items = compile_all(node.items)
+    container = list if node_type == 'List' else tuple
+    return lambda resolve: container(f(resolve) for f in items)
+
+  elif node_type == 'Name':
+    name = node.name
+    return lambda resolve: resolve(name)
+
+  elif node_type == 'Getattr':
+    target = compile_native_node(node.node, environment)
+    attr = node.attr
+    return lambda resolve: environment.getattr(target(resolve), attr)
+
+  elif node_type == 'Getitem':
+    if type(node.arg).__name__ == 'Slice':
+      raise UnsupportedExpression()
+
+    target = compile_native_node(node.node, environment)
+    arg = compile_native_node(node.arg, environment)
+    return lambda resolve: environment.getitem(target(resolve), arg(resolve))
+
+  elif node_type == 'And':
+    left, right = compile_all([ node.left, node.right ])
+    return lambda resolve: left(resolve) and right(resolve)
+
+  elif node_type == 'Or':
+    left, right = compile_all([ node.left, node.right ])
+    return lambda resolve: left(resolve) or right(resolve)
+
+  elif node_type == 'Not':
+    operand = compile_native_node(node.node, environment)
+    return lambda resolve: not operand(resolve)
+
+  elif node_type == 'Neg':
+    operand = compile_native_node(node.node, environment)
+    return lambda resolve: -operand(resolve)
+
+  elif node_type in NATIVE_BINARY_OPERATORS:
+    operation = NATIVE_BINARY_OPERATORS[node_type]
+    left, right = compile_all([ node.left, node.right ])
+    return lambda resolve: operation(left(resolve), right(resolve))
+
+  elif node_type == 'Compare':
+    return compile_native_comparison(node, environment)
+
+  elif node_type == 'Test':
+    if node.dyn_args or node.dyn_kwargs or node.name not in environment.tests:
+      raise UnsupportedExpression()
+
+    test = environment.tests[node.name]
+    target = compile_native_node(node.node, environment)
+    args = compile_all(node.args)
+    kwargs = compile_keywords(node.kwargs)
+
+    return lambda resolve: test(
+      target(resolve),
+      *[ f(resolve) for f in args ],
+      **{ key: f(resolve) for key, f in kwargs }
+    )
+
+  elif node_type == 'Call':
+    if node.dyn_args or node.dyn_kwargs:
+      raise UnsupportedExpression()
+
+    target = compile_native_node(node.node, environment)
+    args = compile_all(node.args)
+    kwargs = compile_keywords(node.kwargs)
+
+    def call(resolve):
+      callee = target(resolve)
+
+      # functions that expect to be handed the template context are left to
+      # Jinja2
+      for function in (callee, getattr(callee, '__call__', None)):
+        if any(hasattr(function, x) for x in ('contextfunction', 'evalcontextfunction', 'environmentfunction')):
+          raise NativeFallback()
+
+      return callee(
+        *[ f(resolve) for f in args ],
+        **{ key: f(resolve) for key, f in kwargs }
+      )
+
+    return call
+
+  else:
+    raise UnsupportedExpression()
+
+def compile_native_comparison(node, environment):
+  first = compile_native_node(node.expr, environment)
+  if any(x.op not in NATIVE_COMPARISON_OPERATORS for x in node.ops):
+    raise UnsupportedExpression()
+
+  operands = [
+    (NATIVE_COMPARISON_OPERATORS[x.op], compile_native_node(x.expr, environment))
+    for x in node.ops
+  ]
+
+  # chained comparisons (e.g. "a < b < c") hold only if every link holds
+  def compare(resolve):
+    left = first(resolve)
+
+    for comparison, f in operands:
+      right = f(resolve)
+
+      if not comparison(left, right):
+        return False
+
+      left = right
+
+    return True
+
+  return compare
+
+PREDICATES = LRUCache(capacity=1024)
+
+# Names that Jinja2 parses as constants rather than variables.
+CONSTANT_NAMES = frozenset([ 'true', 'false', 'none', 'True', 'False', 'None' ])
+
+# The filters whose output depends on nothing but their input. Filters that
+# are random (random, shuffle, password_hash without a salt), read the clock
+# or the file system (strftime, realpath, fileglob) or come from plugins are
+# left out, and so are results that use them.
+PURE_FILTERS = frozenset([
+  # jinja2
+  'abs', 'attr', 'batch', 'capitalize', 'center', 'count', 'd', 'default',
+  'dictsort', 'e', 'escape', 'filesizeformat', 'first', 'float',
+  'forceescape', 'format', 'groupby', 'indent', 'int', 'join', 'last',
+  'length', 'list', 'lower', 'map', 'max', 'min', 'pprint', 'reject',
+  'rejectattr', 'replace', 'reverse', 'round', 'safe', 'select', 'selectattr',
+  'slice', 'sort', 'string', 'striptags', 'sum', 'title', 'tojson', 'trim',
+  'truncate', 'unique', 'upper', 'urlencode', 'urlize', 'wordcount',
+  'wordwrap', 'xmlattr',
+  # ansible
+  'b64decode', 'b64encode', 'basename', 'bool', 'checksum', 'combine',
+  'comment', 'dict2items', 'difference', 'dirname', 'extract', 'flatten',
+  'from_json', 'from_yaml', 'from_yaml_all', 'hash', 'human_readable',
+  'human_to_bytes', 'intersect', 'items2dict', 'log', 'mandatory', 'md5',
+  'pow', 'quote', 'regex_escape', 'regex_findall', 'regex_replace',
+  'regex_search', 'rekey_on_member', 'relpath', 'root', 'sha1', 'splitext',
+  'subelements', 'symmetric_difference', 'ternary', 'to_datetime', 'to_json',
+  'to_nice_json', 'to_nice_yaml', 'to_yaml', 'type_debug', 'union',
+  'win_basename', 'win_dirname', 'win_splitdrive', 'zip', 'zip_longest',
+])
@@ -0,0 +1,538 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2018 Ahmad Amireh <ahmad@instructure.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Evaluation of rules: selecting the variables a rule applies to and testing its
+# conditions against them, in the task's process or a pool of workers, and
+# keeping the results for later runs.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type # pylint: disable=invalid-name
+
+import glob
+import hashlib
+import json
+import os
+import tempfile
+from timeit import default_timer as timer
+from jinja2 import nodes as jinja2_nodes
+from ansible.module_utils._text import to_native
+from ansible.template import Templar
+from ansible.vars.hostvars import HostVars
+from lint_predicates import compile_predicate
+from lint_reports import get_global_display
+from lint_variables import DeferredValue, LRUCache, NOT_FOUND, UnfingerprintableValue, VariableOverlay, batches, compile_selector, descend_into, fingerprint, fingerprint_subtree, isbranch, read_item_value
+
+# Keeps the results of rules on disk so that they are shared by every process.
+# Under ansible-playbook the task of every host runs in a process of its own,
+# so the results kept in memory (RULE_RESULTS) are only reused within a process
+# (e.g. by the check command); those kept here are reused by any host whose
+# rule has the same key of inputs (see ActionModule#_fingerprint_rule), in the
+# same run or a later one. Every result is a file named after a hash of its key:
+#
+#     {
+#       "version": 2,
+#       "plugin": string,
+#       "key": string,
+#       "items": [ [ string, [ string ] ] ]
+#     }
+#
+# Files written by another version of this plugin ("plugin" being a checksum of
+# its source) are disregarded. Once there are more than MAX_ENTRIES results,
+# those used least recently are removed.
+#
+# The store is best-effort; a file that can not be read is treated as missing
+# and one that can not be written is left alone, with a warning.
+class ResultStore():
+  VERSION = 2
+  MAX_ENTRIES = 4096
+
+  def __init__(self, cache_dir):
+    self.cache_dir = cache_dir
+    self._changed = False
+
+  # (string): list?
+  def get(self, rule_key):
+    file_name = self._get_file_name(rule_key)
+
+    try:
+      with open(file_name, 'r') as f:
+        document = json.load(f)
+    except (IOError, OSError, ValueError):
+      return None
+
+    if (
+        not isinstance(document, dict) or
+        document.get('version') != self.VERSION or
+        document.get('plugin') != get_plugin_checksum() or
+        document.get('key') != rule_key
+    ):
+      return None
+
+    try:
+      os.utime(file_name, None)
+    except OSError: # pragma: no cover
+      pass
+
+    return [ { 'path': path, 'captures': captures } for path, captures in document['items'] ]
+
+  # (string, list): None
+  def set(self, rule_key, items):
+    document = {
+      'version': self.VERSION,
+      'plugin': get_plugin_checksum(),
+      'key': rule_key,
+      'items': [ [ x['path'], x['captures'] ] for x in items ],
+    }
+
+    try:
+      if not os.path.isdir(self.cache_dir):
+        os.makedirs(self.cache_dir)
+
+      tmp_fd, tmp_file_name = tempfile.mkstemp(dir=self.cache_dir, prefix='.lint-')
+
+      with os.fdopen(tmp_fd, 'w') as f:
+        json.dump(document, f, sort_keys=True)
+
+      os.rename(tmp_file_name, self._get_file_name(rule_key))
+    except (IOError, OSError) as e:
+      get_global_display().warning('Unable to write lint results to %s: %s' % (self.cache_dir, to_native(e)))
+      return
+
+    self._changed = True
+
+  # (): None
+  #
+  # Remove the results used least recently should there be more than
+  # MAX_ENTRIES of them, if any was written.
+  def prune(self):
+    if not self._changed:
+      return
+
+    self._changed = False
+
+    try:
+      file_names = [ os.path.join(self.cache_dir, x) for x in os.listdir(self.cache_dir) if x.endswith('.json') ]
+    except OSError: # pragma: no cover
+      return
+
+    if len(file_names) <= self.MAX_ENTRIES:
+      return
+
+    def last_used(file_name):
+      try:
+        return os.stat(file_name).st_mtime
+      except OSError: # pragma: no cover
+        return 0
+
+    for file_name in sorted(file_names, key=last_used)[:len(file_names) - self.MAX_ENTRIES]:
+      try:
+        os.remove(file_name)
+      except OSError: # pragma: no cover
+        pass
+
+  def _get_file_name(self, rule_key):
+    return os.path.join(self.cache_dir, fingerprint(rule_key) + '.json')
+
+# (): string
+#
+# A checksum of the source of this plugin: lint.py and the lint_* modules next
+# to it.
+def get_plugin_checksum():
+  directory = os.path.dirname(os.path.abspath(__file__))
+
+  if directory not in PLUGIN_CHECKSUMS:
+    checksum = hashlib.sha1()
+
+    for file_name in sorted(glob.glob(os.path.join(directory, 'lint*.py'))):
+      with open(file_name, 'rb') as f:
+        checksum.update(f.read())
+
+    PLUGIN_CHECKSUMS[directory] = checksum.hexdigest()
+
+  return PLUGIN_CHECKSUMS[directory]
+
+# Stands in for a Query to find out which conditions a rule would refine the
+# selection with, without selecting or evaluating anything. The steps taken can
+# be replayed onto a real Query later on, for instance in another process.
+class ConditionCollector():
+  def __init__(self):
+    self.conditions = []
+    self.steps = []
+
+  def where(self, expr):
+    self.conditions.append(expr)
+    self.steps.append(('where', expr))
+    return self
+
+  def invert(self):
+    self.steps.append(('invert',))
+    return self
+
+  # ([tuple], Query): Query
+  @staticmethod
+  def replay(steps, query):
+    for step in steps:
+      query = getattr(query, step[0])(*step[1:])
+
+    return query
+
+# (): None
+#
+# Set up a process of the pool that evaluates shards (see
+# ActionModule#_create_shards.)
+def initialize_worker():
+  from ansible.parsing.dataloader import DataLoader
+
+  loader = DataLoader()
+
+  WORKER_CONTEXT['loader'] = loader
+  WORKER_CONTEXT['templar'] = Templar(loader=loader)
+
+# (dict): tuple
+#
+# Evaluate a shard in a worker process. Produces the paths of the items that
+# were selected along with the stats of the query (see Query) and the time it
+# took.
+def evaluate_shard(shard):
+  started_at = timer()
+  stats = {}
+  query = Query(
+    target_vars={},
+    task_vars=shard['variables'],
+    loader=WORKER_CONTEXT['loader'],
+    templar=WORKER_CONTEXT['templar'],
+    memoize=shard['memoize'],
+    stats=stats
+  )
+
+  query = ConditionCollector.replay(shard['steps'], query.select_items(shard['items']))
+  paths = [ x['path'] for x in query.commit() ]
+  stats['time'] = timer() - started_at
+
+  return paths, stats
+
+# A somewhat declarative interface for selecting variables
+#
+# The query is lazy: nothing is selected nor evaluated until one of the
+# terminals (#commit, #first, #any, #count) is called, and then items stream
+# through the pipeline without being copied at every stage. Conditions are
+# evaluated in batches of growing size so that a terminal that only needs the
+# first hit stops early.
+#
+# Unless memoize is turned off, the results of evaluating conditions through
+# Jinja2 are memoized process-wide by the expression and its inputs (see
+# Query#where.) Under ansible-playbook that is for the task of one host, which
+# runs in a process of its own; the check command lints every host it assigns
+# to a process with the same memo.
+#
+# If a stats dict is given, the work done is tallied in it under:
+#
+# - "leaves": the number of items selected
+# - "evaluations": the number of times a condition was evaluated for an item
+# - "memo_hits" and "memo_misses": the outcome of looking up the memo
+class Query():
+  BATCH_SIZE = 256
+
+  def __init__(self, target_vars, task_vars, loader, templar, memoize=True, stats=None): # pylint: disable=too-many-arguments
+    self._target_vars = target_vars
+    self._task_vars = VariableOverlay(task_vars)
+    self._loader = loader
+    self._templar = templar
+    self._memoize = memoize
+    self._stats = stats
+    self._pipeline = []
+
+    if stats is not None:
+      for key in ('leaves', 'evaluations', 'memo_hits', 'memo_misses'):
+        stats.setdefault(key, 0)
+
+  # (string): Query
+  #
+  # Select one or more deeply nested variables by a dot-delimited path. Supports
+  # glob expressions.
+  #
+  # Examples
+  # --------
+  #
+  #     select('foo')       # the top-level variable "foo"
+  #     select('foo.*')     # direct descendants of "foo"
+  #     select('foo.*.bar') # "bar" property of direct descendants of "foo"
+  #     select('*')         # all top-level variables
+  #
+  # Glob expressions
+  # ----------------
+  #
+  # When a glob expression (*) is specified, an entry will still be constructed
+  # for __every__ leaf covered by the path even if it does not exist. For
+  # example, consider the following struct:
+  #
+  #     {
+  #       "a": {
+  #         "b": {
+  #         },
+  #         "c": {
+  #           "address": u"127.0.0.1"
+  #         }
+  #       }
+  #     }
+  #
+  # For a path query of 'a.*.address', two items will be yielded even though
+  # only one is defined:
+  #
+  #     [
+  #       { "path": "a.b.address", "value": None },
+  #       { "path": "a.c.address", "value": u"127.0.0.1 }
+  #     ]
+  #
+  def select(self, selector, key_filter=None):
+    return self._chain(lambda _: self._tally_leaves(
+      (x, True) for x in compile_selector(selector).iter_select(self._target_vars, key_filter)
+    ))
+
+  # (list): Query
+  #
+  # Start off with items that have already been selected, for example by a
+  # call to lint_variables#over_all. The items must conform to the structure described in
+  # #select.
+  def select_items(self, items):
+    return self._chain(lambda _: self._tally_leaves((x, True) for x in items))
+
+  # (str): Query
+  #
+  # Refine the selection with a Jinja2 test. The expression will be evaluated
+  # with an additional reserved variable "item" pointing to the item being
+  # matched.
+  #
+  # Example:
+  #
+  #     where('item is search("foo")')
+  #     where(lambda x: x == 'foo')
+  def where(self, expr):
+    predicate = self._create_jinja2_predicate(expr)
+
+    def refine(pairs):
+      for batch in batches(pairs, self.BATCH_SIZE):
+        items = [ x for x, _ in batch ]
+
+        for item, selected in zip(items, predicate(items)):
+          yield item, selected
+
+    return self._chain(refine)
+
+  # (): Query
+  #
+  # Invert the selection.
+  def invert(self):
+    return self._chain(lambda pairs: ((x, not selected) for x, selected in pairs))
+
+  # (): list
+  #
+  # Apply the query and produce the list of selected items. Items in the list
+  # will conform to the following structure:
+  #
+  #     { "path": string, "value": any? }
+  #
+  # Value will be None if the variable was not found but was still covered by
+  # the selection (as explained in the globbing section of #select.)
+  def commit(self):
+    return list(self._stream())
+
+  # (): dict?
+  #
+  # Apply the query up to the first selected item, or None if there is none.
+  def first(self):
+    return next(self._stream(), None)
+
+  # (): bool
+  #
+  # Whether the query selects any item at all.
+  def any(self):
+    return self.first() is not None
+
+  # (): int
+  #
+  # The number of items the query selects.
+  def count(self):
+    return sum(1 for _ in self._stream())
+
+  # (): generator
+  def _stream(self):
+    pairs = None
+
+    for f in self._pipeline:
+      pairs = f(pairs)
+
+    return (x for x, selected in pairs if selected)
+
+  def _chain(self, f): # pylint: disable=invalid-name
+    self._pipeline += [ f ]
+    return self
+
+  def _tally_leaves(self, pairs):
+    if self._stats is None:
+      return pairs
+
+    def tally():
+      for pair in pairs:
+        self._stats['leaves'] += 1
+        yield pair
+
+    return tally()
+
+  def _create_jinja2_predicate(self, expr):
+    predicate = compile_predicate(expr, self._templar)
+    evaluate = predicate.bind(loader=self._loader, templar=self._templar)
+    evaluate_all = predicate.bind_batch(templar=self._templar)
+    evaluate_native = predicate.bind_native(templar=self._templar)
+
+    def match(item):
+      self._task_vars['item'] = read_item_value(item)
+      self._task_vars['captures'] = item['captures']
+
+      return evaluate(self._task_vars)
+
+    # evaluate as many items as possible natively, then look up the rest in the
+    # memo and evaluate what remains through Jinja2 in one go, falling back to
+    # evaluating them one at a time if that fails so that errors are still
+    # reported for the item that caused them
+    def match_all(items):
+      results = [
+        evaluate_native(self._task_vars, read_item_value(x), x['captures'])
+        for x in items
+      ]
+
+      pending = [ index for index, x in enumerate(results) if x is None ]
+      evaluated_natively = len(items) - len(pending)
+      memo_keys = {}
+
+      if pending and self._memoize:
+        create_memo_key = self._create_memo_key_factory(predicate)
+
+        for index in pending:
+          memo_keys[index] = create_memo_key(items[index])
+
+          if memo_keys[index] is not None:
+            results[index] = PREDICATE_RESULTS.get(memo_keys[index])
+
+        memo_misses = [ index for index in pending if results[index] is None ]
+
+        if self._stats is not None:
+          self._stats['memo_hits'] += len(pending) - len(memo_misses)
+          self._stats['memo_misses'] += len([ x for x in memo_misses if memo_keys[x] is not None ])
+
+        pending = memo_misses
+
+      if self._stats is not None:
+        self._stats['evaluations'] += evaluated_natively + len(pending)
+
+      if not pending:
+        return results
+
+      batch_results = evaluate_all(self._task_vars, [
+        (read_item_value(items[x]), items[x]['captures'])
+        for x in pending
+      ])
+
+      if batch_results is None:
+        batch_results = [ match(items[x]) for x in pending ]
+
+      for index, result in zip(pending, batch_results):
+        results[index] = result
+
+        if memo_keys.get(index) is not None:
+          PREDICATE_RESULTS.set(memo_keys[index], result)
+
+      return results
+
+    return match_all
+
+  # (Predicate): (dict): tuple?
+  #
+  # Produce a function that computes the memo key of the result of evaluating
+  # the predicate against an item. The key covers the expression, the value of
+  # the item, its captures and the values of every other variable the
+  # expression reads. None is produced for items whose result may not be
+  # memoized.
+  def _create_memo_key_factory(self, predicate):
+    dependencies = predicate.dependencies
+
+    if dependencies is None or any(x not in self._task_vars for x in dependencies):
+      return lambda item: None
+
+    try:
+      dependencies_fingerprint = fingerprint_subtree([
+        (x, self._task_vars[x]) for x in sorted(dependencies)
+      ], self._templar)
+    except UnfingerprintableValue:
+      return lambda item: None
+
+    def create_memo_key(item):
+      try:
+        return (
+          predicate.expr,
+          fingerprint_subtree(read_item_value(item), self._templar),
+          fingerprint_subtree(item['captures'], self._templar),
+          dependencies_fingerprint
+        )
+      except UnfingerprintableValue:
+        return None
+
+    return create_memo_key
+
+# (dict): string
+#
+# A key for the parts of a rule that determine which items it applies to.
+def fingerprint_rule_definition(rule):
+  return fingerprint([ rule.get(x) for x in ('state', 'path', 'when') ])
+
+# (dict, [Predicate], dict, KeyFilter?): float
+#
+# Estimate how long it takes to evaluate a rule, in seconds: the number of
+# items it selects, sampled by following the first branch (the key filter
+# allows) at every glob, times the cost of evaluating its conditions for each
+# of them. Conditions cost more the larger their expression and much more when
+# they can not be evaluated natively.
+#
+# The estimate depends on nothing but the rule and the variables, so that the
+# order rules are evaluated in, and thus the issue fail_fast reports, is the
+# same for the same input.
+def estimate_rule_cost(rule, predicates, target_vars, key_filter=None):
+  fan_out = 1
+  value = target_vars
+
+  for lens in compile_selector(rule['path']).segments:
+    if isinstance(value, (DeferredValue, HostVars)):
+      fan_out *= len(value) if lens == '*' and isinstance(value, HostVars) else 1
+      break
+    elif lens == '*' and isbranch(value) and value:
+      keys = [ x for x in value.keys() if key_filter is None or key_filter(x) ]
+      fan_out *= len(keys)
+      value = value[keys[0]] if keys else NOT_FOUND
+    elif lens != '*':
+      _, value = next(descend_into(value, lens))
+
+  item_cost = 0.0
+
+  for predicate in predicates:
+    if predicate.tree is None:
+      item_cost += ESTIMATED_COSTS['unparsed']
+    else:
+      size = 1 + sum(1 for _ in predicate.tree.find_all(jinja2_nodes.Node))
+      item_cost += size * ESTIMATED_COSTS['native' if predicate.native else 'jinja2']
+
+  return fan_out * item_cost
+
+RULE_RESULTS = LRUCache(capacity=4096)
+PREDICATE_RESULTS = LRUCache(capacity=65536)
+
+# Rough costs (in seconds) of evaluating a node of a condition's syntax tree for
+# one item, and of evaluating a condition that could not be parsed at all.
+ESTIMATED_COSTS = {
+  'native': 1e-6,
+  'jinja2': 2e-5,
+  'unparsed': 1e-3,
+}
+WORKER_CONTEXT = {}
+PLUGIN_CHECKSUMS = {}
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2018 Ahmad Amireh <ahmad@instructure.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Reporting of issues: to the display, to the lint_summary callback plugin or to
+# a report file.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type # pylint: disable=invalid-name
+
+import fcntl
+import json
+import os
+from textwrap import TextWrapper
+from ansible import constants as C
+from ansible.module_utils._text import to_bytes, to_text
+from ansible.utils.color import stringc
+
+# (string, string, string, string?, list): IssueReport
+def create_issue_report(file_name, report_format, run_id, host, rules):
+  if report_format == 'sarif':
+    return SARIFReport(file_name, run_id, host, rules)
+
+  return JSONLinesReport(file_name, run_id, host, rules)
+
+# A file the issues are written to as every rule is evaluated, instead of being
+# listed in the result of the task. The issues found for every state are
+# tallied in counts.
+#
+# Every host of a run (i.e. of the task, see ActionModule#use_run_id) may report
+# to the same file. The issues of earlier runs are discarded by the first host
+# of a run to open the file.
+class IssueReport():
+  def __init__(self, file_name, run_id, host, rules):
+    self.file_name = file_name
+    self.counts = {}
+    self._run_id = run_id
+    self._host = host
+    self._rules = rules
+
+  # (int, list): None
+  def write(self, rule_index, items):
+    rule = self._rules[rule_index]
+
+    self.counts[rule['state']] = self.counts.get(rule['state'], 0) + len(items)
+    self._write_records([ self._create_record(rule_index, rule, x) for x in items ])
+
+  # (): None
+  def close(self):
+    pass
+
+  def _create_record(self, rule_index, rule, item):
+    raise NotImplementedError()
+
+  def _write_records(self, records):
+    raise NotImplementedError()
+
+# Issues written as JSON Lines, one object per issue:
+#
+#     { "rule": int, "state": string, "path": string, "host": string?, "hint": string?, "run": string }
+#
+# Where "rule" is the number of the rule, starting at 1. The file is truncated
+# when it is opened unless its last record belongs to the same run, then
+# appended to; the records of a rule are written at once under an exclusive
+# lock so they are never interleaved with those of another host.
+class JSONLinesReport(IssueReport):
+  def __init__(self, file_name, run_id, host, rules):
+    IssueReport.__init__(self, file_name, run_id, host, rules)
+    self._fd = os.open(file_name, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+
+    fcntl.lockf(self._fd, fcntl.LOCK_EX)
+
+    try:
+      if self._read_last_run_id() != run_id:
+        os.ftruncate(self._fd, 0)
+    finally:
+      fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+  def close(self):
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
+
+  def _create_record(self, rule_index, rule, item):
+    return {
+      'rule': rule_index + 1,
+      'state': rule['state'],
+      'path': item['path'],
+      'host': self._host,
+      'hint': rule.get('hint'),
+      'run': self._run_id,
+    }
+
+  def _write_records(self, records):
+    if not records:
+      return
+
+    b_data = to_bytes(''.join(json.dumps(x, sort_keys=True) + '\n' for x in records))
+
+    fcntl.lockf(self._fd, fcntl.LOCK_EX)
+
+    try:
+      os.write(self._fd, b_data)
+    finally:
+      fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+  # (): string?
+  def _read_last_run_id(self):
+    size = os.fstat(self._fd).st_size
+    offset = max(0, size - 65536)
+
+    os.lseek(self._fd, offset, os.SEEK_SET)
+
+    lines = os.read(self._fd, size - offset).splitlines()
+
+    try:
+      return json.loads(to_text(lines[-1])).get('run') if lines else None
+    except (ValueError, AttributeError):
+      return None
+
+# Issues written as a SARIF 2.1.0 log with a single run whose rules are those of
+# the task. The file is rewritten with no results when it is opened unless it
+# starts with the header of the same run, then appended to: the results of a
+# rule are written at once, in place of the closing brackets which are written
+# again after them, under an exclusive lock so that the file is a complete log
+# after every rule of every host.
+class SARIFReport(IssueReport):
+  SCHEMA = 'https://json.schemastore.org/sarif-2.1.0.json'
+  TRAILER = b']}]}\n'
+
+  def __init__(self, file_name, run_id, host, rules):
+    IssueReport.__init__(self, file_name, run_id, host, rules)
+    self._fd = os.open(file_name, os.O_RDWR | os.O_CREAT, 0o644)
+
+    b_header = to_bytes(self._create_header())
+
+    fcntl.lockf(self._fd, fcntl.LOCK_EX)
+
+    try:
+      if not self._is_same_run(b_header):
+        os.ftruncate(self._fd, 0)
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.write(self._fd, b_header + self.TRAILER)
+    finally:
+      fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+  def close(self):
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
+
+  def _create_header(self):
+    return '{{"$schema": {0}, "version": "2.1.0", "runs": [{{"tool": {1}, "properties": {2}, "results": ['.format(
+      json.dumps(self.SCHEMA),
+      json.dumps({
+        'driver': {
+          'name': 'lint',
+          'rules': [
+            {
+              'id': 'R{0}'.format(index + 1),
+              'shortDescription': { 'text': x['path'] },
+              'properties': { 'state': x['state'] },
+            }
+            for index, x in enumerate(self._rules)
+          ],
+        }
+      }, sort_keys=True),
+      json.dumps({ 'run': self._run_id })
+    )
+
+  # (bytes): bool
+  #
+  # Whether the file is a complete log that starts with the given header.
+  def _is_same_run(self, b_header):
+    size = os.fstat(self._fd).st_size
+
+    if size < len(b_header) + len(self.TRAILER):
+      return False
+
+    os.lseek(self._fd, 0, os.SEEK_SET)
+
+    if os.read(self._fd, len(b_header)) != b_header:
+      return False
+
+    os.lseek(self._fd, size - len(self.TRAILER), os.SEEK_SET)
+
+    return os.read(self._fd, len(self.TRAILER)) == self.TRAILER
+
+  def _create_record(self, rule_index, rule, item):
+    return {
+      'ruleId': 'R{0}'.format(rule_index + 1),
+      'ruleIndex': rule_index,
+      'level': 'warning' if RULE_SPECS[rule['state']]['ignore_errors'] else 'error',
+      'message': { 'text': rule.get('hint') or rule.get('banner') or RULE_SPECS[rule['state']]['banner'] },
+      'locations': [
+        { 'logicalLocations': [ { 'fullyQualifiedName': item['path'], 'kind': 'variable' } ] }
+      ],
+      'properties': { 'state': rule['state'], 'host': self._host },
+    }
+
+  def _write_records(self, records):
+    if not records:
+      return
+
+    b_data = to_bytes(', '.join(json.dumps(x, sort_keys=True) for x in records))
+
+    fcntl.lockf(self._fd, fcntl.LOCK_EX)
+
+    try:
+      # the results follow the opening bracket of the list or earlier results
+      offset = os.fstat(self._fd).st_size - len(self.TRAILER)
+      os.lseek(self._fd, offset - 1, os.SEEK_SET)
+
+      if os.read(self._fd, 1) != b'[':
+        b_data = b', ' + b_data
+
+      os.lseek(self._fd, offset, os.SEEK_SET)
+      os.write(self._fd, b_data + self.TRAILER)
+    finally:
+      fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+# Set by the lint_summary callback plugin to the id of the process that loaded
+# it, see #is_summary_callback_enabled.
+SUMMARY_CALLBACK_ENV = 'ANSIBLE_LINT_SUMMARY_CALLBACK_PID'
+
+# pylint: disable=too-many-arguments
+#
+# Print the issues of a rule under its banner, followed by its hint. Only the
+# first max_items issues are listed if it is above 0, along with a count of the
+# ones that are not.
+def report_to_display(display, banner, banner_color, hint, hint_wrap, group_index, group_items, max_items=0):
+  display_issue_group(
+    display=display,
+    rule_number=group_index + 1,
+    banner=banner,
+    banner_color=banner_color,
+    item_lines=[ item['path'] for item in group_items ],
+    hint_text=format_hint(hint, hint_wrap, group_index) if hint else None,
+    max_items=max_items
+  )
+
+# (Display, int, string, string, list, string?, int): None
+#
+# Print a group of issues in the gutter of their rule, one line for each of the
+# first max_items (or all) of them, followed by the hint as rendered by
+# #format_hint. Both the action and the lint_summary callback print the issues
+# this way; only the lines of the items differ.
+def display_issue_group(display, rule_number, banner, banner_color, item_lines, hint_text, max_items=0):
+  gutter = '[R:{0}] '.format(rule_number)
+  indent = ' '.ljust(len(gutter))
+  shown_lines = item_lines[:max_items] if max_items > 0 else item_lines
+  lines = [ ('{0}{1}\n'.format(gutter, banner), banner_color) ]
+
+  for line in shown_lines:
+    lines.append((u'{0}  - {1}'.format(indent, line), C.COLOR_HIGHLIGHT))
+
+  if len(shown_lines) < len(item_lines):
+    lines.append((
+      u'{0}  \u2026 and {1:,} more'.format(indent, len(item_lines) - len(shown_lines)),
+      C.COLOR_HIGHLIGHT
+    ))
+
+  if hint_text:
+    lines.append(('\n{0}\n'.format(hint_text), C.COLOR_HIGHLIGHT))
+
+  # one write for the whole group so that the output of a rule is not
+  # interleaved with that of other hosts, nor held up by taking the lock of the
+  # display for every item; colors only go to the screen so that the log file
+  # is kept free of escape sequences
+  display.display('\n'.join(stringc(text, color) for text, color in lines), screen_only=True)
+  display.display('\n'.join(text for text, _ in lines), log_only=True)
+
+# (string, bool, int): string
+#
+# The hint of a rule as it is printed under its issues (see #display_issue_group),
+# indented past the gutter of the rule and wrapped if hint_wrap is set.
+def format_hint(hint, hint_wrap, group_index):
+  indent = ' '.ljust(len('[R:{0}] '.format(group_index + 1)))
+
+  if not hint_wrap:
+    return '{0}HINT: {1}'.format(indent, hint)
+
+  wrapper = TextWrapper()
+  wrapper.initial_indent = indent
+  wrapper.subsequent_indent = indent
+  wrapper.drop_whitespace = False
+  wrapper.width = 70 - len(indent)
+
+  return '\n'.join(wrapper.wrap('HINT: {0}'.format(hint)))
+
+# (): bool
+#
+# Whether the lint_summary callback plugin was loaded by the ansible process
+# running the task, in which case it prints the issues of every host at the end
+# of the play instead. The callback sets SUMMARY_CALLBACK_ENV to its process id
+# when it is loaded; tasks run either in that process or in a worker it forked.
+def is_summary_callback_enabled():
+  return os.environ.get(SUMMARY_CALLBACK_ENV) in (str(os.getpid()), str(os.getppid()))
+
+def get_global_display():
+  try:
+    from __main__ import display as global_display
+    return global_display
+  except ImportError:
+    from ansible.utils.display import Display # pylint: disable=ungrouped-imports
+    return Display()
+
+# The states a rule may be in, i.e. what its issues are reported as.
+RULE_SPECS = {
+  'deprecated': {
+    'banner': u'The following variables have been deprecated:',
+    'banner_color': C.COLOR_WARN,
+    'ignore_errors': True,
+  },
+
+  'required': {
+    'banner': u'The following variables are required but missing:',
+    'banner_color': C.COLOR_ERROR,
+    'ignore_errors': False,
+  },
+
+  'invalid': {
+    'banner': u'The following variables are invalid:',
+    'banner_color': C.COLOR_ERROR,
+    'ignore_errors': False,
+  },
+
+  'suspicious': {
+    'banner': u'The following variables *may* be invalid:',
+    'banner_color': C.COLOR_WARN,
+    'ignore_errors': True,
+  }
+}
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2018 Ahmad Amireh <ahmad@instructure.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Loading of rules from rules files and rules bundles.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type # pylint: disable=invalid-name
+
+import copy
+import json
+import os
+import jinja2
+from jinja2 import nodes as jinja2_nodes
+from ansible.errors import AnsibleAction, AnsibleActionFail, AnsibleError, AnsibleFileNotFound, AnsibleOptionsError
+from ansible.module_utils._text import to_bytes, to_text
+from ansible.parsing.utils.yaml import from_yaml
+from lint_arguments import validate_args
+from lint_predicates import PURE_FILTERS, compile_predicate, parse_expression
+from lint_reports import RULE_SPECS
+from lint_variables import LRUCache, SELECTORS, Selector, compile_selector, fingerprint
+
+# pylint: disable=too-few-public-methods
+
+# Loads (and templates) YAML files. Both the contents of the files and the
+# results of templating them are cached for the lifetime of the process, which
+# under ansible-playbook is the task of a single host:
+#
+# - sources are keyed by their resolved path, modification time and size so
+#   that editing a file invalidates its entry
+# - results are additionally keyed by a hash of the (templated) values of the
+#   variables the file references, so hosts linted in the same process (e.g.
+#   by the check command) that agree on them share a result
+#
+# Files that call functions (e.g. lookups) or use filters that are not known to
+# be pure (see PURE_FILTERS) are templated every time. The values returned must
+# be treated as read-only.
+class YAMLFileLoader():
+  def __init__(self, loader, templar, find_needle):
+    self._loader = loader
+    self._templar = templar
+    self._find_needle = find_needle
+
+  def load_file(self, file_name):
+    try:
+      source = self._find_needle('files', file_name)
+    except AnsibleError as e:
+      raise AnsibleActionFail(to_text(e))
+
+    try:
+      source_stat = os.stat(source)
+    except OSError as e: # pragma: no cover
+      raise AnsibleActionFail("could not find src=%s, %s" % (source, to_text(e))) # pragma: no cover
+
+    source_key = (source, source_stat.st_mtime, source_stat.st_size)
+    template_data, variables = RULES_FILE_SOURCES.get(source_key, (None, None))
+
+    if template_data is None:
+      template_data = self._read_file(source)
+      variables = self._find_referenced_variables(template_data)
+
+      RULES_FILE_SOURCES.set(source_key, (template_data, variables))
+
+    variables_key = self._fingerprint(variables)
+
+    if variables_key is None:
+      return self._parse(template_data, file_name)
+
+    result_key = source_key + (variables_key,)
+    result = RULES_FILE_RESULTS.get(result_key)
+
+    if result is None:
+      result = self._parse(template_data, file_name)
+      RULES_FILE_RESULTS.set(result_key, result)
+
+    return result
+
+  def _read_file(self, source):
+    # Get vault decrypted tmp file
+    try:
+      tmp_source = self._loader.get_real_file(source)
+    except AnsibleFileNotFound as e: # pragma: no cover
+      raise AnsibleActionFail("could not find src=%s, %s" % (source, to_text(e))) # pragma: no cover
+
+    b_tmp_source = to_bytes(tmp_source, errors='surrogate_or_strict')
+
+    # template the source data locally & get ready to transfer
+    try:
+      with open(b_tmp_source, 'rb') as f:
+        return to_text(f.read(), errors='surrogate_or_strict')
+    except AnsibleAction: # pragma: no cover
+      raise # pragma: no cover
+    except Exception as e: # pragma: no cover
+      raise AnsibleActionFail("%s: %s" % (type(e).__name__, to_text(e))) # pragma: no cover
+    finally:
+      self._loader.cleanup_tmp_file(b_tmp_source)
+
+  def _parse(self, template_data, file_name):
+    templated = self._templar.do_template(
+      template_data,
+      preserve_trailing_newlines=True,
+      escape_backslashes=False
+    )
+
+    return from_yaml(data=templated, file_name=file_name)
+
+  # (string): [string]?
+  #
+  # The names of the variables the template references, or None if its result
+  # may not be cached.
+  def _find_referenced_variables(self, template_data):
+    try:
+      tree = self._templar.environment.parse(template_data)
+    except Exception: # pylint: disable=broad-except
+      return None
+
+    if any(True for _ in tree.find_all(jinja2_nodes.Call)):
+      return None
+    elif any(x.name not in PURE_FILTERS for x in tree.find_all(jinja2_nodes.Filter)):
+      return None
+
+    from jinja2 import meta as jinja2_meta
+
+    return sorted(jinja2_meta.find_undeclared_variables(tree))
+
+  # ([string]?): string?
+  def _fingerprint(self, variables):
+    if variables is None:
+      return None
+
+    available_variables = self._templar._available_variables # pylint: disable=protected-access
+
+    if any(x not in available_variables for x in variables):
+      return None
+
+    try:
+      return fingerprint([
+        (x, self._templar.template(available_variables[x])) for x in variables
+      ])
+    except Exception: # pylint: disable=broad-except
+      return None
+
+# Loads rules bundles (see RulesBundle) and keeps them around for the lifetime
+# of the process, keyed by their resolved path, modification time and size.
+class RulesBundleLoader():
+  def __init__(self, loader, find_needle):
+    self._loader = loader
+    self._find_needle = find_needle
+
+  def load_file(self, file_name):
+    try:
+      source = self._find_needle('files', file_name)
+    except AnsibleError as e:
+      raise AnsibleActionFail(to_text(e))
+
+    source_stat = os.stat(source)
+    source_key = (source, source_stat.st_mtime, source_stat.st_size)
+    bundle = RULES_BUNDLES.get(source_key)
+
+    if bundle is None:
+      tmp_source = self._loader.get_real_file(source)
+      b_tmp_source = to_bytes(tmp_source, errors='surrogate_or_strict')
+
+      try:
+        with open(b_tmp_source, 'rb') as f:
+          document = json.loads(to_text(f.read(), errors='surrogate_or_strict'))
+      except ValueError as e:
+        raise AnsibleActionFail("%s is not a rules bundle: %s" % (file_name, to_text(e)))
+      finally:
+        self._loader.cleanup_tmp_file(b_tmp_source)
+
+      bundle = RulesBundle.load(document, file_name=file_name)
+      RULES_BUNDLES.set(source_key, bundle)
+
+    return bundle
+
+# A rules file compiled ahead of time so that loading it involves no templating,
+# no argument validation and no parsing of paths or expressions. Bundles are
+# written as JSON documents of the following structure:
+#
+#     {
+#       "format": "ansible-lint-module/rules-bundle",
+#       "version": 1,
+#       "jinja2_version": string,
+#       "checksum": string,
+#       "body": {
+#         "rules": [ dict ],
+#         "selectors": { string: [ string ] },
+#         "expressions": { string: any? }
+#       }
+#     }
+#
+# Where "rules" have been validated and normalized (i.e. defaults and aliases
+# applied), "selectors" maps every rule path to its segments and "expressions"
+# maps every condition to its serialized syntax tree (see #dump_jinja2_node.)
+#
+# Use the "compile" command of this module to produce one:
+#
+#     python lint.py compile rules.yml rules.json
+class RulesBundle():
+  FORMAT = 'ansible-lint-module/rules-bundle'
+  VERSION = 1
+
+  def __init__(self, rules, selectors, expressions):
+    self.rules = rules
+    self.selectors = selectors
+    self.expressions = expressions
+
+  # (list, Environment): RulesBundle
+  #
+  # Raises AnsibleOptionsError if the rules are not valid.
+  @classmethod
+  def compile(cls, rules, environment):
+    args = { 'rules': copy.deepcopy(rules), 'pool': [] }
+    argument_error = validate_args(ARGUMENT_SPEC, { 'lint': args })
+
+    if argument_error:
+      raise AnsibleOptionsError(argument_error)
+
+    rules = args['rules']
+    expressions = set([ u'item == ""', u'item != ""' ])
+    expressions.update(x['when'] for x in rules if x.get('when'))
+
+    return cls(
+      rules=rules,
+      selectors={ x['path']: list(compile_selector(x['path']).segments) for x in rules },
+      expressions={ x: parse_expression(x, environment) for x in sorted(expressions) }
+    )
+
+  # (dict, string): RulesBundle
+  #
+  # Raises AnsibleActionFail if the document is not a bundle that this version
+  # of the module can load.
+  @classmethod
+  def load(cls, document, file_name):
+    if not isinstance(document, dict) or document.get('format') != cls.FORMAT:
+      raise AnsibleActionFail("%s is not a rules bundle" % file_name)
+    elif document.get('version') != cls.VERSION:
+      raise AnsibleActionFail(
+        "%s was compiled by an incompatible version of the lint module, please recompile it" % file_name
+      )
+    elif document.get('checksum') != fingerprint(document.get('body')):
+      raise AnsibleActionFail("%s is corrupt (checksum mismatch), please recompile it" % file_name)
+
+    body = document['body']
+
+    # syntax trees are only meaningful to the version of Jinja2 that produced
+    # them; the expressions will be parsed again otherwise
+    if document.get('jinja2_version') == jinja2.__version__:
+      expressions = { k: load_jinja2_node(v) for k, v in body['expressions'].items() }
+    else:
+      expressions = { k: None for k in body['expressions'] }
+
+    return cls(
+      rules=body['rules'],
+      selectors=body['selectors'],
+      expressions=expressions,
+    )
+
+  # (): dict
+  def dump(self):
+    body = {
+      'rules': self.rules,
+      'selectors': self.selectors,
+      'expressions': { k: dump_jinja2_node(v) for k, v in self.expressions.items() },
+    }
+
+    return {
+      'format': self.FORMAT,
+      'version': self.VERSION,
+      'jinja2_version': jinja2.__version__,
+      'checksum': fingerprint(body),
+      'body': body,
+    }
+
+  # (Templar): None
+  #
+  # Seed the selector and predicate caches with the pre-parsed paths and
+  # expressions.
+  def install(self, templar):
+    for expr, segments in self.selectors.items():
+      if expr not in SELECTORS:
+        SELECTORS[expr] = Selector(expr, segments=segments)
+
+    for expr, tree in self.expressions.items():
+      compile_predicate(expr, templar, tree=tree)
+
+# (Node?): any
+#
+# Serialize a Jinja2 syntax tree into a JSON-compatible structure.
+def dump_jinja2_node(node):
+  if isinstance(node, jinja2_nodes.Node):
+    return {
+      'node': type(node).__name__,
+      'fields': [ dump_jinja2_node(getattr(node, x)) for x in node.fields ],
+    }
+  elif isinstance(node, (list, tuple)):
+    return [ dump_jinja2_node(x) for x in node ]
+  else:
+    return node
+
+# (any): Node?
+#
+# Restore a Jinja2 syntax tree serialized by #dump_jinja2_node.
+def load_jinja2_node(data):
+  if isinstance(data, dict):
+    node_class = getattr(jinja2_nodes, data['node'], None)
+
+    if not isinstance(node_class, type) or not issubclass(node_class, jinja2_nodes.Node):
+      raise AnsibleActionFail("unrecognized expression node %s" % data['node'])
+
+    return node_class(*[ load_jinja2_node(x) for x in data['fields'] ])
+  elif isinstance(data, list):
+    return [ load_jinja2_node(x) for x in data ]
+  else:
+    return data
+
+RULES_FILE_SOURCES = LRUCache(capacity=64)
+RULES_FILE_RESULTS = LRUCache(capacity=256)
+RULES_BUNDLES = LRUCache(capacity=16)
+
+# The arguments of the task, which is also what rules files and bundles are
+# validated against.
+ARGUMENT_SPEC = dict(
+  lint = dict(
+    type='dict',
+    required_one_of=[
+      [ 'rules_file', 'rules', 'rules_bundle' ],
+    ],
+    options=dict(
+      pool = dict(type='list', default=[], elements='dict'),
+      fail_fast = dict(type='bool', default=False),
+      stats = dict(type='bool', default=False),
+      workers = dict(type='int', default=0),
+      cache_dir = dict(type='path', default=None),
+      max_items_per_rule = dict(type='int', default=0),
+      report_file = dict(type='path', default=None),
+      report_format = dict(type='str', default='jsonl', choices=[ 'jsonl', 'sarif' ]),
+      rules_file = dict(type='path', default=None),
+      rules_bundle = dict(type='path', default=None),
+      rules = dict(
+        type='list',
+        default=None,
+        required_if=[
+          [ 'state', 'invalid', [ 'when' ] ],
+          [ 'state', 'suspicious', [ 'when' ] ],
+        ],
+        elements='dict',
+        options=dict(
+          state=dict(type='str', choices=list(RULE_SPECS.keys()), required=True),
+          path=dict(type='str', required=True),
+          hint=dict(type='str', aliases=['msg']),
+          hint_wrap=dict(type='bool', default=True),
+          banner=dict(type='str', default=None),
+          banner_color=dict(type='str', default=None),
+          when=dict(type='str'),
+          memoize=dict(type='bool', default=True),
+          include_keys=dict(type='raw', default=None),
+          exclude_keys=dict(type='raw', default=None),
+        )
+      )
+    )
+  )
+)
@@ -0,0 +1,559 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2018 Ahmad Amireh <ahmad@instructure.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Walking the variables of a host: selectors (paths), lazy views of host
+# variables and templates, fingerprints, and the caches the plugin keeps.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type # pylint: disable=invalid-name
+
+import hashlib
+import json
+from collections import OrderedDict
+from six import binary_type, integer_types, string_types
+from ansible.module_utils._text import to_bytes
+from ansible.template import Templar
+from ansible.vars.hostvars import HostVars, STATIC_VARS
+
+# (Templar, any): bool
+#
+# Whether a value would reach Jinja2 unchanged, i.e. whether templating it is a
+# no-op.
+def is_plain_value(templar, value):
+  if value is None or isinstance(value, (bool, float) + integer_types):
+    return True
+  elif isinstance(value, string_types):
+    return (
+      hasattr(value, '__UNSAFE__') or
+      not templar._contains_vars(value) # pylint: disable=protected-access
+    )
+  else:
+    return False
+
+# A mapping that holds on to at most a certain number of entries, discarding the
+# least recently used ones to make room for new ones.
+class LRUCache():
+  def __init__(self, capacity):
+    self.capacity = capacity
+    self._entries = OrderedDict()
+
+  def __contains__(self, key):
+    return key in self._entries
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key, default=None):
+    if key not in self._entries:
+      return default
+
+    value = self._entries.pop(key)
+    self._entries[key] = value
+
+    return value
+
+  def set(self, key, value):
+    self._entries.pop(key, None)
+    self._entries[key] = value
+
+    while len(self._entries) > self.capacity:
+      self._entries.popitem(last=False)
+
+  def clear(self):
+    self._entries.clear()
+
+# A ChainMap-like view over several mappings that are searched in order; the
+# first mapping to define a key wins. Entries assigned to the overlay itself are
+# kept apart and shadow those of all the mappings underneath, which are never
+# modified nor copied.
+#
+# It is a dict so that it may be handed to Templar#set_available_variables.
+class VariableOverlay(dict):
+  def __init__(self, *maps):
+    super(VariableOverlay, self).__init__()
+    self.maps = maps
+
+  def __getitem__(self, key):
+    if dict.__contains__(self, key):
+      return dict.__getitem__(self, key)
+
+    for mapping in self.maps:
+      if key in mapping:
+        return mapping[key]
+
+    raise KeyError(key)
+
+  def __contains__(self, key):
+    return dict.__contains__(self, key) or any(key in x for x in self.maps)
+
+  # Keys are produced in the order dict.update() would have placed them had the
+  # mappings been merged from the last to the first.
+  def __iter__(self):
+    seen = set()
+
+    for layer in list(reversed(self.maps)) + [ dict.keys(self) ]:
+      for key in layer:
+        if key not in seen:
+          seen.add(key)
+          yield key
+
+  def __len__(self):
+    return sum(1 for _ in self)
+
+  def __repr__(self):
+    return '{0}({1!r})'.format(type(self).__name__, self.copy())
+
+  def get(self, key, default=None):
+    return self[key] if key in self else default
+
+  def keys(self):
+    return list(self)
+
+  def values(self):
+    return [ self[x] for x in self ]
+
+  def items(self):
+    return [ (x, self[x]) for x in self ]
+
+  def copy(self):
+    return { x: self[x] for x in self }
+
+# (any): string
+#
+# A stable hash of a JSON-serializable value. Raises TypeError or ValueError
+# for values that are not.
+def fingerprint(x):
+  return hashlib.sha1(to_bytes(json.dumps(x, sort_keys=True))).hexdigest()
+
+class UnfingerprintableValue(Exception):
+  pass
+
+# (any, Templar, dict?): string
+#
+# A stable hash of the contents of a variable subtree (i.e. dicts, lists and
+# scalars). Raises UnfingerprintableValue if the subtree contains anything else,
+# or strings that would be altered by templating.
+#
+# Every dict and list is hashed on its own and its hash fed to that of its
+# parent, so that when a memo is given the hash of every container is computed
+# only once however many subtrees include it. The memo is keyed by the identity
+# of the containers and holds on to them so that the identities are not reused;
+# it must not outlive changes to them (e.g. keep one for the run of a task.)
+def fingerprint_subtree(value, templar, memo=None):
+  def digest_container(x):
+    entry = None if memo is None else memo.get(id(x))
+
+    if entry is not None:
+      if entry[1] is None:
+        raise UnfingerprintableValue()
+
+      return entry[1]
+
+    digest = hashlib.sha1()
+
+    try:
+      if isinstance(x, dict):
+        digest.update(b'{')
+
+        for key in x:
+          feed(digest, key)
+          feed(digest, x[key])
+
+        digest.update(b'}')
+      else:
+        digest.update(b'[')
+
+        for item in x:
+          feed(digest, item)
+
+        digest.update(b']')
+    except UnfingerprintableValue:
+      if memo is not None:
+        memo[id(x)] = (x, None)
+
+      raise
+
+    if memo is not None:
+      memo[id(x)] = (x, digest.digest())
+
+    return digest.digest()
+
+  def feed(digest, x):
+    if isinstance(x, (dict, list, tuple)):
+      digest.update(digest_container(x))
+    elif isinstance(x, string_types):
+      if not is_plain_value(templar, x):
+        raise UnfingerprintableValue()
+
+      b_value = to_bytes(x, errors='surrogate_or_strict')
+      digest.update(to_bytes('s{0}:'.format(len(b_value))))
+      digest.update(b_value)
+    elif x is None or isinstance(x, (bool, float) + integer_types):
+      digest.update(to_bytes('{0}:{1!r};'.format(type(x).__name__, x)))
+    else:
+      raise UnfingerprintableValue()
+
+  root = hashlib.sha1()
+  feed(root, value)
+
+  return root.hexdigest()
+
+def isiterable(x):
+  try:
+    iter(x)
+  except TypeError:
+    return False
+  else:
+    return True
+
+def isbranch(x):
+  return isiterable(x) and not isinstance(x, (string_types, binary_type))
+
+def listof(x):
+  return x if isinstance(x, list) else [ x ]
+
+# (iterable, int): generator
+#
+# Group the items of an iterable into lists of 1, 2, 4, ... items, up to the
+# given capacity, consuming the iterable only as far as it is read.
+def batches(iterable, capacity):
+  batch = []
+  size = 1
+
+  for item in iterable:
+    batch.append(item)
+
+    if len(batch) == size:
+      yield batch
+      batch = []
+      size = min(size * 2, capacity)
+
+  if batch:
+    yield batch
+
+# (string, any, KeyFilter?): list
+#
+# Select the leaves covered by a single path expression. See Query#select for
+# the structure of the items produced, and KeyFilter for restricting the keys
+# that globs expand to.
+def over(expr, value, key_filter=None):
+  return compile_selector(expr).select(value, key_filter)
+
+# ([string], any, [KeyFilter?]?): [list]
+#
+# Select the leaves covered by several path expressions in a single walk of
+# the value. The expressions are merged into a prefix trie so that the branches
+# they have in common are visited only once, and every leaf that is reached is
+# handed to each of the expressions that end there.
+#
+# Produces one list of items per expression, in the order the expressions were
+# given. Each list is identical (both in content and order) to what #over would
+# have produced for that expression alone.
+#
+# Expressions that come with a key filter are walked on their own as they may
+# not share the branches of the others.
+def over_all(exprs, value, key_filters=None):
+  key_filters = key_filters or [ None ] * len(exprs)
+  selectors = [ compile_selector(x) for x in exprs ]
+  shared = [ index for index, x in enumerate(key_filters) if x is None ]
+  selections = [
+    [] if key_filter is None else selector.select(value, key_filter)
+    for selector, key_filter in zip(selectors, key_filters)
+  ]
+  visited = []
+
+  def descend(node, value):
+    for expr_index in node['terminals']:
+      selections[expr_index].append(selectors[expr_index].create_item(visited, value))
+
+    for lens, child in node['children'].items():
+      for key, x in descend_into(value, lens):
+        visited.append(key)
+        descend(child, x)
+        visited.pop()
+
+  if shared:
+    descend(create_path_trie(selectors, shared), value)
+
+  return selections
+
+# ([Selector], [int]?): dict
+#
+# Build a prefix trie out of compiled path selectors, or only those at the
+# given indices. Every node has the following structure:
+#
+#     {
+#       "children": OrderedDict(string, dict),
+#       "terminals": [ int ]
+#     }
+#
+# Where "terminals" lists the indices of the selectors that end at that node.
+# Children are kept in the order their segments were first encountered.
+def create_path_trie(selectors, indices=None):
+  def create_node():
+    return { 'children': OrderedDict(), 'terminals': [] }
+
+  root = create_node()
+
+  for selector_index in range(len(selectors)) if indices is None else indices:
+    selector = selectors[selector_index]
+    node = root
+
+    for lens in selector.segments:
+      if lens not in node['children']:
+        node['children'][lens] = create_node()
+
+      node = node['children'][lens]
+
+    node['terminals'].append(selector_index)
+
+  return root
+
+# (any, string): generator
+#
+# Step from a value into the branches covered by a single path segment. Yields
+# (key, value) pairs where the value is NOT_FOUND if the segment does not exist.
+#
+# Strings are treated as leaves; they are never searched for the segment.
+#
+# Lazy mappings (see #create_lazy_mapping) are descended into without resolving
+# their values; those are yielded as instances of DeferredValue instead.
+#
+# A glob only expands to the keys a key filter allows, if one is given; the
+# branches of the others are not looked up at all.
+def descend_into(value, lens, key_filter=None): # pylint: disable=too-many-branches
+  if isinstance(value, DeferredValue):
+    value = value.expand()
+
+  lazy_mapping = create_lazy_mapping(value)
+
+  if lazy_mapping is not None:
+    value = lazy_mapping
+
+  if isinstance(value, LazyMapping):
+    if lens == '*':
+      for x in value.keys():
+        if key_filter is None or key_filter(x):
+          yield x, value.child(x)
+    elif lens in value:
+      yield lens, value.child(lens)
+    else:
+      yield lens, NOT_FOUND
+  elif not isbranch(value):
+    yield lens, NOT_FOUND
+  elif lens in value:
+    yield lens, value[lens]
+  elif lens == '*':
+    for x in value.keys():
+      if key_filter is None or key_filter(x):
+        yield x, value[x]
+  else:
+    yield lens, NOT_FOUND
+
+# (any): LazyMapping?
+#
+# Wrap the values that Ansible resolves on access in a mapping that can be
+# descended into without resolving them. Only "hostvars" is such a value: looking
+# up a host in it templates every variable of that host.
+def create_lazy_mapping(value):
+  if isinstance(value, HostVars):
+    return HostVarsMapping(value)
+
+  return None
+
+# A value that is looked up, and templated, only once it is read. Values that
+# are mappings may be expanded into a LazyMapping to be descended into without
+# resolving the whole of them.
+class DeferredValue():
+  def __init__(self, resolve, expand=None):
+    self._resolve = resolve
+    self._expand = expand
+    self._resolved = NOT_RESOLVED
+    self._expanded = NOT_RESOLVED
+
+  # (): any
+  def resolve(self):
+    if self._resolved is NOT_RESOLVED:
+      self._resolved = self._resolve()
+
+    return self._resolved
+
+  # (): any
+  #
+  # The form of the value to descend into; the resolved value unless the value
+  # can be expanded lazily.
+  def expand(self):
+    if self._expand is None:
+      return self.resolve()
+
+    if self._expanded is NOT_RESOLVED:
+      self._expanded = self._expand()
+
+    return self._expanded
+
+# A mapping whose keys can be listed without resolving its values. Values are
+# produced by #child as instances of DeferredValue.
+class LazyMapping():
+  def keys(self):
+    raise NotImplementedError()
+
+  def __contains__(self, key):
+    raise NotImplementedError()
+
+  # (string): DeferredValue
+  def child(self, key):
+    raise NotImplementedError()
+
+# The hosts in "hostvars". Reading a host resolves to what hostvars[host] would
+# but descending into one only reads its raw variables, and templates nothing
+# but the values that are read in turn (see TemplatedMapping).
+class HostVarsMapping(LazyMapping):
+  def __init__(self, hostvars):
+    self._hostvars = hostvars
+
+  def keys(self):
+    return list(self._hostvars)
+
+  def __contains__(self, key):
+    return key in self._hostvars
+
+  def child(self, key):
+    hostvars = self._hostvars
+
+    def expand():
+      data = hostvars.raw_get(key)
+      templar = Templar(loader=hostvars._loader, variables=data) # pylint: disable=protected-access
+
+      return TemplatedMapping(data, templar, static_keys=STATIC_VARS)
+
+    return DeferredValue(lambda: hostvars[key], expand)
+
+# A dict of raw variables whose values are templated, in the context of the
+# variables they were defined with, only as they are read.
+class TemplatedMapping(LazyMapping):
+  def __init__(self, data, templar, static_keys=()):
+    self._data = data
+    self._templar = templar
+    self._static_keys = static_keys
+
+  def keys(self):
+    return list(self._data.keys())
+
+  def __contains__(self, key):
+    return key in self._data
+
+  def child(self, key):
+    value = self._data[key]
+    templar = self._templar
+
+    if key in self._static_keys:
+      return DeferredValue(lambda: value)
+    elif isinstance(value, dict):
+      return DeferredValue(
+        lambda: templar.template(value, fail_on_undefined=False),
+        lambda: TemplatedMapping(value, templar)
+      )
+    else:
+      return DeferredValue(lambda: templar.template(value, fail_on_undefined=False))
+
+# (any): bool
+#
+# Whether a selected value stands for a path that does not exist (or an empty
+# dict.) Compared by identity so that lazy values are not resolved.
+def is_missing(value):
+  return value is NOT_FOUND or (isinstance(value, dict) and not value)
+
+# (dict): any
+#
+# The value of a selected item as predicates read it, resolving it if it was
+# deferred.
+def read_item_value(item):
+  value = item['value']
+
+  if isinstance(value, DeferredValue):
+    value = value.resolve()
+
+  return '' if value is None or is_missing(value) else value
+
+# (string): Selector
+#
+# Compile a dot-delimited path expression. Selectors are memoized by their
+# expression so that every expression is parsed only once per process.
+def compile_selector(expr):
+  if expr not in SELECTORS:
+    SELECTORS[expr] = Selector(expr)
+
+  return SELECTORS[expr]
+
+# A path expression that has been parsed ahead of time. See Query#select for
+# the syntax.
+class Selector():
+  def __init__(self, expr, segments=None):
+    self.expr = expr
+    self.segments = tuple(expr.split('.') if segments is None else segments)
+    self.glob_positions = tuple(
+      index for index, x in enumerate(self.segments) if x == '*'
+    )
+
+  # (any, KeyFilter?): list
+  #
+  # Select the leaves covered by this selector. See #over.
+  def select(self, value, key_filter=None):
+    return list(self.iter_select(value, key_filter))
+
+  # (any, KeyFilter?): generator
+  #
+  # Like #select but yields the leaves as they are reached.
+  def iter_select(self, value, key_filter=None):
+    segments = self.segments
+    depth = len(segments)
+    visited = []
+
+    def descend(level, value):
+      if level == depth:
+        yield self.create_item(visited, value)
+        return
+
+      for key, x in descend_into(value, segments[level], key_filter):
+        visited.append(key)
+
+        for item in descend(level + 1, x):
+          yield item
+
+        visited.pop()
+
+    return descend(0, value)
+
+  # ([string], any): dict
+  def create_item(self, visited, value):
+    return {
+      'path': '.'.join(visited),
+      'captures': [ visited[index] for index in self.glob_positions ],
+      'value': None if is_missing(value) else value
+    }
+
+# The keys that the globs of a path expression may expand to: those in include
+# (all of them if None) that are not in exclude.
+class KeyFilter():
+  def __init__(self, include=None, exclude=None):
+    self.include = include
+    self.exclude = exclude
+
+  def __call__(self, key):
+    return (
+      (self.include is None or key in self.include) and
+      (self.exclude is None or key not in self.exclude)
+    )
+
+  # (): string
+  def fingerprint(self):
+    return fingerprint([
+      None if x is None else sorted(repr(key) for key in x)
+      for x in (self.include, self.exclude)
+    ])
+
+NOT_FOUND = {}
+NOT_RESOLVED = object()
+SELECTORS = {}
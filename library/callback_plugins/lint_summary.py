@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2018 Ahmad Amireh <ahmad@instructure.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type # pylint: disable=invalid-name
+
+import os
+import sys
+from collections import OrderedDict
+from ansible.plugins.callback import CallbackBase
+from ansible.plugins.loader import action_loader
+
+# The issues are printed by the lint_reports module of the lint action plugin,
+# whose directory Ansible does not put on the import path.
+LINT_ACTION_PATH = action_loader.find_plugin('lint')
+
+if LINT_ACTION_PATH and os.path.dirname(LINT_ACTION_PATH) not in sys.path:
+  sys.path.insert(0, os.path.dirname(LINT_ACTION_PATH))
+
+# pylint: disable=wrong-import-position
+from lint_reports import SUMMARY_CALLBACK_ENV, display_issue_group
+# pylint: enable=wrong-import-position
+
+DOCUMENTATION = '''
+    callback: lint_summary
+    type: aggregate
+    short_description: summarize the issues found by the lint action across hosts
+    description:
+      - Collects the issues that every C(lint) task found and prints them once
+        at the end of the play, listing every variable only once along with the
+        number of hosts it was found on.
+      - While enabled, C(lint) tasks no longer print the issues of every host.
+    requirements:
+      - whitelisting in configuration (C(callback_whitelist = lint_summary))
+'''
+
+class CallbackModule(CallbackBase):
+  CALLBACK_VERSION = 2.0
+  CALLBACK_TYPE = 'aggregate'
+  CALLBACK_NAME = 'lint_summary'
+  CALLBACK_NEEDS_WHITELIST = True
+
+  def __init__(self, display=None):
+    super(CallbackModule, self).__init__(display=display)
+    self._tasks = OrderedDict()
+
+    os.environ[SUMMARY_CALLBACK_ENV] = str(os.getpid())
+
+  def v2_playbook_on_play_start(self, play): # pylint: disable=unused-argument
+    self._report()
+
+  def v2_runner_on_ok(self, result):
+    self._collect(result)
+
+  def v2_runner_on_failed(self, result, ignore_errors=False): # pylint: disable=unused-argument
+    self._collect(result)
+
+  def v2_playbook_on_stats(self, stats): # pylint: disable=unused-argument
+    self._report()
+
+  # ------------------------------------------------------------------------------
+  # INTERNAL
+  # ------------------------------------------------------------------------------
+
+  # Issues are collected for every task under the following structure:
+  #
+  #     {
+  #       "name": string,
+  #       "hosts": int,
+  #       "rules": OrderedDict(int, {
+  #         "group": dict,
+  #         "paths": OrderedDict(string, int)
+  #       })
+  #     }
+  #
+  # Where "group" is the first group of issues reported for the rule (see the
+  # "grouped_issues" field of the lint action) and "paths" counts the hosts
+  # every path was reported for.
+  def _collect(self, result):
+    groups = result._result.get('grouped_issues') # pylint: disable=protected-access
+
+    if not isinstance(groups, list):
+      return
+
+    task = result._task # pylint: disable=protected-access
+    key = task._uuid # pylint: disable=protected-access
+
+    if key not in self._tasks:
+      self._tasks[key] = { 'name': task.get_name(), 'hosts': 0, 'rules': OrderedDict() }
+
+    entry = self._tasks[key]
+    entry['hosts'] += 1
+
+    for group in groups:
+      if group['rule'] not in entry['rules']:
+        entry['rules'][group['rule']] = { 'group': group, 'paths': OrderedDict() }
+
+      paths = entry['rules'][group['rule']]['paths']
+
+      for path in group['paths']:
+        paths[path] = paths.get(path, 0) + 1
+
+  def _report(self):
+    for entry in self._tasks.values():
+      if not entry['rules']:
+        continue
+
+      self._display.banner(u'LINT SUMMARY [{0}]'.format(entry['name']))
+
+      for rule in sorted(entry['rules']):
+        report_rule(self._display, entry['rules'][rule], entry['hosts'])
+
+    self._tasks.clear()
+
+# (Display, dict, int): None
+#
+# Print the issues of a rule like the lint action does, followed by the number
+# of hosts every one of them was found on. The hint comes rendered by the
+# action.
+def report_rule(display, rule, host_count):
+  group = rule['group']
+
+  display_issue_group(
+    display=display,
+    rule_number=group['rule'],
+    banner=group['banner'],
+    banner_color=group['banner_color'],
+    item_lines=[
+      u'{0} ({1:,} of {2:,} hosts)'.format(path, rule['paths'][path], host_count)
+      for path in sorted(rule['paths'])
+    ],
+    hint_text=group['hint_text'],
+    max_items=group['max_items']
+  )
@@ -32,15 +32,89 @@ options:
       - A custom pool of variables to operate on as opposed to the pool
         all defined variables.
       - List of dicts.
+  fail_fast:
+    description:
+      - Stop at the first issue that fails the task. Only C(required) and
+        C(invalid) rules are evaluated; C(deprecated) and C(suspicious) rules
+        are skipped.
+      - The rules that were not evaluated are listed in C(unevaluated_rules).
+    type: bool
+    default: False
+  stats:
+    description:
+      - Report how long each phase of the task took and, for every rule that
+        was evaluated, the work it took in C(stats).
+    type: bool
+    default: False
+  workers:
+    description:
+      - Number of processes to evaluate the rules with. The items selected by
+        every rule are split among a pool of that many processes, which are
+        sent only the items and the variables the rule's conditions read.
+      - Rules whose conditions call functions (such as lookups) or that involve
+        templated values are evaluated by the task's own process, and so are
+        rules that select no more than 1024 items; no pool is started unless
+        a rule selects more.
+      - Only worthwhile for pools with a very large number of variables. Has
+        no effect when C(fail_fast) is set.
+    type: int
+    default: 0
+  cache_dir:
+    description:
+      - Directory to keep the results of the rules in, with a file for every
+        result, so that they are shared by every host and run.
+      - A rule is evaluated again only if no host was linted before with the
+        same definition of the rule, the same variables it selects or reads
+        and the same version of this module.
+      - Without it, results are only reused within a process; ansible-playbook
+        runs the task of every host in a process of its own, so that is within
+        a host (e.g. for tasks that loop) or by the C(check) command.
+    type: path
+  max_items_per_rule:
+    description:
+      - Most issues to print for every rule; those beyond are summarized in a
+        count. All of them are still listed in C(issues).
+      - C(0) prints every issue.
+    type: int
+    default: 0
+  report_file:
+    description:
+      - File to write the issues to as every rule is evaluated, instead of
+        listing them in C(issues); the result only counts them.
+      - Every host of the task may report to the same file. The issues written
+        by earlier runs of the task are discarded, so use a file for every task
+        that reports issues.
+    type: path
+  report_format:
+    description:
+      - Format of C(report_file); one JSON object per issue, with the number of
+        the rule, its state, the path, host, hint and the run of the task it
+        was found by, or a SARIF 2.1.0 log.
+    type: str
+    choices: [ jsonl, sarif ]
+    default: jsonl
   rules_file:
     description:
       - YAML file containing the rules to use.
-      - Required if C(rules) is not set.
+      - The file is read and parsed once per process for every set of values
+        of the variables it references; ansible-playbook runs the task of
+        every host in a process of its own, so every host parses it again.
+        Prefer C(rules_bundle) for large rules files.
+      - Required if neither C(rules) nor C(rules_bundle) is set.
+    type: path
+  rules_bundle:
+    description:
+      - Rules bundle (a rules file compiled ahead of time) containing the rules
+        to use. Loading a bundle involves no templating nor validation.
+      - Bundles are produced by running the action plugin as a script, e.g.
+        C(python action_plugins/lint.py compile rules.yml rules.json). The rules
+        file may not use templating.
+      - Required if neither C(rules) nor C(rules_file) is set.
     type: path
   rules:
     description:
       - The rules to use for validating the variables.
-      - Required if C(rules_rules) is not set.
+      - Required if neither C(rules_file) nor C(rules_bundle) is set.
     type: list
     suboptions:
       state:
@@ -92,6 +166,34 @@ options:
             or "item != ''" instead of the "defined()" test.
           - Required when I(state=invalid)
           - Required when I(state=suspicious)
+      memoize:
+        description:
+          - Whether the results of evaluating C(when) may be reused for items
+            that have the same value and captures.
+          - Results are reused within a process; ansible-playbook runs the
+            task of every host in a process of its own, so that is across the
+            items of one host, while the C(check) command reuses them across
+            the hosts it lints in a process.
+          - Other variables the condition reads are accounted for, but their
+            values have to be hashed for every evaluation; turn this off for
+            conditions that read large variables or ones with values that
+            change in ways the module can not see.
+        type: bool
+        default: True
+      include_keys:
+        description:
+          - Keys that the "*" glob expressions of C(path) may expand to; other
+            branches are skipped without being looked up or tested by C(when).
+          - Either a list of keys, or the name of a variable that holds a dict
+            (whose keys are used) or a list.
+          - A string is always the name of a variable; a single key must be
+            given as a list, e.g. C([ port ]).
+        type: raw
+      exclude_keys:
+        description:
+          - Keys that the "*" glob expressions of C(path) must not expand to.
+            Accepts the same values as C(include_keys).
+        type: raw
 
 
 author:
@@ -134,6 +236,35 @@ EXAMPLES = '''
         banner: 'The following properties are not recognized:'
         hint: 'please check for typos'
 
+- name: warn about user settings that are not known
+  lint:
+    rules:
+      - state: suspicious
+        path: '*'
+        include_keys: user_settings
+        exclude_keys: default_settings
+        when: true
+        hint: 'please check for typos'
+
+- name: validate configuration using a precompiled rules bundle
+  lint:
+    rules_bundle: lint-rules.json
+
+- name: re-evaluate only the rules whose variables have changed since the last run
+  lint:
+    rules_file: lint-rules.yml
+    cache_dir: ~/.ansible/lint_cache
+
+- name: write the issues of every host to a single file
+  lint:
+    rules_file: lint-rules.yml
+    report_file: /tmp/lint-issues.jsonl
+
+- name: fail as soon as a variable is found to be missing or invalid
+  lint:
+    rules_file: lint-rules.yml
+    fail_fast: yes
+
 - name: load user settings
   include_vars:
     file: user_settings.yml
@@ -153,7 +284,75 @@ EXAMPLES = '''
 RETURN = '''
 issues:
   description: The issues detected in the variables
-  returned: always
+  returned: unless report_file is set
   type: list
   sample: [{ "path": "foo", "type": "deprecated" }]
+issue_count:
+  description: The number of issues written to the report file
+  returned: when report_file is set
+  type: int
+  sample: 4812
+grouped_issues:
+  description: The issues of every rule, along with how the rule displays them,
+    for the lint_summary callback plugin to print
+  returned: when the lint_summary callback plugin is loaded
+  type: list
+  sample:
+    - rule: 1
+      state: deprecated
+      banner: 'The following variables have been deprecated:'
+      banner_color: bright purple
+      hint: use 'bar' instead of 'foo'!
+      hint_wrap: true
+      hint_text: "      HINT: use 'bar' instead of 'foo'!"
+      max_items: 0
+      paths: [ foo ]
+report_file:
+  description: The file the issues were written to
+  returned: when report_file is set
+  type: str
+  sample: /tmp/lint-issues.jsonl
+rule_count:
+  description: The number of rules that were loaded
+  returned: always
+  type: int
+  sample: 12
+cache:
+  description: How many rules had their result looked up from the results of
+    previous evaluations in the process or in cache_dir (hits), had to be
+    evaluated (misses) or could not be cached at all, for instance because
+    they select from templated variables
+  returned: always
+  type: dict
+  sample: { "hits": 10, "misses": 1, "uncacheable": 1 }
+unevaluated_rules:
+  description: The numbers of the rules (as displayed) that were skipped in fail_fast mode
+  returned: always
+  type: list
+  sample: [1, 4]
+stats:
+  description: Timings (in seconds) and counters to diagnose slow tasks
+  returned: when stats is enabled
+  type: complex
+  contains:
+    totals:
+      description: The time spent validating the arguments, loading the rules,
+        collecting the pool, scheduling and evaluating the rules
+      type: dict
+      sample: { "validation": 0.001, "loading": 0.02, "pool": 0.0, "scheduling": 0.001, "evaluation": 0.3 }
+    rules:
+      description: The work done for every rule that was evaluated
+      type: list
+      sample:
+        - rule: 1
+          state: invalid
+          path: services.*.port
+          time: 0.12
+          leaves: 40
+          evaluations: 12
+          memo_hits: 28
+          memo_misses: 12
+          cache: misses
+          shards: 0
+          issues: 1
 '''
@@ -0,0 +1,77 @@
+import os
+
+from ansible import constants as C
+from lint import main
+from lint_check import WORKER_CONTEXT, check_host
+from test_utils import create_action_module
+
+def create_inventory(tmpdir):
+  tmpdir.join('inventory').write('[web]\nw1\nw2\n\n[db]\nd1\n')
+  tmpdir.mkdir('group_vars').join('web.yml').write('port: 80\n')
+  tmpdir.mkdir('host_vars').join('w2.yml').write("port: 8080\naddress: '{{ inventory_hostname }}.local'\n")
+  tmpdir.join('rules.yml').write('\n'.join([
+    '- state: invalid',
+    '  path: port',
+    '  when: item | int < 1024',
+    '- state: required',
+    '  path: address',
+  ]))
+
+  return [
+    'check',
+    '-i', str(tmpdir.join('inventory')),
+    '--playbook-dir', str(tmpdir),
+    '--rules-file', str(tmpdir.join('rules.yml')),
+  ]
+
+def test_check_exit_status(tmpdir):
+  argv = create_inventory(tmpdir)
+
+  assert main(argv + [ '--forks', '1' ]) == 1
+  assert main(argv + [ '--forks', '2' ]) == 1
+  assert main(argv + [ '--forks', '1', '--limit', 'w2' ]) == 0
+  assert main(argv + [ '--forks', '1', '--limit', 'w2', '-e', 'port=22' ]) == 1
+
+def test_check_matches_the_action(tmpdir):
+  argv = create_inventory(tmpdir)
+
+  assert main(argv + [ '--forks', '1', '--limit', 'nothing' ]) == 0
+
+  for host_name in [ 'w1', 'w2', 'd1' ]:
+    _, result, _ = check_host(host_name)
+
+    context = WORKER_CONTEXT['check']
+    task_vars = context['variable_manager'].get_vars(host=context['inventory'].get_host(host_name))
+    expected = create_action_module('lint', dict(context['args']), task_vars).run(None, task_vars=task_vars)
+
+    assert result['issues'] == expected['issues']
+    assert result['failed'] == expected['failed']
+
+def test_check_report_file_holds_every_host(tmpdir):
+  import json
+
+  argv = create_inventory(tmpdir)
+  report_file = tmpdir.join('issues.jsonl')
+
+  for _ in range(2):
+    assert main(argv + [ '--forks', '2', '--report-file', str(report_file) ]) == 1
+
+  records = [ json.loads(x) for x in report_file.readlines() ]
+
+  assert sorted((x['host'], x['path']) for x in records) == [
+    ('d1', 'address'), ('d1', 'port'), ('w1', 'address'), ('w1', 'port')
+  ]
+
+def test_check_ignores_the_summary_callback(tmpdir, monkeypatch):
+  monkeypatch.setattr(C, 'DEFAULT_CALLBACK_WHITELIST', [ 'lint_summary' ])
+  monkeypatch.setenv('ANSIBLE_LINT_SUMMARY_CALLBACK_PID', str(os.getpid()))
+
+  argv = create_inventory(tmpdir)
+
+  assert main(argv + [ '--forks', '1', '--limit', 'nothing' ]) == 0
+
+  _, result, output = check_host('w1')
+
+  assert 'grouped_issues' not in result
+  assert '[R:1] ' in '\n'.join(output.screen)
+  assert '[R:2] ' in '\n'.join(output.log)
@@ -0,0 +1,51 @@
+import json
+import os
+import subprocess
+import sys
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'library', 'action_plugins')
+
+# Seconds the plugin may take to import, once Ansible has loaded what it loads
+# before any action plugin. Generous so that slow machines do not fail it; a
+# dependency that is imported eagerly by mistake is caught by
+# test_import_is_lazy below rather than by the time.
+IMPORT_TIME_BUDGET = 0.25
+
+MEASURE_IMPORT = '''
+import json
+import sys
+from timeit import default_timer as timer
+
+import ansible.plugins.action
+
+started_at = timer()
+
+import lint
+
+print(json.dumps({
+  'time': timer() - started_at,
+  'modules': sorted(sys.modules),
+}))
+'''
+
+def measure_import():
+  output = subprocess.check_output([ sys.executable, '-c', MEASURE_IMPORT ], cwd=PLUGIN_DIR)
+
+  return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+def test_import_time():
+  assert min(measure_import()['time'] for _ in range(3)) < IMPORT_TIME_BUDGET
+
+# Only what neither Ansible nor the plugin needs up front is deferred: the
+# modules the check command and the compilation of conditions use.
+def test_import_is_lazy():
+  modules = measure_import()['modules']
+
+  for name in [
+    'argparse',
+    'ansible.inventory.manager',
+    'ansible.playbook',
+    'ansible.vars.manager',
+    'jinja2.meta',
+  ]:
+    assert name not in modules
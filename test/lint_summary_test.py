@@ -0,0 +1,97 @@
+import os
+import pytest
+
+from lint_reports import is_summary_callback_enabled
+from lint_summary import CallbackModule
+from test_utils import RecordingDisplay
+
+@pytest.fixture(autouse=True)
+def callback_env(monkeypatch):
+  # loading the callback flags it in the environment of the process, which is
+  # restored once the test is over
+  monkeypatch.setenv('ANSIBLE_LINT_SUMMARY_CALLBACK_PID', '')
+  monkeypatch.delenv('ANSIBLE_LINT_SUMMARY_CALLBACK_PID')
+
+class FakeHost():
+  def __init__(self, name):
+    self.name = name
+
+  def get_name(self):
+    return self.name
+
+class FakeTask():
+  def __init__(self, uuid, name):
+    self._uuid = uuid
+    self.name = name
+
+  def get_name(self):
+    return self.name
+
+class FakeResult():
+  def __init__(self, host, task, result):
+    self._host = FakeHost(host)
+    self._task = task
+    self._result = result
+
+def create_group(rule, paths, **kwargs):
+  return dict({
+    'rule': rule,
+    'state': 'deprecated',
+    'banner': 'The following variables are deprecated:',
+    'banner_color': 'bright purple',
+    'hint': None,
+    'hint_wrap': True,
+    'hint_text': None,
+    'max_items': 0,
+    'paths': paths,
+  }, **kwargs)
+
+def test_lint_summary_groups_issues_across_hosts():
+  display = RecordingDisplay()
+  callback = CallbackModule(display=display)
+  task = FakeTask('1', 'lint')
+
+  callback.v2_runner_on_ok(FakeResult('a', task, { 'grouped_issues': [ create_group(1, [ 'foo', 'bar' ]) ] }))
+  callback.v2_runner_on_failed(FakeResult('b', task, { 'grouped_issues': [ create_group(1, [ 'foo' ]) ] }))
+  callback.v2_runner_on_ok(FakeResult('c', task, { 'grouped_issues': [] }))
+  callback.v2_runner_on_ok(FakeResult('c', FakeTask('2', 'debug'), { 'msg': 'hi' }))
+
+  assert display.messages == []
+
+  callback.v2_playbook_on_stats(None)
+
+  assert display.banners == [ 'LINT SUMMARY [lint]' ]
+  assert len(display.messages) == 1
+  assert '[R:1] ' in display.messages[0]
+  assert 'bar (1 of 3 hosts)' in display.messages[0]
+  assert 'foo (2 of 3 hosts)' in display.messages[0]
+  assert display.log == [ '[R:1] The following variables are deprecated:\n\n        - bar (1 of 3 hosts)\n        - foo (2 of 3 hosts)' ]
+
+  callback.v2_playbook_on_stats(None)
+
+  assert len(display.messages) == 1
+
+def test_lint_summary_max_items():
+  display = RecordingDisplay()
+  callback = CallbackModule(display=display)
+  task = FakeTask('1', 'lint')
+
+  callback.v2_runner_on_ok(FakeResult('a', task, {
+    'grouped_issues': [ create_group(2, [ 'a', 'b', 'c' ], max_items=1, hint='Remove them.', hint_text='      HINT: Remove them.') ]
+  }))
+
+  callback.v2_playbook_on_play_start(None)
+
+  assert '[R:2] ' in display.messages[0]
+  assert 'a (1 of 1 hosts)' in display.messages[0]
+  assert 'b (1 of 1 hosts)' not in display.messages[0]
+  assert u'\u2026 and 2 more' in display.messages[0]
+  assert 'HINT: Remove them.' in display.messages[0]
+
+def test_lint_summary_signals_that_it_is_loaded():
+  assert not is_summary_callback_enabled()
+
+  CallbackModule(display=RecordingDisplay())
+
+  assert os.environ['ANSIBLE_LINT_SUMMARY_CALLBACK_PID'] == str(os.getpid())
+  assert is_summary_callback_enabled()
@@ -1,5 +1,11 @@
+import json
+import os
+import pytest
+from ansible import constants as C
+from ansible.errors import AnsibleActionFail
 from lint import ActionModule as LintActionModule
-from test_utils import NullDisplay, create_action_module
+from lint_query import PLUGIN_CHECKSUMS, RULE_RESULTS
+from test_utils import NullDisplay, RecordingDisplay, create_action_module
 
 from ansible.playbook.task import Task
 from ansible.playbook.play_context import PlayContext
@@ -42,6 +48,31 @@ def test_pool():
   assert not result['failed']
   assert len(result['issues']) == 2
 
+def test_pool_precedence():
+  result = run(
+    args={
+      "rules": [
+        {
+          "state": u"invalid",
+          "path": u"*",
+          "when": u"item == 1",
+        }
+      ],
+      "pool": [
+        {
+          "foo": 1,
+          "bar": 1
+        },
+        {
+          "foo": 2
+        },
+      ]
+    },
+    task_vars={}
+  )
+
+  assert result['issues'] == [{ 'type': u'invalid', 'path': u'bar' }]
+
 def test_lint_deprecated():
   result = run(
     args={
@@ -306,4 +337,601 @@ def test_lint_validation_rules():
   )
 
   assert result['failed']
-  assert result['msg'] == 'one of the following is required: rules_file, rules found in lint'
+  assert result['msg'] == 'one of the following is required: rules_file, rules, rules_bundle found in lint'
+
+def test_lint_result_cache():
+  args = {
+    "rules": [
+      {
+        "state": u"invalid",
+        "path": u"cached_apps.*.port",
+        "when": u"item not in allowed_ports",
+      },
+      {
+        "state": u"suspicious",
+        "path": u"*",
+        "when": u"captures[0] == 'cached_appz'",
+      }
+    ]
+  }
+
+  task_vars = {
+    "allowed_ports": [ 80 ],
+    "cached_apps": {
+      "a": { "port": 80 },
+      "b": { "port": 81 },
+    }
+  }
+
+  first = run(args=args, task_vars=task_vars)
+  second = run(args=args, task_vars=task_vars)
+
+  assert first['issues'] == [{ 'type': u'invalid', 'path': u'cached_apps.b.port' }]
+  assert second['issues'] == first['issues']
+  assert second['cache'] == { 'hits': 1, 'misses': 0, 'uncacheable': 1 }
+
+  task_vars['allowed_ports'] = [ 81 ]
+  third = run(args=args, task_vars=task_vars)
+
+  assert third['issues'] == [{ 'type': u'invalid', 'path': u'cached_apps.a.port' }]
+  assert third['cache'] == { 'hits': 0, 'misses': 1, 'uncacheable': 1 }
+
+  task_vars['cached_apps']['b']['port'] = u'{{ 80 }}'
+  fourth = run(args=args, task_vars=task_vars)
+
+  assert fourth['cache'] == { 'hits': 0, 'misses': 0, 'uncacheable': 2 }
+
+def test_lint_result_cache_skips_filters_not_known_to_be_pure():
+  args = {
+    "rules": [
+      { "state": u"invalid", "path": u"filtered_apps.*.port", "when": u"item | int > 80" },
+      { "state": u"invalid", "path": u"filtered_apps.*.port", "when": u"(item | string | password_hash('sha512')) == ''" },
+      { "state": u"invalid", "path": u"filtered_apps.*.port", "when": u"(item | to_uuid) == ''" },
+    ]
+  }
+
+  task_vars = { "filtered_apps": { "a": { "port": 80 }, "b": { "port": 81 } } }
+
+  run(args=args, task_vars=task_vars)
+  result = run(args=args, task_vars=task_vars)
+
+  assert result['issues'] == [{ 'type': u'invalid', 'path': u'filtered_apps.b.port' }]
+  assert result['cache'] == { 'hits': 1, 'misses': 0, 'uncacheable': 2 }
+
+def test_lint_result_cache_hashes_shared_inputs_once(monkeypatch):
+  import lint_variables
+
+  args = {
+    "rules": [
+      { "state": u"invalid", "path": u"hashed_apps.*.port", "when": u"item > limit" },
+      { "state": u"invalid", "path": u"hashed_apps.*.port", "when": u"item == banned" },
+      { "state": u"required", "path": u"hashed_apps.*.name" },
+    ]
+  }
+
+  task_vars = {
+    "limit": 1024,
+    "banned": u"x",
+    "hashed_apps": { x: { "name": x, "port": 80 } for x in [ u"a", u"b", u"c" ] },
+  }
+
+  run(args=args, task_vars=task_vars)
+
+  checked = []
+  is_plain_value = lint_variables.is_plain_value
+
+  def spy(templar, value):
+    checked.append(value)
+    return is_plain_value(templar, value)
+
+  monkeypatch.setattr(lint_variables, 'is_plain_value', spy)
+
+  result = run(args=args, task_vars=task_vars)
+
+  assert result['cache'] == { 'hits': 3, 'misses': 0, 'uncacheable': 0 }
+  # every key and value of the selected subtree once, then the dependency
+  assert sorted(checked) == sorted([ u"a", u"b", u"c", u"x" ] + [ u"name", u"port" ] * 3 + [ u"a", u"b", u"c" ])
+
+def test_lint_fail_fast():
+  args = {
+    "fail_fast": True,
+    "rules": [
+      {
+        "state": u"deprecated",
+        "path": u"ff_apps",
+      },
+      {
+        "state": u"invalid",
+        "path": u"ff_apps.*.port",
+        "when": u"item > 1024",
+      },
+      {
+        "state": u"required",
+        "path": u"ff_apps.*.address",
+      },
+      {
+        "state": u"invalid",
+        "path": u"ff_apps.*.port",
+        "when": u"item < 1024",
+      },
+    ]
+  }
+
+  task_vars = {
+    "ff_apps": {
+      "a": { "port": 80 },
+      "b": { "port": 81 },
+    }
+  }
+
+  result = run(args=args, task_vars=task_vars)
+
+  assert result['failed']
+  assert result['issues'] == [{ 'type': u'required', 'path': u'ff_apps.a.address' }]
+  assert result['unevaluated_rules'] == [ 1, 4 ]
+
+  task_vars['ff_apps']['a']['address'] = u'127.0.0.1'
+  task_vars['ff_apps']['b']['address'] = u'127.0.0.1'
+
+  result = run(args=args, task_vars=task_vars)
+
+  assert result['failed']
+  assert result['issues'] == [{ 'type': u'invalid', 'path': u'ff_apps.a.port' }]
+  assert result['unevaluated_rules'] == [ 1 ]
+
+  args['fail_fast'] = False
+  result = run(args=args, task_vars=task_vars)
+
+  assert len(result['issues']) == 3
+  assert result['unevaluated_rules'] == []
+
+def test_lint_rule_scheduling():
+  args = {
+    "fail_fast": True,
+    "rules": [
+      {
+        "state": u"invalid",
+        "path": u"sched_apps.*.port",
+        "when": u"item == 80",
+      },
+      {
+        "state": u"suspicious",
+        "path": u"sched_apps",
+        "when": u"item != ''",
+      },
+      {
+        "state": u"invalid",
+        "path": u"sched_apps.*.port",
+        "when": u"item != 80",
+      },
+    ]
+  }
+
+  task_vars = {
+    "sched_apps": {
+      "a": { "port": 80 },
+      "b": { "port": 81 },
+    }
+  }
+
+  # the first and third rule cost the same, so they run in declaration order,
+  # every time
+  for _ in range(2):
+    result = run(args=args, task_vars=task_vars)
+
+    assert result['issues'] == [{ 'type': u'invalid', 'path': u'sched_apps.a.port' }]
+    assert result['unevaluated_rules'] == [ 2, 3 ]
+
+  # a larger condition makes the first rule more expensive than the third
+  args['rules'][0]['when'] = u"item == 80 and item > 0 and item < 65536"
+
+  result = run(args=args, task_vars=task_vars)
+
+  assert result['issues'] == [{ 'type': u'invalid', 'path': u'sched_apps.b.port' }]
+  assert result['unevaluated_rules'] == [ 1, 2 ]
+
+  # output is in the order of the rules regardless of the order they ran in
+  args['fail_fast'] = False
+  result = run(args=args, task_vars=task_vars)
+
+  assert result['issues'] == [
+    { 'type': u'suspicious', 'path': u'sched_apps' },
+    { 'type': u'invalid', 'path': u'sched_apps.a.port' },
+    { 'type': u'invalid', 'path': u'sched_apps.b.port' },
+  ]
+
+def test_lint_stats():
+  args = {
+    "stats": True,
+    "rules": [
+      {
+        "state": u"invalid",
+        "path": u"stats_apps.*.port",
+        "when": u"item is not number or item < 1024",
+        "memoize": False,
+      },
+      {
+        "state": u"required",
+        "path": u"stats_apps.*.address",
+      },
+    ]
+  }
+
+  task_vars = {
+    "stats_apps": {
+      "a": { "port": 80, "address": u"127.0.0.1" },
+      "b": { "port": 8080 },
+      "c": { "port": 8081 },
+    }
+  }
+
+  result = run(args=args, task_vars=task_vars)
+
+  assert sorted(result['stats']['totals'].keys()) == [
+    'evaluation', 'loading', 'pool', 'scheduling', 'validation'
+  ]
+
+  invalid, required = result['stats']['rules']
+
+  assert invalid['rule'] == 1
+  assert invalid['leaves'] == 3
+  assert invalid['evaluations'] == 3
+  assert invalid['issues'] == 1
+  assert invalid['cache'] == 'misses'
+  assert required['rule'] == 2
+  assert required['issues'] == 2
+  assert required['time'] >= 0
+
+  args['stats'] = False
+
+  assert 'stats' not in run(args=args, task_vars=task_vars)
+
+def test_lint_workers(monkeypatch):
+  monkeypatch.setattr(LintActionModule, 'SHARD_SIZE', 2)
+
+  args = {
+    "stats": True,
+    "rules": [
+      {
+        "state": u"invalid",
+        "path": u"workers_apps.*.port",
+        "when": u"item not in allowed_ports",
+        "memoize": False,
+      },
+      {
+        "state": u"invalid",
+        "path": u"workers_apps.*.port",
+        "when": u"item != lookup('env', 'WORKERS_PORT') | int",
+      },
+      {
+        "state": u"required",
+        "path": u"workers_apps.*.address",
+      },
+    ]
+  }
+
+  task_vars = {
+    "allowed_ports": [ 80, 443 ],
+    "ansible_host": u"10.0.0.1",
+    "workers_apps": {
+      "a": { "port": 80, "address": u"127.0.0.1" },
+      "b": { "port": 81 },
+      "c": { "port": 443 },
+      "d": { "port": 8080, "address": u"{{ ansible_host }}" },
+      "e": { "port": 8443 },
+    }
+  }
+
+  monkeypatch.setenv('WORKERS_PORT', '80')
+
+  expected = run(args=args, task_vars=task_vars)
+
+  RULE_RESULTS.clear()
+  args['workers'] = 2
+  result = run(args=args, task_vars=task_vars)
+
+  assert result['issues'] == expected['issues']
+  assert len(result['issues']) == 10
+  # the second rule calls a lookup and the third selects a template, so they
+  # are evaluated in-process
+  assert [ x['shards'] for x in result['stats']['rules'] ] == [ 2, 0, 0 ]
+  assert [ x['evaluations'] for x in result['stats']['rules'] ] == [ 5, 5, 5 ]
+
+  # selections that fit in a single shard are evaluated without a pool
+  monkeypatch.setattr(LintActionModule, 'SHARD_SIZE', 5)
+  monkeypatch.setattr('multiprocessing.Pool', None)
+  RULE_RESULTS.clear()
+  result = run(args=args, task_vars=task_vars)
+
+  assert result['issues'] == expected['issues']
+  assert [ x['shards'] for x in result['stats']['rules'] ] == [ 0, 0, 0 ]
+
+def test_lint_result_store(tmpdir, monkeypatch):
+  args = {
+    "cache_dir": str(tmpdir.join('lint')),
+    "rules": [
+      {
+        "state": u"invalid",
+        "path": u"stored_ports.*",
+        "when": u"item < 1024",
+      },
+      {
+        "state": u"required",
+        "path": u"stored_apps.*.address",
+      },
+    ]
+  }
+
+  task_vars = {
+    "inventory_hostname": u"web-1",
+    "stored_ports": { "a": 80, "b": 8080 },
+    "stored_apps": { "a": {}, "b": {} },
+  }
+
+  first = run(args=args, task_vars=task_vars)
+
+  assert first['cache'] == { 'hits': 0, 'misses': 2, 'uncacheable': 0 }
+  assert len(tmpdir.join('lint').listdir()) == 2
+
+  # as would another host, whose task runs in a process of its own
+  RULE_RESULTS.clear()
+  task_vars['inventory_hostname'] = u'web-2'
+  second = run(args=args, task_vars=task_vars)
+
+  assert second['cache'] == { 'hits': 2, 'misses': 0, 'uncacheable': 0 }
+  assert second['issues'] == first['issues']
+
+  RULE_RESULTS.clear()
+  task_vars['stored_apps']['b']['address'] = u'127.0.0.1'
+  third = run(args=args, task_vars=task_vars)
+
+  assert third['cache'] == { 'hits': 1, 'misses': 1, 'uncacheable': 0 }
+  assert third['issues'] == [
+    { 'type': u'required', 'path': u'stored_apps.a.address' },
+    { 'type': u'invalid', 'path': u'stored_ports.a' },
+  ]
+
+  # results recorded by another version of the plugin are disregarded
+  RULE_RESULTS.clear()
+  monkeypatch.setattr('lint_query.PLUGIN_CHECKSUMS', dict((k, 'other') for k in PLUGIN_CHECKSUMS))
+  fourth = run(args=args, task_vars=task_vars)
+
+  assert fourth['cache'] == { 'hits': 0, 'misses': 2, 'uncacheable': 0 }
+
+def test_lint_result_store_prunes_results_used_least_recently(tmpdir, monkeypatch):
+  import lint_query
+
+  monkeypatch.setattr(lint_query.ResultStore, 'MAX_ENTRIES', 2)
+
+  args = { "cache_dir": str(tmpdir), "rules": [ { "state": u"required", "path": u"pruned_app" } ] }
+
+  for value in [ 1, 2, 3 ]:
+    RULE_RESULTS.clear()
+    run(args=args, task_vars={ "pruned_app": value })
+
+  assert len(tmpdir.listdir()) == 2
+
+  RULE_RESULTS.clear()
+
+  assert run(args=args, task_vars={ "pruned_app": 1 })['cache']['misses'] == 1
+
+def test_lint_max_items_per_rule():
+  args = {
+    "max_items_per_rule": 2,
+    "rules": [
+      { "state": u"required", "path": u"summarized_apps.*.port", "hint": u"Set a port." },
+    ]
+  }
+
+  task_vars = {
+    "summarized_apps": { x: {} for x in [ 'a', 'b', 'c', 'd', 'e' ] }
+  }
+
+  display = RecordingDisplay()
+  module = create_action_module('lint', args, task_vars)
+  module.use_display(display)
+  result = module.run(None, task_vars=task_vars)
+
+  assert len(result['issues']) == 5
+  assert len(display.messages) == 1
+  assert 'summarized_apps.a.port' in display.messages[0]
+  assert 'summarized_apps.b.port' in display.messages[0]
+  assert 'summarized_apps.c.port' not in display.messages[0]
+  assert u'\u2026 and 3 more' in display.messages[0]
+  assert 'HINT: Set a port.' in display.messages[0]
+  # the log file gets the same text without colors
+  assert len(display.log) == 1
+  assert 'summarized_apps.a.port' in display.log[0]
+  assert '\x1b' not in display.log[0]
+
+def report(run_id, args, task_vars):
+  module = create_action_module('lint', args, task_vars)
+  module.use_run_id(run_id)
+
+  return module.run(None, task_vars=task_vars)
+
+def test_lint_report_file(tmpdir):
+  rules = [
+    { "state": u"invalid", "path": u"reported_ports.*", "when": u"item < 1024", "hint": u"Use a higher port." },
+    { "state": u"suspicious", "path": u"reported_ports.*", "when": u"item == 8080" },
+  ]
+
+  report_file = str(tmpdir.join('issues.jsonl'))
+  tmpdir.join('issues.jsonl').write('{"run": "previous"}\n')
+
+  for host in [ 'a', 'b' ]:
+    result = report(
+      run_id='1',
+      args={ "report_file": report_file, "rules": rules },
+      task_vars={ "inventory_hostname": host, "reported_ports": { "web": 80, "proxy": 8080 } }
+    )
+
+    assert 'issues' not in result
+    assert result['issue_count'] == 2
+    assert result['report_file'] == report_file
+    assert result['failed'] == True
+
+  with open(report_file) as f:
+    records = sorted([ json.loads(x) for x in f ], key=lambda x: (x['host'], x['rule']))
+
+  assert records == [
+    { 'rule': 1, 'state': 'invalid', 'path': 'reported_ports.web', 'host': 'a', 'hint': 'Use a higher port.', 'run': '1' },
+    { 'rule': 2, 'state': 'suspicious', 'path': 'reported_ports.proxy', 'host': 'a', 'hint': None, 'run': '1' },
+    { 'rule': 1, 'state': 'invalid', 'path': 'reported_ports.web', 'host': 'b', 'hint': 'Use a higher port.', 'run': '1' },
+    { 'rule': 2, 'state': 'suspicious', 'path': 'reported_ports.proxy', 'host': 'b', 'hint': None, 'run': '1' },
+  ]
+
+  report(
+    run_id='2',
+    args={ "report_file": report_file, "rules": rules },
+    task_vars={ "inventory_hostname": 'a', "reported_ports": { "web": 8000 } }
+  )
+
+  assert tmpdir.join('issues.jsonl').read() == ''
+
+def test_lint_report_file_is_written_as_rules_are_evaluated(tmpdir, monkeypatch):
+  import lint
+
+  report_file = tmpdir.join('issues.jsonl')
+  written = []
+  create_rule_query = lint.ActionModule._create_rule_query
+
+  def spy(self, rule, *args, **kwargs):
+    written.append((rule['path'], len(report_file.readlines())))
+    return create_rule_query(self, rule, *args, **kwargs)
+
+  monkeypatch.setattr(lint.ActionModule, '_create_rule_query', spy)
+
+  report(
+    run_id='1',
+    args={
+      "report_file": str(report_file),
+      "rules": [
+        { "state": u"suspicious", "path": u"streamed_ports.*", "when": u"item == 8080" },
+        { "state": u"required", "path": u"streamed_port" },
+      ],
+    },
+    task_vars={ "inventory_hostname": "a", "streamed_ports": { "web": 80, "proxy": 8080 } }
+  )
+
+  assert written == [ (u"streamed_port", 0), (u"streamed_ports.*", 1) ]
+
+def test_lint_report_file_sarif(tmpdir):
+  report_file = str(tmpdir.join('issues.sarif'))
+  args = {
+    "report_file": report_file,
+    "report_format": "sarif",
+    "rules": [ { "state": u"suspicious", "path": u"reported_ports.*", "when": u"item == 8080" } ],
+  }
+
+  for host in [ 'a', 'b' ]:
+    result = report(
+      run_id='1',
+      args=args,
+      task_vars={ "inventory_hostname": host, "reported_ports": { "web": 80, "proxy": 8080 } }
+    )
+
+    assert result['issue_count'] == 1
+    assert result['failed'] == False
+
+  with open(report_file) as f:
+    document = json.load(f)
+
+  assert document['version'] == '2.1.0'
+  assert document['runs'][0]['tool']['driver']['rules'][0]['id'] == 'R1'
+  assert document['runs'][0]['properties'] == { 'run': '1' }
+  assert len(document['runs'][0]['results']) == 2
+  assert document['runs'][0]['results'][0]['level'] == 'warning'
+  assert document['runs'][0]['results'][0]['locations'][0]['logicalLocations'][0]['fullyQualifiedName'] == (
+    'reported_ports.proxy'
+  )
+  assert [ x['properties'] for x in document['runs'][0]['results'] ] == [
+    { 'state': 'suspicious', 'host': 'a' },
+    { 'state': 'suspicious', 'host': 'b' },
+  ]
+
+  report(run_id='2', args=args, task_vars={ "inventory_hostname": 'a', "reported_ports": { "web": 80 } })
+
+  with open(report_file) as f:
+    document = json.load(f)
+
+  assert document['runs'][0]['properties'] == { 'run': '2' }
+  assert document['runs'][0]['results'] == []
+
+  # a file that is not a complete log is started over
+  with open(report_file, 'a') as f:
+    f.write('{')
+
+  report(run_id='2', args=args, task_vars={ "inventory_hostname": 'b', "reported_ports": { "web": 8080, "proxy": 8080 } })
+
+  with open(report_file) as f:
+    document = json.load(f)
+
+  assert [ x['properties'] for x in document['runs'][0]['results'] ] == [
+    { 'state': 'suspicious', 'host': 'b' },
+    { 'state': 'suspicious', 'host': 'b' },
+  ]
+
+def test_lint_with_summary_callback(monkeypatch):
+  monkeypatch.setenv('ANSIBLE_LINT_SUMMARY_CALLBACK_PID', str(os.getpid()))
+
+  args = {
+    "rules": [
+      { "state": u"deprecated", "path": u"summary_foo", "hint": u"Use summary_bar." },
+      { "state": u"required", "path": u"summary_bar" },
+    ]
+  }
+
+  task_vars = { "summary_foo": 1 }
+  display = RecordingDisplay()
+  module = create_action_module('lint', args, task_vars)
+  module.use_display(display)
+  result = module.run(None, task_vars=task_vars)
+
+  assert display.messages == []
+  assert [ (x['rule'], x['state'], x['paths']) for x in result['grouped_issues'] ] == [
+    (1, 'deprecated', [ 'summary_foo' ]),
+    (2, 'required', [ 'summary_bar' ]),
+  ]
+  assert result['grouped_issues'][0]['hint'] == 'Use summary_bar.'
+  assert result['grouped_issues'][0]['hint_text'] == '      HINT: Use summary_bar.'
+  assert len(result['issues']) == 2
+
+def test_lint_with_summary_callback_whitelisted_but_not_loaded(monkeypatch):
+  monkeypatch.setattr(C, 'DEFAULT_CALLBACK_WHITELIST', [ 'lint_summary' ])
+  monkeypatch.delenv('ANSIBLE_LINT_SUMMARY_CALLBACK_PID', raising=False)
+
+  args = { "rules": [ { "state": u"required", "path": u"summary_bar" } ] }
+  display = RecordingDisplay()
+  module = create_action_module('lint', args, {})
+  module.use_display(display)
+  result = module.run(None, task_vars={})
+
+  assert 'grouped_issues' not in result
+  assert len(display.messages) == 1
+  assert len(result['issues']) == 1
+
+def test_lint_key_filters():
+  base_vars = { "known": 1, "other_known": 2 }
+  user_vars = { "known": 1, "mistyped": 3 }
+  task_vars = dict(base_vars, mistyped=3, base_vars=base_vars, user_vars=user_vars)
+
+  def run_rule(**options):
+    rule = dict({ "state": u"suspicious", "path": u"*", "when": u"true" }, **options)
+
+    return [ x['path'] for x in run(args={ "rules": [ rule ] }, task_vars=task_vars)['issues'] ]
+
+  assert run_rule(include_keys=u"user_vars", exclude_keys=u"base_vars") == [ 'mistyped' ]
+  assert run_rule(include_keys=[ u"known", u"other_known" ]) == [ 'known', 'other_known' ]
+  assert run_rule(include_keys=[ u"known", u"mistyped" ], exclude_keys=[ u"known" ]) == [ 'mistyped' ]
+
+  # variables the condition could not tell apart are told apart by the filters
+  task_vars['user_vars'] = { "other_known": 2 }
+
+  assert run_rule(include_keys=u"user_vars", exclude_keys=u"base_vars") == []
+
+def test_lint_key_filters_undefined_variable():
+  with pytest.raises(AnsibleActionFail) as error:
+    run(args={ "rules": [ { "state": u"required", "path": u"*", "include_keys": u"nothing" } ] }, task_vars={})
+
+  assert 'include_keys of rule * refers to an undefined variable: nothing' in str(error.value)
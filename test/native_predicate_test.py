@@ -0,0 +1,96 @@
+import pytest
+from ansible.parsing.dataloader import DataLoader
+from ansible.template import Templar
+
+from lint_predicates import compile_predicate
+
+CASES = [
+  (u'item == ""', [ u'', u'foo', 0, None, True ]),
+  (u'item != ""', [ u'', u'foo', 0 ]),
+  (u'item not in [ "a", "b" ]', [ u'a', u'c', 1 ]),
+  (u'item in ( "a", "b" )', [ u'a', u'c' ]),
+  (u'item is match("[\\d\\.]+")', [ u'127.0.0.1', u'some.host', u'' ]),
+  (u'item is not match("[\\d\\.]+")', [ u'127.0.0.1', u'some.host' ]),
+  (u'item is search("dockerhost")', [ u'http://dockerhost:9090', u'http://lvh.me' ]),
+  (u'item is number', [ 1, 1.5, u'1', u'' ]),
+  (u'item is not number or item is lessthan(1024)', [ 80, 8080, u'http' ]),
+  (u'item is string and item|length > 0', [ u'a', u'' ]),
+  (u'captures[1] not in [ "address", "port" ]', [ u'' ]),
+  (u'captures[0] in allowed.keys() and captures[0] not in denied', [ u'' ]),
+  (u'item > 10 and item <= 20 or item == 0', [ 0, 5, 15, 25 ]),
+  (u'1 < item < 3', [ 1, 2, 3 ]),
+  (u'item % 2 == 0 and -item < item - 1', [ 2, 3, 4 ]),
+  (u'item.port == 80', [ u'', { 'port': 80 } ]),
+  (u'item is defined and not item is none', [ u'', u'foo' ]),
+  (u'true', [ u'', 1 ]),
+  (u'False', [ u'' ]),
+]
+
+CAPTURES = [
+  [ u'a', u'address' ],
+  [ u'b', u'addres' ],
+  [ u'c', u'port' ],
+]
+
+VARIABLES = {
+  'allowed': { 'a': 1, 'c': 1 },
+  'denied': [ 'c' ],
+}
+
+def evaluate_natively(expr, item, captures):
+  templar = Templar(DataLoader())
+  predicate = compile_predicate(expr, templar)
+  all_vars = dict(VARIABLES, item=item, captures=captures)
+
+  return predicate.bind_native(templar=templar)(all_vars, item, captures)
+
+def evaluate_with_jinja2(expr, item, captures):
+  loader = DataLoader()
+  templar = Templar(loader)
+  predicate = compile_predicate(expr, templar)
+  all_vars = dict(VARIABLES, item=item, captures=captures)
+
+  return predicate.bind(loader=loader, templar=templar)(all_vars)
+
+@pytest.mark.parametrize('expr,items', CASES)
+def test_native_predicate_parity(expr, items):
+  for item in items:
+    for captures in CAPTURES:
+      native = evaluate_natively(expr, item, captures)
+
+      # the native form must either agree with Jinja2 or defer to it
+      if native is not None:
+        assert native == evaluate_with_jinja2(expr, item, captures), (expr, item, captures)
+
+def test_native_predicate_coverage():
+  templar = Templar(DataLoader())
+
+  for expr, _ in CASES:
+    if '|' not in expr:
+      assert compile_predicate(expr, templar).native is not None, expr
+
+  assert compile_predicate(u'item | length > 0', templar).native is None
+  assert compile_predicate(u'item[1:] == "a"', templar).native is None
+
+  # constants read no variables, so their results can be cached
+  assert compile_predicate(u'true', templar).dependencies == frozenset()
+  assert compile_predicate(u'foo', templar).native is None
+
+def test_native_predicate_defers_to_jinja2():
+  # templated values and undefined variables are left to Jinja2
+  assert evaluate_natively(u'item == "a"', u'{{ "a" }}', []) is None
+  assert evaluate_natively(u'foo is defined', u'', []) is None
+  assert evaluate_natively(u'item == "a"', [ u'a' ], []) is None
+  assert evaluate_natively(u'captures[3] == "a"', u'', [ u'a' ]) is None
+
+def test_native_predicate_is_used(monkeypatch):
+  def fail(*_args, **_kwargs):
+    raise AssertionError('should not be called')
+
+  monkeypatch.setattr('lint_predicates.Predicate.bind_batch', lambda *_args, **_kwargs: fail)
+
+  from test_utils import create_query
+
+  result = create_query({ 'a': u'foo', 'b': u'bar' }).select('*').where('item == "foo"').commit()
+
+  assert [ x['path'] for x in result ] == [ 'a' ]
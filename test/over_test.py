@@ -1,4 +1,4 @@
-from lint import over
+from lint_variables import KeyFilter, compile_selector, over, over_all
 
 def test_over_branches():
   result = over('foo', { "foo": { "bar": 1 } })
@@ -57,3 +57,75 @@ def test_over_glob_root():
   assert len(result) == 2
   assert result[0]['path'] == 'foo'
   assert result[1]['path'] == 'bar'
+
+def test_over_all():
+  value = { "foo": { "a": { "name": "A" }, "b": 2 }, "bar": None }
+  result = over_all([ 'foo.*.name', '*', 'foo.a', 'foo.*.name', 'baz.*' ], value)
+
+  assert type(result) == list
+  assert len(result) == 5
+  assert [ x['path'] for x in result[0] ] == [ u'foo.a.name', u'foo.b.name' ]
+  assert [ x['value'] for x in result[0] ] == [ 'A', None ]
+  assert [ x['path'] for x in result[1] ] == [ u'foo', u'bar' ]
+  assert result[2] == [{ 'path': u'foo.a', 'captures': [], 'value': { "name": "A" } }]
+  assert result[3] == result[0]
+  assert result[4] == []
+
+def test_over_all_captures():
+  result = over_all([ 'foo.*.*', 'foo.*' ], { "foo": { "a": { "host": 1 } } })
+
+  assert result[0][0]['captures'] == [ 'a', 'host' ]
+  assert result[1][0]['captures'] == [ 'a' ]
+
+def test_over_strings():
+  result = over('foo.o', { "foo": "bob" })
+
+  assert len(result) == 1
+  assert result[0]['path'] == u'foo.o'
+  assert result[0]['value'] == None
+
+  result = over('foo.*.*', { "foo": { "a": "bob" } })
+
+  assert len(result) == 1
+  assert result[0]['path'] == u'foo.a.*'
+  assert result[0]['captures'] == [ u'a', u'*' ]
+  assert result[0]['value'] == None
+
+def test_compile_selector():
+  selector = compile_selector('foo.*.bar.*')
+
+  assert selector is compile_selector('foo.*.bar.*')
+  assert selector.segments == ('foo', '*', 'bar', '*')
+  assert selector.glob_positions == (1, 3)
+
+def test_over_key_filter():
+  value = { "a": { "x": 1, "y": 2 }, "b": { "x": 3 }, "c": { "x": 4 } }
+
+  result = over('*.x', value, KeyFilter(include=frozenset([ 'a', 'c' ])))
+
+  assert [ x['path'] for x in result ] == [ 'a.x', 'c.x' ]
+
+  result = over('*.*', value, KeyFilter(include=frozenset([ 'a', 'b', 'x' ]), exclude=frozenset([ 'b' ])))
+
+  assert [ x['path'] for x in result ] == [ 'a.x' ]
+
+def test_over_key_filter_does_not_expand_other_branches():
+  class Exploding(dict):
+    def __getitem__(self, key):
+      if key == 'expensive':
+        raise AssertionError('should not be looked up')
+
+      return dict.__getitem__(self, key)
+
+  value = Exploding({ "cheap": 1, "expensive": 2 })
+
+  assert [ x['path'] for x in over('*', value, KeyFilter(exclude=frozenset([ 'expensive' ]))) ] == [ 'cheap' ]
+
+def test_over_all_key_filters():
+  value = { "a": { "x": 1 }, "b": { "x": 2 } }
+  exprs = [ '*.x', '*.x', 'a' ]
+  key_filters = [ None, KeyFilter(include=frozenset([ 'b' ])), None ]
+
+  assert over_all(exprs, value, key_filters) == [
+    over(expr, value, key_filter) for expr, key_filter in zip(exprs, key_filters)
+  ]
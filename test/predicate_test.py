@@ -0,0 +1,77 @@
+import pytest
+from ansible.errors import AnsibleError
+from ansible.parsing.dataloader import DataLoader
+from ansible.template import Templar
+
+from lint_predicates import PREDICATES, compile_predicate
+from lint_variables import LRUCache
+
+def evaluate(expr, all_vars):
+  loader = DataLoader()
+  templar = Templar(loader)
+
+  return compile_predicate(expr, templar).bind(loader=loader, templar=templar)(all_vars)
+
+def test_compile_predicate_caching():
+  templar = Templar(DataLoader())
+  predicate = compile_predicate(u'item == "foo"', templar)
+
+  assert predicate is compile_predicate(u'item == "foo"', templar)
+  assert predicate.template is not None
+  assert u'item == "foo"' in PREDICATES
+
+def test_predicate_evaluation():
+  assert evaluate(u'item == "foo"', { 'item': 'foo' }) is True
+  assert evaluate(u'item == "foo"', { 'item': 'bar' }) is False
+  assert evaluate(u'captures[0] in allowed', { 'captures': [ 'a' ], 'allowed': [ 'a' ] }) is True
+  assert evaluate(u'item is match("[\\d\\.]+")', { 'item': '127.0.0.1' }) is True
+
+def test_predicate_fallback():
+  templar = Templar(DataLoader())
+
+  assert compile_predicate(u'item', templar).template is None
+  assert compile_predicate(u'{{ item }} == 1', templar).template is None
+  assert evaluate(u'item', { 'item': '1 == 1' }) is True
+  assert evaluate(u'item.foo is defined', { 'item': '' }) is False
+
+def test_predicate_errors():
+  with pytest.raises(AnsibleError) as error:
+    evaluate(u'item is match(1, 2, 3, 4)', { 'item': '' })
+
+  assert 'The conditional check' in str(error.value)
+
+def test_lru_cache():
+  cache = LRUCache(capacity=2)
+  cache.set('a', 1)
+  cache.set('b', 2)
+
+  assert cache.get('a') == 1
+
+  cache.set('c', 3)
+
+  assert len(cache) == 2
+  assert 'a' in cache
+  assert 'b' not in cache
+  assert cache.get('b') is None
+
+def test_predicate_does_not_use_conditional(monkeypatch):
+  def fail(*_args, **_kwargs):
+    raise AssertionError('should not be called')
+
+  monkeypatch.setattr('ansible.playbook.conditional.Conditional.evaluate_conditional', fail)
+
+  assert evaluate(u'item not in [ "a", "b" ]', { 'item': 'c' }) is True
+
+def test_predicate_batch_evaluation():
+  templar = Templar(DataLoader())
+  evaluate_all = compile_predicate(u'captures[0] not in allowed and item != ""', templar).bind_batch(templar=templar)
+  all_vars = { 'allowed': [ 'a' ] }
+
+  assert evaluate_all(all_vars, [ ('x', [ 'a' ]), ('x', [ 'b' ]), ('', [ 'c' ]) ]) == [ False, True, False ]
+  assert all_vars == { 'allowed': [ 'a' ] }
+
+def test_predicate_batch_evaluation_errors():
+  templar = Templar(DataLoader())
+  evaluate_all = compile_predicate(u'item is match(1, 2, 3, 4)', templar).bind_batch(templar=templar)
+
+  assert evaluate_all({}, [ ('x', []) ]) is None
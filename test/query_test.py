@@ -1,4 +1,11 @@
-from lint import Query
+import pytest
+from collections import OrderedDict
+from ansible.errors import AnsibleError
+from ansible.parsing.dataloader import DataLoader
+from ansible.template import Templar
+from ansible.vars.hostvars import HostVars
+
+from lint_query import Query
 from test_utils import create_query
 
 def test_query_where():
@@ -51,3 +58,133 @@ def test_query_invert_with_no_refinement():
   result = subject.select('*').invert().commit()
 
   assert len(result) == 0
+
+def test_query_does_not_modify_task_vars():
+  task_vars = {
+    'a': 'foo',
+    'item': 'bar'
+  }
+
+  result = create_query(task_vars).select('a').where('item == "foo"').commit()
+
+  assert len(result) == 1
+  assert task_vars == { 'a': 'foo', 'item': 'bar' }
+
+def test_query_where_reports_errors_per_item():
+  subject = create_query({
+    'a': 'foo',
+    'b': { 'c': 1 },
+  })
+
+  with pytest.raises(AnsibleError) as error:
+    subject.select('*').where('item.c > 0').commit()
+
+  assert 'The conditional check' in str(error.value)
+
+def test_query_where_memoization(monkeypatch):
+  task_vars = { 'names': { 'a': 'foo', 'b': 'quux' }, 'limit': 3 }
+  expr = 'item | length > limit'
+
+  result = create_query(task_vars).select('names.*').where(expr).commit()
+
+  assert [ x['path'] for x in result ] == [ 'names.b' ]
+
+  def fail(*_args, **_kwargs):
+    raise AssertionError('should not be called')
+
+  monkeypatch.setattr('lint_predicates.Predicate.bind_batch', lambda *_args, **_kwargs: fail)
+  monkeypatch.setattr('ansible.playbook.conditional.Conditional.evaluate_conditional', fail)
+
+  result = create_query(task_vars).select('names.*').where(expr).commit()
+
+  assert [ x['path'] for x in result ] == [ 'names.b' ]
+
+  # a change in the variables the expression reads must not hit the memo
+  task_vars['limit'] = 4
+
+  with pytest.raises(AssertionError):
+    create_query(task_vars).select('names.*').where(expr).commit()
+
+def test_query_where_without_memoization(monkeypatch):
+  task_vars = { 'a': 'foo', 'b': 'quux' }
+  expr = 'item | length > 3'
+
+  create_query(task_vars).select('*').where(expr).commit()
+
+  def fail(*_args, **_kwargs):
+    raise AssertionError('should not be called')
+
+  monkeypatch.setattr('lint_predicates.Predicate.bind_batch', lambda *_args, **_kwargs: fail)
+
+  with pytest.raises(AssertionError):
+    create_query(task_vars, memoize=False).select('*').where(expr).commit()
+
+def test_query_terminals():
+  task_vars = { 'a': 'foo', 'b': 'bar', 'c': 'foo' }
+
+  assert create_query(task_vars).select('*').where('item == "foo"').count() == 2
+  assert create_query(task_vars).select('*').where('item == "foo"').any()
+  assert not create_query(task_vars).select('*').where('item == "baz"').any()
+  assert create_query(task_vars).select('*').where('item == "baz"').first() is None
+  assert create_query(task_vars).select('a').where('item == "foo"').first()['path'] == 'a'
+
+def test_query_first_stops_early():
+  task_vars = OrderedDict([
+    ('a', { 'c': 1 }),
+    ('b', 'foo'),
+  ])
+
+  # "b" would fail to evaluate if it were ever reached
+  assert create_query(task_vars).select('*').where('item.c > 0').first()['path'] == 'a'
+
+  with pytest.raises(AnsibleError):
+    create_query(task_vars).select('*').where('item.c > 0').count()
+
+class CountingHostVars(HostVars):
+  def __init__(self, hosts):
+    self._hosts = hosts
+    self._loader = DataLoader()
+    self.reads = []
+
+  def raw_get(self, host_name):
+    self.reads.append(('raw', host_name))
+    return self._hosts[host_name]
+
+  def __getitem__(self, host_name):
+    self.reads.append(('templated', host_name))
+    return Templar(self._loader, variables=self._hosts[host_name]).template(self._hosts[host_name])
+
+  def __contains__(self, host_name):
+    return host_name in self._hosts
+
+  def __iter__(self):
+    return iter(self._hosts)
+
+  def __len__(self):
+    return len(self._hosts)
+
+def test_query_hostvars_are_resolved_lazily():
+  hostvars = CountingHostVars({
+    'web': { 'port': '{{ base_port + 1 }}', 'base_port': 8000, 'users': '{{ undefined_users }}' },
+    'db': { 'port': 5432 },
+  })
+
+  subject = create_query({ 'hostvars': hostvars })
+  result = subject.select('hostvars.*.port').where('item | int > 6000').commit()
+
+  assert [ x['path'] for x in result ] == [ 'hostvars.web.port' ]
+  assert sorted(hostvars.reads) == [ ('raw', 'db'), ('raw', 'web') ]
+
+def test_query_hostvars_selection_does_not_resolve_hosts():
+  hostvars = CountingHostVars(OrderedDict([ ('web', { 'port': 80 }), ('db', { 'port': 5432 }) ]))
+
+  subject = create_query({ 'hostvars': hostvars })
+  result = subject.select('hostvars.*').commit()
+
+  assert [ x['path'] for x in result ] == [ 'hostvars.web', 'hostvars.db' ]
+  assert hostvars.reads == []
+
+  result = create_query({ 'hostvars': hostvars }).select('hostvars.*').where('item.port > 1024').commit()
+
+  assert [ x['path'] for x in result ] == [ 'hostvars.db' ]
+  assert sorted(hostvars.reads) == [ ('templated', 'db'), ('templated', 'web') ]
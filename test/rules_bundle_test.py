@@ -0,0 +1,99 @@
+import json
+import pytest
+from ansible.errors import AnsibleActionFail, AnsibleOptionsError
+from ansible.parsing.dataloader import DataLoader
+from ansible.template import Templar
+
+from lint import main
+from lint_predicates import compile_predicate
+from lint_rules import RulesBundle, RulesBundleLoader
+from test_utils import create_action_module
+
+RULES = [
+  {
+    "state": u"required",
+    "path": u"apps.*.address",
+    "msg": u"address is required",
+  },
+  {
+    "state": u"invalid",
+    "path": u"apps.*.port",
+    "when": u"item is not number",
+  }
+]
+
+def compile_bundle(rules):
+  return RulesBundle.compile(rules=rules, environment=Templar(DataLoader()).environment)
+
+def write_bundle(tmpdir, document):
+  bundle_file = tmpdir.join('rules.json')
+  bundle_file.write(json.dumps(document))
+
+  return str(bundle_file)
+
+def run(bundle_file, task_vars):
+  args = { "rules_bundle": bundle_file }
+
+  return create_action_module('lint', args, task_vars).run(None, task_vars=task_vars)
+
+def test_rules_bundle_compile():
+  bundle = compile_bundle(RULES)
+
+  assert bundle.rules[0]['hint'] == u'address is required'
+  assert bundle.rules[0]['hint_wrap'] == True
+  assert bundle.selectors[u'apps.*.address'] == [ u'apps', u'*', u'address' ]
+  assert u'item is not number' in bundle.expressions
+  assert u'item == ""' in bundle.expressions
+  assert RULES[0].get('hint') is None
+
+def test_rules_bundle_compile_validation():
+  with pytest.raises(AnsibleOptionsError):
+    compile_bundle([{ "state": u"invalid", "path": u"foo" }])
+
+def test_rules_bundle_round_trip():
+  document = json.loads(json.dumps(compile_bundle(RULES).dump()))
+  bundle = RulesBundle.load(document, file_name='rules.json')
+  templar = Templar(DataLoader())
+
+  assert bundle.rules == compile_bundle(RULES).rules
+  assert compile_predicate(u'item is not number', templar, tree=bundle.expressions[u'item is not number']).native
+
+def test_rules_bundle_run(tmpdir):
+  bundle_file = write_bundle(tmpdir, compile_bundle(RULES).dump())
+  result = run(bundle_file, {
+    "apps": {
+      "a": { "address": u"127.0.0.1", "port": 80 },
+      "b": { "port": u"http" },
+    }
+  })
+
+  assert result['failed']
+  assert result['rule_count'] == 2
+  assert result['issues'] == [
+    { 'type': u'required', 'path': u'apps.b.address' },
+    { 'type': u'invalid', 'path': u'apps.b.port' },
+  ]
+
+def test_rules_bundle_integrity(tmpdir):
+  document = compile_bundle(RULES).dump()
+  document['body']['rules'][0]['path'] = u'foo'
+
+  with pytest.raises(AnsibleActionFail) as error:
+    RulesBundleLoader(loader=DataLoader(), find_needle=lambda _, x: x).load_file(write_bundle(tmpdir, document))
+
+  assert 'checksum mismatch' in str(error.value)
+
+  document = compile_bundle(RULES).dump()
+  document['version'] = 0
+
+  with pytest.raises(AnsibleActionFail) as error:
+    RulesBundle.load(document, file_name='rules.json')
+
+  assert 'incompatible version' in str(error.value)
+
+def test_rules_bundle_cli(tmpdir):
+  bundle_file = tmpdir.join('rules.json')
+
+  assert main([ 'compile', 'test/files/lint-rules-static.yml', str(bundle_file) ]) == 0
+  assert json.loads(bundle_file.read())['body']['rules'][0]['path'] == u'apps.*.address'
+  assert main([ 'compile', 'test/files/lint-rules-var.yml', str(bundle_file) ]) == 1
@@ -1,4 +1,5 @@
-from lint import ActionModule as LintActionModule, Query
+from lint import ActionModule as LintActionModule
+from lint_query import Query
 
 from ansible.parsing.dataloader import DataLoader
 from ansible.playbook.block import Block
@@ -12,6 +13,22 @@ class NullDisplay():
   def display(*_args, **_kwargs):
     return True
 
+# Keeps what is displayed: what goes to the screen in messages, and what goes
+# to the log file only in log.
+class RecordingDisplay():
+  verbosity = 0
+
+  def __init__(self):
+    self.banners = []
+    self.messages = []
+    self.log = []
+
+  def banner(self, msg, **_kwargs):
+    self.banners.append(msg)
+
+  def display(self, msg, log_only=False, **_kwargs):
+    (self.log if log_only else self.messages).append(msg)
+
 def create_action_module(name, args=None, task_vars=None):
   play = Play.load(dict())
   play_context = PlayContext(play=play)
@@ -29,7 +46,7 @@ def create_action_module(name, args=None, task_vars=None):
 
   return module
 
-def create_query(task_vars):
+def create_query(task_vars, **kwargs):
   loader = DataLoader()
 
   return Query(
@@ -37,4 +54,5 @@ def create_query(task_vars):
     task_vars=task_vars,
     loader=loader,
     templar=Templar(loader),
+    **kwargs
   )
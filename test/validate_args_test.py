@@ -0,0 +1,153 @@
+import copy
+
+from ansible.errors import AnsibleOptionsError
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils._text import to_native
+from lint import ActionModule
+from lint_arguments import ArgumentValidator, VALIDATED_ARGUMENTS, validate_args
+
+def validate(args):
+  VALIDATED_ARGUMENTS.clear()
+
+  return validate_args(ActionModule.ARGUMENT_SPEC, { 'lint': args })
+
+# (dict): string?
+#
+# The message AnsibleModule fails with for the same arguments, which is what
+# ArgumentValidator mimics.
+def validate_with_ansible_module(args):
+  class ReferenceModule(AnsibleModule):
+    def __init__(self, params):
+      self.params = params
+
+      super(ReferenceModule, self).__init__(
+        argument_spec=ActionModule.ARGUMENT_SPEC,
+        bypass_checks=False,
+        no_log=True,
+        check_invalid_arguments=True
+      )
+
+    def fail_json(self, **kwargs):
+      raise AnsibleOptionsError(kwargs['msg'])
+
+    def _load_params(self):
+      return self.params
+
+  try:
+    ReferenceModule({ 'lint': args })
+  except AnsibleOptionsError as e:
+    return to_native(e)
+  else:
+    return None
+
+def test_messages():
+  cases = [
+    ({}, 'one of the following is required: rules_file, rules, rules_bundle found in lint'),
+    ({ 'rules': [ { 'path': 'a' } ] }, 'missing required arguments: state found in lint -> rules'),
+    (
+      { 'rules': [ { 'state': 'x', 'path': 'a' } ] },
+      'value of state must be one of: deprecated, required, invalid, suspicious, got: x found in lint -> rules'
+    ),
+    (
+      { 'rules': [ { 'state': 'invalid', 'path': 'a' } ] },
+      'state is invalid but all of the following are missing: when found in lint -> rules'
+    ),
+    (
+      { 'rules': [ { 'state': 'required', 'path': 'a', 'bogus': 1 } ] },
+      'Unsupported parameters for (basic.py) module: bogus found in lint -> rules. Supported parameters ' +
+      'include: banner, banner_color, exclude_keys, hint, hint_wrap, include_keys, memoize, path, state, when'
+    ),
+    ({ 'rules': [ 'x' ] }, 'value of rules must be of type dict or list of dict'),
+    (
+      { 'rules': { 'state': 'required', 'path': 'a' } },
+      "argument rules is of type <class 'dict'> and we were unable to convert to list: " +
+      "<class 'dict'> cannot be converted to a list"
+    ),
+  ]
+
+  for args, message in cases:
+    assert validate(args) == message
+
+def test_messages_match_ansible_module():
+  cases = [
+    {},
+    { 'rules': [ { 'path': 'a' } ] },
+    { 'rules': [ { 'state': 'x', 'path': 'a' } ] },
+    { 'rules': [ { 'state': 'invalid', 'path': 'a' } ] },
+    { 'rules': [ { 'state': 'required', 'path': 'a', 'bogus': 1 } ] },
+    { 'rules': [ 'x' ] },
+    { 'rules': { 'state': 'required', 'path': 'a' } },
+    { 'rules': [ { 'state': 'required', 'path': 'a', 'hint_wrap': 'maybe' } ] },
+    { 'rules': [ { 'state': 'required', 'path': 'a', 'memoize': 2 } ] },
+    { 'rules': [ { 'state': 'required', 'path': 'a', 'hint_wrap': [] } ] },
+    { 'rules': [ { 'state': 'required', 'path': 'a' } ], 'fail_fast': 'maybe' },
+    { 'rules': [ { 'state': 'required', 'path': 'a' } ], 'workers': 'many' },
+    { 'rules': [ { 'state': 'required', 'path': 'a' } ], 'report_format': 'xml' },
+  ]
+
+  for args in cases:
+    assert validate(copy.deepcopy(args)) == validate_with_ansible_module(copy.deepcopy(args))
+
+def test_normalization():
+  args = {
+    'pool': 'a,b',
+    'rules': [ { 'state': 'required', 'path': 1, 'msg': 'hi', 'hint_wrap': 'no' } ]
+  }
+
+  assert validate(args) is None
+  assert args == {
+    'pool': [ 'a', 'b' ],
+    'fail_fast': False,
+    'stats': False,
+    'workers': 0,
+    'cache_dir': None,
+    'max_items_per_rule': 0,
+    'report_file': None,
+    'report_format': 'jsonl',
+    'rules_file': None,
+    'rules_bundle': None,
+    'rules': [
+      {
+        'state': 'required',
+        'path': '1',
+        'msg': 'hi',
+        'hint': 'hi',
+        'hint_wrap': False,
+        'banner': None,
+        'banner_color': None,
+        'when': None,
+        'memoize': True,
+        'include_keys': None,
+        'exclude_keys': None,
+      }
+    ]
+  }
+
+def test_cache():
+  args = { 'rules': [ { 'state': 'required', 'path': 'a', 'msg': 'hi' } ] }
+  same_args = copy.deepcopy(args)
+
+  assert validate(args) is None
+
+  calls = []
+  validate_impl = ArgumentValidator.validate
+
+  def spy(self, params):
+    calls.append(params)
+    return validate_impl(self, params)
+
+  ArgumentValidator.validate = spy
+
+  try:
+    assert validate_args(ActionModule.ARGUMENT_SPEC, { 'lint': same_args }) is None
+    assert calls == []
+    assert same_args == args
+
+    error_args = { 'rules': [ { 'path': 'a' } ] }
+
+    for _ in range(2):
+      assert validate_args(ActionModule.ARGUMENT_SPEC, { 'lint': copy.deepcopy(error_args) }) == \
+        'missing required arguments: state found in lint -> rules'
+    assert len(calls) == 1
+  finally:
+    ArgumentValidator.validate = validate_impl
@@ -0,0 +1,32 @@
+from lint_variables import VariableOverlay
+
+def test_variable_overlay_lookup():
+  a = { 'x': 1, 'y': 1 }
+  b = { 'y': 2, 'z': 2 }
+  subject = VariableOverlay(a, b)
+
+  assert subject['x'] == 1
+  assert subject['y'] == 1
+  assert subject['z'] == 2
+  assert 'z' in subject
+  assert 'w' not in subject
+  assert subject.get('w', 3) == 3
+
+def test_variable_overlay_assignment():
+  task_vars = { 'item': 'outer', 'foo': 1 }
+  subject = VariableOverlay(task_vars)
+  subject['item'] = 'inner'
+
+  assert subject['item'] == 'inner'
+  assert task_vars['item'] == 'outer'
+  assert len(subject) == 2
+
+def test_variable_overlay_iteration():
+  subject = VariableOverlay({ 'c': 3, 'a': 1 }, { 'b': 2, 'a': 0 })
+  subject['d'] = 4
+
+  # same order as { 'b': 2, 'a': 0 }.update({ 'c': 3, 'a': 1 }).update({ 'd': 4 })
+  assert list(subject) == [ 'b', 'a', 'c', 'd' ]
+  assert subject.keys() == [ 'b', 'a', 'c', 'd' ]
+  assert subject.copy() == { 'a': 1, 'b': 2, 'c': 3, 'd': 4 }
+  assert isinstance(subject, dict)
@@ -1,7 +1,8 @@
 import pytest
 from ansible.errors import *
 
-from lint import ActionModule as LintActionModule, YAMLFileLoader
+from lint import ActionModule as LintActionModule
+from lint_rules import YAMLFileLoader
 from test_utils import create_action_module
 
 def run(file, task_vars={}):
@@ -25,3 +26,31 @@ def test_yaml_file_loader_templating():
 def test_yaml_file_loader_templating_error():
   with pytest.raises(AnsibleUndefinedVariable):
     run(u"test/files/lint-rules-undefined-var.yml")
+
+def test_yaml_file_loader_caching():
+  first = run(u"test/files/lint-rules-var.yml", { 'foo': 'blah' })
+  second = run(u"test/files/lint-rules-var.yml", { 'foo': 'blah', 'bar': 1 })
+  third = run(u"test/files/lint-rules-var.yml", { 'foo': 'bleh' })
+
+  assert first is second
+  assert third is not first
+  assert third[0]['path'] == u'bleh'
+
+def test_yaml_file_loader_caching_templated_variables():
+  first = run(u"test/files/lint-rules-var.yml", { 'foo': '{{ bar }}', 'bar': 'a' })
+  second = run(u"test/files/lint-rules-var.yml", { 'foo': '{{ bar }}', 'bar': 'b' })
+
+  assert first[0]['path'] == u'a'
+  assert second[0]['path'] == u'b'
+
+def test_yaml_file_loader_caching_modified_file(tmpdir):
+  rules_file = tmpdir.join('rules.yml')
+  rules_file.write('- state: required\n  path: a\n')
+  first = run(str(rules_file))
+
+  rules_file.write('- state: required\n  path: bb\n')
+  rules_file.setmtime(rules_file.mtime() + 10)
+  second = run(str(rules_file))
+
+  assert first[0]['path'] == u'a'
+  assert second[0]['path'] == u'bb'